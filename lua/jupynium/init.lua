@@ -136,6 +136,7 @@ function M.setup(opts)
   vim.g.jupynium_autoscroll_mode = options.opts.autoscroll.mode
   vim.g.jupynium_autoscroll_focus = options.opts.autoscroll.focus
   vim.g.jupynium_autoscroll_cell_top_margin_percent = options.opts.autoscroll.cell.top_margin_percent
+  vim.g.jupynium_markdown_render_idle_timeout = options.opts.markdown_render.idle_timeout
 
   if options.opts.textobjects.use_default_keybindings then
     -- Register autocmd for setting up keymaps
@@ -28,6 +28,9 @@
 ---@field page Jupynium.Config.Scroll.Page
 ---@field cell Jupynium.Config.Scroll.Cell
 
+---@class (exact) Jupynium.Config.MarkdownRender
+---@field idle_timeout number
+
 ---@class (exact) Jupynium.Config.Textobjects
 ---@field use_default_keybindings boolean
 
@@ -58,6 +61,7 @@
 ---@field auto_close_tab boolean
 ---@field autoscroll Jupynium.Config.Autoscroll
 ---@field scroll Jupynium.Config.Scroll
+---@field markdown_render Jupynium.Config.MarkdownRender
 ---@field jupynium_file_pattern string[]
 ---@field use_default_keybindings boolean
 ---@field textobjects Jupynium.Config.Textobjects
@@ -93,6 +97,9 @@
 ---@field page Jupynium.UserConfig.Scroll.Page?
 ---@field cell Jupynium.UserConfig.Scroll.Cell?
 
+---@class Jupynium.UserConfig.MarkdownRender
+---@field idle_timeout number?
+
 ---@class Jupynium.UserConfig.Textobjects
 ---@field use_default_keybindings boolean?
 
@@ -123,6 +130,7 @@
 ---@field auto_close_tab boolean?
 ---@field autoscroll Jupynium.UserConfig.Autoscroll?
 ---@field scroll Jupynium.UserConfig.Scroll?
+---@field markdown_render Jupynium.UserConfig.MarkdownRender?
 ---@field jupynium_file_pattern string[]?
 ---@field use_default_keybindings boolean?
 ---@field textobjects Jupynium.UserConfig.Textobjects?
@@ -218,6 +226,14 @@ M.default_opts = {
     },
   },
 
+  -- Markdown cells are not rendered on every change, because it can be slow (e.g. MathJax).
+  -- They are rendered when the cursor leaves the cell,
+  -- or after `idle_timeout` seconds without changes (0 to render right away).
+  -- Related command :JupyniumRenderMarkdown
+  markdown_render = {
+    idle_timeout = 1.0,
+  },
+
   -- Files to be detected as a jupynium file.
   -- Add highlighting, keybindings, commands (e.g. :JupyniumStartAndAttachToServer)
   -- Modify this if you already have lots of files in Jupytext format, for example.
@@ -1,18 +1,40 @@
 from __future__ import annotations
 
 import logging
-from importlib.resources import files as resfiles
+from itertools import accumulate
 from typing import TYPE_CHECKING
 
-from .jupyter_notebook_selenium import insert_cell_at
+from .fenwick import FenwickTree
+from .jupyter_notebook_selenium import NotebookTransaction
+from .line_store import LineStore
+from .notebook_shadow import NotebookShadow
 
 if TYPE_CHECKING:
-    from selenium.webdriver.remote.webdriver import WebDriver
+    from .driver_protocol import Driver
 
 logger = logging.getLogger(__name__)
 
 
-set_cell_text_js_code = (resfiles("jupynium") / "js" / "set_cell_text.js").read_text()
+def _diff_lines(old_lines: list[str], new_lines: list[str]) -> tuple[int, int, int]:
+    """
+    Find the changed range by trimming the common leading and trailing lines.
+
+    Returns:
+        int: start line
+        int: end line in old_lines (exclusive)
+        int: end line in new_lines (exclusive)
+    """
+    max_common = min(len(old_lines), len(new_lines))
+    start = 0
+    while start < max_common and old_lines[start] == new_lines[start]:
+        start += 1
+    num_trailing = 0
+    while (
+        num_trailing < max_common - start
+        and old_lines[-1 - num_trailing] == new_lines[-1 - num_trailing]
+    ):
+        num_trailing += 1
+    return start, len(old_lines) - num_trailing, len(new_lines) - num_trailing
 
 
 class JupyniumBuffer:
@@ -25,24 +47,31 @@ class JupyniumBuffer:
 
     def __init__(
         self,
-        buf: list[str] | None = None,
+        buf: list[str] | LineStore | None = None,
         header_cell_type: str = "header",
     ):
         """
         self.buf is a list of lines of the nvim buffer.
 
+        It is stored as a LineStore, which behaves like a list but
+        edits cost proportional to the edit size, not the buffer size.
+
         Args:
             header_cell_type: Use only when partial update.
         """
+        # What we believe the synced notebook looks like.
+        self.shadow = NotebookShadow()
+
         if buf is None:
             # each cell's row length. 0-th cell is not a cell, but it's the header.
             # You can put anything above and it won't be synced to Jupyter Notebook.
-            self.buf = [""]
+            self.buf = LineStore([""])
             self.num_rows_per_cell: list[int] = [1]
 
             self.cell_types = ["header"]  # 0-th cell is not a cell.
+            self._row_index = FenwickTree(self.num_rows_per_cell)
         else:
-            self.buf = buf
+            self.buf = buf if isinstance(buf, LineStore) else LineStore(buf)
             self.full_analyse_buf(header_cell_type)
 
     def full_analyse_buf(self, header_cell_type: str = "header"):
@@ -88,6 +117,8 @@ class JupyniumBuffer:
 
         self.num_rows_per_cell = num_rows_per_cell
         self.cell_types = cell_types
+        # Prefix sums of num_rows_per_cell for O(log n) row <-> cell lookups.
+        self._row_index = FenwickTree(num_rows_per_cell)
 
     def _process_cell_text(self, cell_type: str, lines: list[str]):
         """
@@ -117,33 +148,24 @@ class JupyniumBuffer:
         In a markdown cell, remove the leading # from the lines or multiline string.
         e.g. '# # Markdown header' -> '# Markdown header'
         """
-        if start_cell_idx == 0:
-            start_row_offset = 0
-        else:
-            start_row_offset = 1
+        # Take the lines of all cells at once, and split them per cell.
+        range_start_row, _ = self.get_cell_row_range(start_cell_idx)
+        _, range_end_row = self.get_cell_row_range(end_cell_idx)
+        lines = self.buf.get_lines(range_start_row, range_end_row)
 
         texts_per_cell = []
-        start_row = self.get_cell_start_row(start_cell_idx)
-        texts_per_cell.append(
-            self._process_cell_text(
-                self.cell_types[start_cell_idx],
-                self.buf[
-                    start_row + start_row_offset : start_row
-                    + self.num_rows_per_cell[start_cell_idx]
-                ],
-            )
-        )
-
-        for cell_idx in range(start_cell_idx + 1, end_cell_idx + 1):
-            start_row += self.num_rows_per_cell[cell_idx - 1]
+        start_row = 0
+        for cell_idx in range(start_cell_idx, end_cell_idx + 1):
+            end_row = start_row + self.num_rows_per_cell[cell_idx]
+            # Except the header, the first row of a cell is the separator.
+            start_row_offset = 0 if cell_idx == 0 else 1
             texts_per_cell.append(
                 self._process_cell_text(
                     self.cell_types[cell_idx],
-                    self.buf[
-                        start_row + 1 : start_row + self.num_rows_per_cell[cell_idx]
-                    ],
+                    lines[start_row + start_row_offset : end_row],
                 )
             )
+            start_row = end_row
 
         if strip:
             texts_per_cell = [x.strip() for x in texts_per_cell]
@@ -155,7 +177,7 @@ class JupyniumBuffer:
 
     def process_on_lines(
         self,
-        driver: WebDriver,
+        driver: Driver,
         *,
         strip: bool,
         lines: list[str],
@@ -163,24 +185,34 @@ class JupyniumBuffer:
         old_end_row: int,
         new_end_row: int,
     ):
+        if not self.shadow.valid:
+            # We don't know what the notebook looks like
+            # (e.g. loaded from ipynb, or an error occurred before).
+            self.shadow.load_from_notebook(driver)
+
         (
             notebook_cell_operations,
             modified_cell_idx_start,
             modified_cell_idx_end,
         ) = self._on_lines_update_buf(lines, start_row, old_end_row, new_end_row)
-        self._apply_cell_operations(driver, notebook_cell_operations)
 
+        # Structural changes, type changes and text updates in one round trip.
+        # If the number of cells doesn't match after the structural changes,
+        # the rest is skipped and we fall back to the full sync.
+        transaction = NotebookTransaction(self.shadow)
+        self._add_cell_operations(transaction, notebook_cell_operations)
         num_cells = self.num_cells_in_notebook
-        num_cells_in_notebook = driver.execute_script(
-            "return Jupyter.notebook.ncells();"
+        transaction.expect_ncells(num_cells)
+        self._add_partial_sync_operations(
+            transaction, modified_cell_idx_start, modified_cell_idx_end, strip=strip
         )
+        num_cells_in_notebook = transaction.commit(driver)
 
         if num_cells_in_notebook != num_cells:
             self.full_sync_to_notebook(driver, strip=strip)
-        else:
-            self._partial_sync_to_notebook(
-                driver, modified_cell_idx_start, modified_cell_idx_end, strip=strip
-            )
+        elif self.shadow.needs_verification() and not self.shadow.verify(driver):
+            # Periodic check: the notebook has been modified outside of Jupynium.
+            self.full_sync_to_notebook(driver, strip=strip)
 
     def _on_lines_update_buf(
         self, lines: list[str], start_row: int, old_end_row: int, new_end_row: int
@@ -204,6 +236,7 @@ class JupyniumBuffer:
             row_within_cell = self.num_rows_per_cell[-1]
 
         modified_cell_idx_start = cell_idx
+        num_rows_before_edit = self.num_rows_per_cell[cell_idx]
 
         lines_to_remove = old_end_row - start_row
 
@@ -278,60 +311,57 @@ class JupyniumBuffer:
 
         modified_cell_idx_end = modified_cell_idx_start + new_lines_buf.num_cells - 1
 
-        # Now actually replace the lines
-        # Optimisation: if the number of lines is not changed,
-        # which is most of the cases,
-        # then we can just replace the the strings in the list
-        # instead of modifying list itself.
-        if old_end_row == new_end_row:
-            for i, line in enumerate(lines):
-                self.buf[start_row + i] = line
+        # Keep the row index up to date.
+        # Most edits stay within a cell, which is a single O(log n) point update.
+        # Creating or removing cells shifts the indices, so rebuild.
+        if len(notebook_cell_delete_operations) > 0 or new_lines_buf.num_cells > 1:
+            self._row_index.build(self.num_rows_per_cell)
         else:
-            # If the number of lines is changed,
-            # then we need to remove the old lines and insert the new lines.
-            self.buf[start_row:old_end_row] = lines
+            self._row_index.add(
+                cell_idx, self.num_rows_per_cell[cell_idx] - num_rows_before_edit
+            )
+
+        # Now actually replace the lines
+        # The LineStore only touches the chunks around the edit,
+        # so this doesn't shift the rest of the buffer.
+        self.buf.replace(start_row, old_end_row, lines)
 
         return notebook_cell_operations, modified_cell_idx_start, modified_cell_idx_end
 
-    def _apply_cell_operations(
+    def _add_cell_operations(
         self,
-        driver: WebDriver,
+        transaction: NotebookTransaction,
         notebook_cell_operations: list[tuple[str, int, list[str]]],
     ):
         # Remove / create cells in Notebook
         for operation, cell_idx, cell_types in notebook_cell_operations:
             nb_cell_idx = cell_idx - 1
             if operation == "delete":
-                logger.info(f"Deleting cell {nb_cell_idx} from Notebook")
-                driver.execute_script(
-                    "Jupyter.notebook.delete_cell(arguments[0]);", nb_cell_idx
-                )
+                transaction.delete_cell(nb_cell_idx)
             elif operation == "insert":
                 for i, cell_type in enumerate(cell_types):
-                    logger.info(f"Inserting cell {nb_cell_idx + i} from Notebook")
-                    insert_cell_at(driver, cell_type, nb_cell_idx + i)
+                    transaction.insert_cell(nb_cell_idx + i, cell_type)
             elif operation == "cell_type":
                 for i, cell_type in enumerate(cell_types):
                     logger.info(
                         f"Cell {nb_cell_idx + i} type change to {cell_type} "
                         "from Notebook"
                     )
-                    # "markdown"
-                    if cell_type == "markdown":
-                        driver.execute_script(
-                            "Jupyter.notebook.cells_to_markdown([arguments[0]]);",
-                            nb_cell_idx + i,
-                        )
-                    elif cell_type == "code":
-                        driver.execute_script(
-                            "Jupyter.notebook.cells_to_code([arguments[0]]);",
-                            nb_cell_idx + i,
-                        )
-                    else:
-                        raise ValueError(f"Unknown cell type {cell_type}")
+                    transaction.set_cell_type(nb_cell_idx + i, cell_type)
 
     def get_cell_start_row(self, cell_idx: int):
-        return sum(self.num_rows_per_cell[:cell_idx])
+        return self._row_index.prefix_sum(cell_idx)
+
+    def get_cell_row_range(self, cell_idx: int) -> tuple[int, int]:
+        """
+        Row range of the cell.
+
+        Returns:
+            int: start row of the cell (including the separator)
+            int: end row of the cell (exclusive)
+        """
+        start_row = self.get_cell_start_row(cell_idx)
+        return start_row, start_row + self.num_rows_per_cell[cell_idx]
 
     def get_cell_index_from_row(
         self,
@@ -354,7 +384,15 @@ class JupyniumBuffer:
             int: row index within the cell
         """
         if num_rows_per_cell is None:
-            num_rows_per_cell = self.num_rows_per_cell
+            cell_idx, cell_start_row = self._row_index.search(row)
+            if cell_idx < self.num_cells:
+                return cell_idx, cell_start_row, row - cell_start_row
+
+            # Out of bound. Could be adding a new line.
+            if raise_out_of_bound:
+                raise IndexError(f"Could not find cell for row {row}")
+            else:
+                return self.num_cells - 1, cell_start_row, row - cell_start_row
 
         cell_start_row = 0
         i = 0
@@ -371,12 +409,17 @@ class JupyniumBuffer:
 
     def _check_validity(self):
         assert len(self.buf) == sum(self.num_rows_per_cell)
+        assert len(self._row_index) == self.num_cells
+        assert all(
+            self.get_cell_start_row(i) == start_row
+            for i, start_row in enumerate(accumulate(self.num_rows_per_cell, initial=0))
+        )
         assert len(self.cell_types) == len(self.num_rows_per_cell)
         assert self.cell_types[0] == "header"
         assert all(x in ("code", "markdown") for x in self.cell_types[1:])
 
     def _partial_sync_to_notebook(
-        self, driver: WebDriver, start_cell_idx: int, end_cell_idx: int, *, strip=True
+        self, driver: Driver, start_cell_idx: int, end_cell_idx: int, *, strip=True
     ):
         """
         Given the range of cells to update, sync the JupyniumBuffer with the notebook.
@@ -385,16 +428,31 @@ class JupyniumBuffer:
             Cell 1 in JupyniumBuffer is cell 0 in Notebook.
             Args are inclusive range in ju.py JupyniumBuffer
         """
+        transaction = NotebookTransaction(self.shadow)
+        self._add_partial_sync_operations(
+            transaction, start_cell_idx, end_cell_idx, strip=strip
+        )
+        if len(transaction) > 0:
+            transaction.commit(driver)
+
+    def _add_partial_sync_operations(
+        self,
+        transaction: NotebookTransaction,
+        start_cell_idx: int,
+        end_cell_idx: int,
+        *,
+        strip=True,
+    ):
+        """Same as _partial_sync_to_notebook but add to the transaction."""
         assert start_cell_idx <= end_cell_idx < self.num_cells
 
         if self.num_cells == 1:
             # Markdown file
-            driver.execute_script(
-                "Jupyter.notebook.cells_to_markdown([0]);"
-                "Jupyter.notebook.get_cell(0).set_text(arguments[0]);"
-                "Jupyter.notebook.get_cell(0).render()",
-                "\n".join(self.buf),
-            )
+            text = "\n".join(self.buf)
+            if not (
+                self.shadow.ncells == 1 and self.shadow.is_synced(0, "markdown", text)
+            ):
+                transaction.set_markdown_file_text(text)
         else:
             # Notebook file
 
@@ -408,59 +466,127 @@ class JupyniumBuffer:
             texts_per_cell = self.get_cells_text(
                 start_cell_idx, end_cell_idx, strip=strip
             )
-
-            code_cell_indices = [
-                start_cell_idx + i
-                for i, cell_type in enumerate(
-                    self.cell_types[start_cell_idx : end_cell_idx + 1]
-                )
-                if cell_type == "code"
-            ]
-            markdown_cell_indices = [
-                start_cell_idx + i
-                for i, cell_type in enumerate(
-                    self.cell_types[start_cell_idx : end_cell_idx + 1]
-                )
-                if cell_type == "markdown"
+            cell_types = self.cell_types[start_cell_idx : end_cell_idx + 1]
+
+            # Only send the cells that differ from what the notebook already has.
+            # If the shadow model is invalid, everything is sent.
+            shadow = self.shadow
+            changed_cells = [
+                i
+                for i, (cell_type, text) in enumerate(zip(cell_types, texts_per_cell))
+                if not shadow.is_synced(start_cell_idx - 1 + i, cell_type, text)
             ]
+            if len(changed_cells) == 0:
+                return
+
+            code_cell_indices = []
+            markdown_cell_indices = []
+            for i in changed_cells:
+                notebook_cell_idx = start_cell_idx - 1 + i
+                if (
+                    shadow.valid
+                    and notebook_cell_idx < shadow.ncells
+                    and shadow.cell_types[notebook_cell_idx] == cell_types[i]
+                ):
+                    continue
+                if cell_types[i] == "code":
+                    code_cell_indices.append(start_cell_idx + i)
+                else:
+                    markdown_cell_indices.append(start_cell_idx + i)
 
             if len(code_cell_indices) > 0:
                 logger.info(f"Converting to code cells: {code_cell_indices}")
                 for i in code_cell_indices:
-                    driver.execute_script(
-                        "Jupyter.notebook.cells_to_code([arguments[0]]);", i - 1
-                    )
+                    transaction.set_cell_type(i - 1, "code")
 
             if len(markdown_cell_indices) > 0:
                 logger.info(f"Converting to markdown cells: {markdown_cell_indices}")
                 for i in markdown_cell_indices:
-                    driver.execute_script(
-                        "Jupyter.notebook.cells_to_markdown([arguments[0]]);", i - 1
+                    transaction.set_cell_type(i - 1, "markdown")
+
+            # If only a part of a cell has changed, send the changed lines only.
+            converted_cells = set(code_cell_indices + markdown_cell_indices)
+            text_cells = []
+            for i in changed_cells:
+                if start_cell_idx + i in converted_cells:
+                    # Send the whole text so that markdown cells are rendered.
+                    text_cells.append(i)
+                    continue
+                notebook_cell_idx = start_cell_idx - 1 + i
+                old_lines = shadow.texts[notebook_cell_idx].split("\n")
+                new_lines = texts_per_cell[i].split("\n")
+                start_line, old_end_line, new_end_line = _diff_lines(
+                    old_lines, new_lines
+                )
+                if start_line == 0 and old_end_line == len(old_lines):
+                    # Nothing in common
+                    text_cells.append(i)
+                else:
+                    transaction.replace_cell_lines(
+                        notebook_cell_idx,
+                        start_line,
+                        old_end_line,
+                        new_lines[start_line:new_end_line],
                     )
 
-            # This will render markdown cells
-            driver.execute_script(
-                set_cell_text_js_code,
-                start_cell_idx - 1,
-                end_cell_idx - 1,
-                *texts_per_cell,
+            if len(text_cells) == 0:
+                return
+
+            # Set texts of each run of consecutive cells.
+            run_start = prev = text_cells[0]
+            for i in text_cells[1:]:
+                if i != prev + 1:
+                    transaction.set_cells_text(
+                        start_cell_idx - 1 + run_start,
+                        texts_per_cell[run_start : prev + 1],
+                    )
+                    run_start = i
+                prev = i
+            transaction.set_cells_text(
+                start_cell_idx - 1 + run_start, texts_per_cell[run_start : prev + 1]
             )
 
-    def full_sync_to_notebook(self, driver: WebDriver, *, strip: bool = True):
-        # Full sync with notebook.
-        # WARNING: syncing may result in data loss.
-        num_cells = self.num_cells_in_notebook
-        num_cells_in_notebook = driver.execute_script(
-            "return Jupyter.notebook.ncells();"
-        )
-        if num_cells > num_cells_in_notebook:
-            for _ in range(num_cells - num_cells_in_notebook):
-                driver.execute_script("Jupyter.notebook.insert_cell_below();")
-        elif num_cells < num_cells_in_notebook:
-            for _ in range(num_cells_in_notebook - num_cells):
-                driver.execute_script("Jupyter.notebook.delete_cell(-1);")
-
-        self._partial_sync_to_notebook(driver, 0, self.num_cells - 1, strip=strip)
+    def render_markdown_cells(
+        self, driver: Driver, *, except_cell_idx: int | None = None
+    ):
+        """
+        Render markdown cells whose text has changed since they were last rendered.
+
+        Rendering (e.g. MathJax) can be slow, so it is not done on every text change.
+
+        Args:
+            except_cell_idx: Notebook cell index to leave unrendered (e.g. the cell
+                being edited).
+        """
+        cell_indices = sorted(self.shadow.unrendered - {except_cell_idx})
+        if len(cell_indices) == 0:
+            return
+        logger.info(f"Rendering markdown cells: {cell_indices}")
+        transaction = NotebookTransaction(self.shadow)
+        transaction.render_markdown_cells(cell_indices)
+        transaction.commit(driver)
+
+    def full_sync_to_notebook(self, driver: Driver, *, strip: bool = True):
+        # Full sync with notebook: the notebook cells are overwritten by the buffer.
+        # Cells that the notebook already has (according to the shadow model)
+        # are not sent again, unless the number of cells differs.
+        # Invalidate the model first to overwrite edits made in the browser.
+        if not self.shadow.valid:
+            self.shadow.load_from_notebook(driver)
+        transaction = NotebookTransaction(self.shadow)
+        if self.num_cells > 1 and self.shadow.ncells != self.num_cells_in_notebook:
+            # The cells don't line up (e.g. start_sync), so comparing them by index
+            # would attach outputs to the wrong cells. Load all cells at once.
+            transaction.load_cells(
+                self.cell_types[1:],
+                self.get_cells_text(1, self.num_cells - 1, strip=strip),
+            )
+        else:
+            transaction.resize(self.num_cells_in_notebook)
+            self._add_partial_sync_operations(
+                transaction, 0, self.num_cells - 1, strip=strip
+            )
+        transaction.commit(driver)
 
     @property
     def num_cells(self):
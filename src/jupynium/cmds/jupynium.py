@@ -31,21 +31,28 @@ from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.firefox.service import Service
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
 
 from jupynium import __version__
 from jupynium import selenium_helpers as sele
 from jupynium.definitions import persist_queue_path
+from jupynium.driver_protocol import driver_wait
+from jupynium.driver_stats import InstrumentedDriver, command_stats
+from jupynium.event_loop import AttachListener, EventWaiter, notify_attach
 from jupynium.events_control import process_events
+from jupynium.kernel_requests import KernelRequests
+from jupynium.marionette import marionette_firefox
 from jupynium.nvim import NvimInfo
+from jupynium.nvim_reader import NvimReader
 from jupynium.process import already_running_pid
 from jupynium.pynvim_helpers import attach_and_init
+from jupynium.window_tracking import WindowTrackingDriver
 
 if TYPE_CHECKING:
     from collections.abc import Sequence
 
     from pynvim import Nvim
-    from selenium.webdriver.remote.webdriver import WebDriver
+
+    from jupynium.driver_protocol import Driver
 
 logger = verboselogs.VerboseLogger(__name__)
 
@@ -53,6 +60,7 @@ logger = verboselogs.VerboseLogger(__name__)
 def webdriver_firefox(
     profiles_ini_path: str | PathLike | None = "~/.mozilla/firefox/profiles.ini",
     profile_name: str | None = None,
+    marionette: bool = False,  # noqa: FBT001, FBT002
 ):
     """
     Get a Firefox webdriver with a specific profile.
@@ -62,6 +70,7 @@ def webdriver_firefox(
     Args:
         profiles_ini_path: Path to profiles.ini
         profile_name: Profile name in profiles.ini. If None, use the default profile.
+        marionette: Talk to Firefox's Marionette directly instead of geckodriver.
     """
     # Read firefox profile path from profiles.ini
     profile_path = None
@@ -102,16 +111,30 @@ def webdriver_firefox(
 
     logger.info(f"Using firefox profile: {profile_path}")
 
+    preferences = {
+        "browser.link.open_newwindow": 3,
+        "browser.link.open_newwindow.restriction": 0,
+    }
+    if marionette:
+        logger.info("Using Marionette directly, without geckodriver.")
+        # Skipped window switches are not sent, so they are not counted.
+        return WindowTrackingDriver(
+            InstrumentedDriver(marionette_firefox(profile_path, preferences))
+        )
+
     options = Options()
     if profile_path is not None:
         options.add_argument("-profile")
         options.add_argument(str(profile_path))
-    options.set_preference("browser.link.open_newwindow", 3)
-    options.set_preference("browser.link.open_newwindow.restriction", 0)
+    for name, value in preferences.items():
+        options.set_preference(name, value)
     # profile.setAlwaysLoadNoFocusLib(True);
 
     service = Service(log_path=os.path.devnull)
-    return webdriver.Firefox(options=options, service=service)
+    # Skipped window switches are not sent, so they are not counted.
+    return WindowTrackingDriver(
+        InstrumentedDriver(webdriver.Firefox(options=options, service=service))
+    )
 
 
 # def webdriver_safari():
@@ -154,7 +177,32 @@ def get_parser():
         "--sleep_time_idle",
         type=float,
         default=0.05,
-        help="Sleep time when there is no event to process.",
+        help="Polling interval, only used when events cannot be waited on "
+        "(e.g. nvim connected with a named pipe on Windows).",
+    )
+    parser.add_argument(
+        "--housekeeping_interval",
+        type=float,
+        default=1.0,
+        help="Maximum time to wait for events before checking whether the browser "
+        "and the notebook tabs are still open. "
+        "Negative to wait indefinitely (closed tabs are noticed on the next event).",
+    )
+    parser.add_argument(
+        "--time_budget",
+        type=float,
+        default=0.1,
+        help="With multiple nvims attached, they take turns and each can use "
+        "this much time (in seconds) per turn. The rest of the events are processed "
+        "in the next turn, so a busy nvim does not stall the others. "
+        "Negative for no limit.",
+    )
+    parser.add_argument(
+        "--kernel_client",
+        action="store_true",
+        help="Send kernel completion and inspection requests to the notebook server "
+        "directly (websocket), instead of through the browser. "
+        "Falls back to the browser if it fails to connect.",
     )
     parser.add_argument(
         "-v",
@@ -178,6 +226,13 @@ def get_parser():
         "--firefox_profile_name",
         help="Firefox profile name. If None, use the default profile.",
     )
+    parser.add_argument(
+        "--firefox_marionette",
+        action="store_true",
+        help="Control Firefox through its Marionette socket directly, "
+        "instead of through geckodriver (HTTP). Faster for small commands. "
+        "The profile's user.js is changed while running, and restored on quit.",
+    )
     parser.add_argument(
         "--jupyter_command",
         type=str,
@@ -215,6 +270,7 @@ def start_if_running_else_clear(args, q: persistqueue.UniqueQ):
     if already_running_pid():
         if args.nvim_listen_addr is not None:
             q.put(args)
+            notify_attach()
             logger.info(
                 "Jupynium is already running. Attaching to the running process."
             )
@@ -248,14 +304,25 @@ def number_of_windows_be_list(num_windows: list[int]):
     Slightly modified from EC.number_of_windows_to_be(num_windows).
     """
 
-    def _predicate(driver: webdriver.Firefox):
+    def _predicate(driver: Driver):
         return len(driver.window_handles) in num_windows
 
     return _predicate
 
 
+def attach_with_reader(nvim_listen_addr: str) -> tuple[Nvim, NvimReader]:
+    """Attach to nvim, and receive its notifications in the background."""
+    reader = NvimReader(nvim_listen_addr)
+    try:
+        nvim = attach_and_init(nvim_listen_addr, event_channel_id=reader.channel_id)
+    except Exception:
+        reader.close()
+        raise
+    return nvim, reader
+
+
 def attach_new_neovim(
-    driver: WebDriver,
+    driver: Driver,
     new_args: argparse.Namespace,
     nvims: dict[str, NvimInfo],
     url_to_home_windows: dict[str, str],
@@ -265,7 +332,7 @@ def attach_new_neovim(
         logger.info("Already attached.")
     else:
         try:
-            nvim = attach_and_init(new_args.nvim_listen_addr)
+            nvim, reader = attach_with_reader(new_args.nvim_listen_addr)
             if new_args.notebook_URL in url_to_home_windows:
                 home_window = url_to_home_windows[new_args.notebook_URL]
             else:
@@ -274,15 +341,21 @@ def attach_new_neovim(
                 driver.get(new_args.notebook_URL)
 
                 # Wait for the notebook to load
-                driver_wait = WebDriverWait(driver, 10)
-                driver_wait.until(EC.number_of_windows_to_be(prev_num_windows + 1))
+                wait = driver_wait(driver, 10)
+                wait.until(EC.number_of_windows_to_be(prev_num_windows + 1))
                 sele.wait_until_loaded(driver)
 
                 home_window = driver.current_window_handle
                 url_to_home_windows[new_args.notebook_URL] = home_window
 
             nvim_info = NvimInfo(
-                nvim, home_window, auto_close_tab=not new_args.no_auto_close_tab
+                nvim,
+                home_window,
+                auto_close_tab=not new_args.no_auto_close_tab,
+                reader=reader,
+                kernel_requests=KernelRequests(
+                    use_kernel_client=new_args.kernel_client
+                ),
             )
             nvims[new_args.nvim_listen_addr] = nvim_info
         except Exception:
@@ -366,7 +439,7 @@ def fallback_open_notebook_server(
     jupyter_command: Sequence[str],
     notebook_dir: str | PathLike | None,
     nvim: Nvim | None,
-    driver: WebDriver,
+    driver: Driver,
 ):
     """
     After firefox failing to try to connect to Notebook, open the Notebook server and try again.
@@ -456,7 +529,7 @@ def fallback_open_notebook_server(
     return notebook_proc
 
 
-def main():  # noqa: C901 PLR0912
+def main():  # noqa: C901 PLR0912 PLR0915
     # Initialise with NOTSET level and null device, and add stream handler separately.
     # This way, the root logging level is NOTSET (log all),
     # and we can customise each handler's behaviour.
@@ -506,15 +579,17 @@ def main():  # noqa: C901 PLR0912
         sys.exit(return_code)
 
     nvim = None
+    reader = None
     if args.nvim_listen_addr is not None:
         try:
-            nvim = attach_and_init(args.nvim_listen_addr)
+            nvim, reader = attach_with_reader(args.nvim_listen_addr)
         except Exception:
             logger.exception("Exception occurred")
             sys.exit(1)
 
     nvims = {}
     notebook_proc = None
+    attach_listener = AttachListener()
     try:
         # Open selenium
         # If you load with Chrome, it will annoyingly set focus to the browser
@@ -523,7 +598,9 @@ def main():  # noqa: C901 PLR0912
         # If you load with Safari, it won't let you interact with the browser.
 
         with webdriver_firefox(
-            args.firefox_profiles_ini_path, args.firefox_profile_name
+            args.firefox_profiles_ini_path,
+            args.firefox_profile_name,
+            marionette=args.firefox_marionette,
         ) as driver:
             # Initial number of windows when launching browser
             init_num_windows = len(driver.window_handles)
@@ -549,7 +626,7 @@ def main():  # noqa: C901 PLR0912
                     exception_no_notebook(args.notebook_URL, nvim)
 
             # Wait for the notebook to load
-            driver_wait = WebDriverWait(driver, 10)
+            wait = driver_wait(driver, 10)
             # Acceptable number of windows is either:
             # - Initial number of windows, for regular case where jupynium handles
             # initally focused tab
@@ -557,7 +634,7 @@ def main():  # noqa: C901 PLR0912
             # a new tab
             # Ref: https://github.com/kiyoon/jupynium.nvim/issues/59
             accept_num_windows = [init_num_windows, init_num_windows + 1]
-            driver_wait.until(number_of_windows_be_list(accept_num_windows))
+            wait.until(number_of_windows_be_list(accept_num_windows))
             sele.wait_until_loaded(driver)
 
             home_window = driver.current_window_handle
@@ -566,7 +643,13 @@ def main():  # noqa: C901 PLR0912
             if args.nvim_listen_addr is not None and nvim is not None:
                 nvims = {
                     args.nvim_listen_addr: NvimInfo(
-                        nvim, home_window, auto_close_tab=not args.no_auto_close_tab
+                        nvim,
+                        home_window,
+                        auto_close_tab=not args.no_auto_close_tab,
+                        reader=reader,
+                        kernel_requests=KernelRequests(
+                            use_kernel_client=args.kernel_client
+                        ),
                     )
                 }
             else:
@@ -576,12 +659,43 @@ def main():  # noqa: C901 PLR0912
                     "(use `:echo v:servername` of nvim)"
                 )
 
-            while not sele.is_browser_disconnected(driver):
+            # Block until an nvim sends messages, a new nvim wants to attach,
+            # or a timer is due. No fixed-interval polling.
+            event_waiter = EventWaiter(attach_listener, args.sleep_time_idle)
+            time_budget = None if args.time_budget < 0 else args.time_budget
+            ready_nvims: set[str] = set()
+            attach_requested = True
+            next_housekeeping = time.monotonic()
+            while True:
                 try:
+                    now = time.monotonic()
+                    housekeeping = now >= next_housekeeping
+                    # The liveness checks of this iteration share one snapshot.
+                    driver.expire_window_handles()
+                    if housekeeping:
+                        if sele.is_browser_disconnected(driver):
+                            break
+                        if args.housekeeping_interval >= 0:
+                            next_housekeeping = now + args.housekeeping_interval
+                        else:
+                            next_housekeeping = float("inf")
+
                     del_list = []
                     for nvim_listen_addr, nvim_info in nvims.items():
+                        if not (
+                            housekeeping
+                            or nvim_listen_addr in ready_nvims
+                            or (
+                                nvim_info.next_timer is not None
+                                and now >= nvim_info.next_timer
+                            )
+                        ):
+                            continue
+
                         try:
-                            status, rpcrequest_event = process_events(nvim_info, driver)
+                            status, rpcrequest_event = process_events(
+                                nvim_info, driver, time_budget
+                            )
                         except OSError:
                             logger.info("Nvim has been closed. Detaching nvim.")
                             del_list.append((nvim_listen_addr, None))
@@ -605,14 +719,33 @@ def main():  # noqa: C901 PLR0912
                         del nvims[listen_addr]
 
                     # Check if a new newvim instance wants to attach to this server.
-                    try:
-                        new_args: argparse.Namespace = q.get(block=False)
-                    except Empty:
-                        pass
-                    else:
-                        attach_new_neovim(driver, new_args, nvims, url_to_home_windows)
-
-                    time.sleep(args.sleep_time_idle)
+                    if attach_requested or housekeeping:
+                        while True:
+                            try:
+                                new_args: argparse.Namespace = q.get(block=False)
+                            except Empty:
+                                break
+                            else:
+                                attach_new_neovim(
+                                    driver, new_args, nvims, url_to_home_windows
+                                )
+
+                    wakeup_time = min(
+                        [
+                            next_housekeeping,
+                            *(
+                                nvim_info.next_timer
+                                for nvim_info in nvims.values()
+                                if nvim_info.next_timer is not None
+                            ),
+                        ]
+                    )
+                    timeout = (
+                        None
+                        if wakeup_time == float("inf")
+                        else wakeup_time - time.monotonic()
+                    )
+                    ready_nvims, attach_requested = event_waiter.wait(nvims, timeout)
                 except WebDriverException:
                     break
 
@@ -634,7 +767,9 @@ def main():  # noqa: C901 PLR0912
     else:
         logger.success("Piecefully closed as the browser is closed.")
 
+    logger.info(command_stats.summary())
     nvims_teardown(nvims)
+    attach_listener.close()
     kill_notebook_proc(notebook_proc)
 
 
@@ -0,0 +1,71 @@
+"""
+The part of Selenium's WebDriver that Jupynium uses.
+
+Jupynium is given Selenium's WebDriver, the Marionette driver, or the wrappers
+around them (WindowTrackingDriver, InstrumentedDriver), so the code is written
+against these protocols instead of Selenium's classes.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Protocol, cast
+
+from selenium.webdriver.support.wait import WebDriverWait
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+
+class Element(Protocol):
+    def find_element(self, by: str, value: str) -> Element: ...
+
+    def find_elements(self, by: str, value: str) -> Sequence[Element]: ...
+
+    def click(self) -> None: ...
+
+    @property
+    def text(self) -> str: ...
+
+
+class SwitchTo(Protocol):
+    def window(self, window_name: str) -> None: ...
+
+    def new_window(self, type_hint: str | None = None) -> None: ...
+
+
+class Driver(Protocol):
+    @property
+    def switch_to(self) -> SwitchTo: ...
+
+    @property
+    def window_handles(self) -> list[str]: ...
+
+    @property
+    def current_window_handle(self) -> str: ...
+
+    def execute_script(self, script: str, *args) -> Any: ...
+
+    def execute_async_script(self, script: str, *args) -> Any: ...
+
+    def find_element(self, by: str, value: str) -> Element: ...
+
+    def find_elements(self, by: str, value: str) -> Sequence[Element]: ...
+
+    def get(self, url: str) -> None: ...
+
+    def get_cookies(self) -> list[dict]: ...
+
+    def close(self) -> None: ...
+
+    def quit(self) -> None: ...
+
+
+def driver_wait(driver: Driver, timeout: float) -> WebDriverWait[WebDriver]:
+    """
+    Selenium's WebDriverWait, for any Driver.
+
+    It only passes the driver to the conditions, which use the methods above.
+    """
+    return WebDriverWait(cast("WebDriver", driver), timeout)
@@ -0,0 +1,203 @@
+"""
+Count the WebDriver commands and how long they take.
+
+Each command is a round trip to the browser, so it is what makes syncing slow.
+The commands are counted by type and by the handler they were sent from
+(see handler()), so that we can see what an edit costs.
+Show them with :JupyniumDriverStats, and they are logged when Jupynium quits.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator, Sequence
+
+    from .driver_protocol import Driver, Element
+
+
+_current_handler: ContextVar[str] = ContextVar("jupynium_handler", default="main")
+
+
+@contextlib.contextmanager
+def handler(name: str) -> Iterator[None]:
+    """Attribute the commands sent within to the handler (e.g. event name)."""
+    token = _current_handler.set(name)
+    try:
+        yield
+    finally:
+        _current_handler.reset(token)
+
+
+@dataclass
+class CommandStat:
+    count: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def __str__(self):
+        avg_ms = 1000 * self.total_time / self.count if self.count > 0 else 0.0
+        return (
+            f"{self.count:8d} {self.total_time:9.3f} s"
+            f"   avg {avg_ms:7.2f} ms   max {1000 * self.max_time:8.2f} ms"
+        )
+
+
+class CommandStats:
+    """WebDriver commands, keyed by (handler, command)."""
+
+    def __init__(self):
+        self.stats: dict[tuple[str, str], CommandStat] = {}
+        self.since = time.monotonic()
+
+    def record(self, command: str, elapsed: float):
+        key = (_current_handler.get(), command)
+        if key not in self.stats:
+            self.stats[key] = CommandStat()
+        self.stats[key].add(elapsed)
+
+    def reset(self):
+        self.stats.clear()
+        self.since = time.monotonic()
+
+    def total(self) -> CommandStat:
+        total = CommandStat()
+        for stat in self.stats.values():
+            total.count += stat.count
+            total.total_time += stat.total_time
+            total.max_time = max(total.max_time, stat.max_time)
+        return total
+
+    def _group_by(self, key_idx: int) -> dict[str, CommandStat]:
+        grouped: dict[str, CommandStat] = {}
+        for key, stat in self.stats.items():
+            group = grouped.setdefault(key[key_idx], CommandStat())
+            group.count += stat.count
+            group.total_time += stat.total_time
+            group.max_time = max(group.max_time, stat.max_time)
+        return grouped
+
+    def by_command(self) -> dict[str, CommandStat]:
+        return self._group_by(1)
+
+    def by_handler(self) -> dict[str, CommandStat]:
+        return self._group_by(0)
+
+    def summary(self) -> str:
+        """Human-readable tables, the most time-consuming first."""
+
+        def table(stats: dict[Any, CommandStat], name: Callable[[Any], str]):
+            return [
+                f"  {name(key):<50} {stat}"
+                for key, stat in sorted(
+                    stats.items(), key=lambda item: item[1].total_time, reverse=True
+                )
+            ]
+
+        lines = [
+            f"WebDriver commands in the last {time.monotonic() - self.since:.1f} s:",
+            f"  {'total':<50} {self.total()}",
+            "By command:",
+            *table(self.by_command(), str),
+            "By handler:",
+            *table(self.by_handler(), str),
+            "By handler and command:",
+            *table(self.stats, lambda key: f"{key[0]}: {key[1]}"),
+        ]
+        return "\n".join(lines)
+
+
+# Shared by all drivers of this process.
+command_stats = CommandStats()
+
+
+class _InstrumentedSwitchTo:
+    def __init__(self, instrumented_driver: InstrumentedDriver):
+        self._instrumented_driver = instrumented_driver
+
+    def window(self, window_name: str) -> None:
+        with self._instrumented_driver.timed("switch_to.window"):
+            self._instrumented_driver.driver.switch_to.window(window_name)
+
+    def new_window(self, type_hint: str | None = None) -> None:
+        with self._instrumented_driver.timed("switch_to.new_window"):
+            self._instrumented_driver.driver.switch_to.new_window(type_hint)
+
+
+class InstrumentedDriver:
+    """
+    Driver that records the commands in CommandStats.
+
+    Only the commands that Jupynium sends directly are recorded,
+    not e.g. the commands of the found elements.
+    """
+
+    def __init__(self, driver: Driver, stats: CommandStats | None = None):
+        self.driver = driver
+        self.stats = command_stats if stats is None else stats
+        self.switch_to = _InstrumentedSwitchTo(self)
+
+    @contextlib.contextmanager
+    def timed(self, command: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stats.record(command, time.perf_counter() - start)
+
+    @property
+    def window_handles(self) -> list[str]:
+        with self.timed("window_handles"):
+            return self.driver.window_handles
+
+    @property
+    def current_window_handle(self) -> str:
+        with self.timed("current_window_handle"):
+            return self.driver.current_window_handle
+
+    def execute_script(self, script: str, *args) -> Any:
+        with self.timed("execute_script"):
+            return self.driver.execute_script(script, *args)
+
+    def execute_async_script(self, script: str, *args) -> Any:
+        with self.timed("execute_async_script"):
+            return self.driver.execute_async_script(script, *args)
+
+    def find_element(self, by: str, value: str) -> Element:
+        with self.timed("find_element"):
+            return self.driver.find_element(by, value)
+
+    def find_elements(self, by: str, value: str) -> Sequence[Element]:
+        with self.timed("find_elements"):
+            return self.driver.find_elements(by, value)
+
+    def get(self, url: str) -> None:
+        with self.timed("get"):
+            self.driver.get(url)
+
+    def get_cookies(self) -> list[dict]:
+        with self.timed("get_cookies"):
+            return self.driver.get_cookies()
+
+    def close(self) -> None:
+        with self.timed("close"):
+            self.driver.close()
+
+    def quit(self) -> None:
+        self.driver.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.quit()
@@ -0,0 +1,188 @@
+"""
+Wait for events instead of polling at a fixed interval.
+
+The main loop blocks until an attached nvim sends something,
+a new nvim asks to attach, or a timer is due.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+import select
+import socket
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .definitions import attach_wakeup_path
+from .rpc_messages import len_pending_messages
+
+if TYPE_CHECKING:
+    from os import PathLike
+
+    from pynvim import Nvim
+
+    from .nvim import NvimInfo
+
+logger = logging.getLogger(__name__)
+
+
+def nvim_socket(nvim: Nvim) -> socket.socket | None:
+    """
+    Get the socket that pynvim reads nvim's messages from.
+
+    pynvim doesn't expose it, so it is taken from the asyncio transport of
+    pynvim's event loop (`nvim._session._async_session.loop._transport`),
+    as in pynvim 0.5 and 0.6. If it's not found (e.g. a pynvim release that
+    changes it), the callers fall back to polling.
+
+    Returns:
+        socket.socket | None: None if it is not available (e.g. named pipes on Windows)
+    """
+    session = getattr(getattr(nvim, "_session", None), "_async_session", None)
+    loop = getattr(session, "loop", None)
+    transport = getattr(loop, "_transport", None)
+    get_extra_info = getattr(transport, "get_extra_info", None)
+    if get_extra_info is None:
+        return None
+    return get_extra_info("socket")
+
+
+def nvim_socket_readable(nvim: Nvim) -> bool:
+    """
+    Whether nvim has sent data that pynvim hasn't read yet. Doesn't block.
+
+    Always False if the socket is not available.
+    """
+    sock = nvim_socket(nvim)
+    if sock is None:
+        return False
+    readable, _, _ = select.select([sock], [], [], 0)
+    return len(readable) > 0
+
+
+def notify_attach(path: str | PathLike = attach_wakeup_path):
+    """
+    Wake up the running Jupynium after putting the attach args in the queue.
+
+    It does nothing if the running Jupynium isn't listening
+    (e.g. older version, or not supported on this platform).
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return
+    with (
+        contextlib.suppress(OSError),
+        socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock,
+    ):
+        sock.sendto(b"\0", str(path))
+
+
+class AttachListener:
+    """Receive the wake-up datagrams sent by notify_attach()."""
+
+    def __init__(self, path: str | PathLike = attach_wakeup_path):
+        self.path = Path(path)
+        self.sock: socket.socket | None = None
+        if not hasattr(socket, "AF_UNIX"):
+            return
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.unlink(missing_ok=True)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(str(self.path))
+        except OSError:
+            logger.warning(
+                "Cannot listen for attach requests. Polling the queue instead.",
+                exc_info=True,
+            )
+            return
+        sock.settimeout(0.0)
+        self.sock = sock
+
+    def clear(self):
+        """Consume all wake-ups received so far."""
+        if self.sock is None:
+            return
+        with contextlib.suppress(BlockingIOError):
+            while True:
+                self.sock.recv(64)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.path.unlink(missing_ok=True)
+
+
+class EventWaiter:
+    """
+    Block on the nvim sockets, the background readers and the attach listener.
+
+    If something can't be waited on (e.g. Windows named pipes),
+    it falls back to polling every `poll_interval` seconds.
+    """
+
+    def __init__(self, attach_listener: AttachListener, poll_interval: float = 0.05):
+        self.attach_listener = attach_listener
+        self.poll_interval = poll_interval
+
+    def wait(
+        self, nvims: dict[str, NvimInfo], timeout: float | None
+    ) -> tuple[set[str], bool]:
+        """
+        Wait until there is something to process, or until timeout.
+
+        Args:
+            nvims: attached nvims, keyed by the listen address
+            timeout: seconds. None to wait indefinitely.
+
+        Returns:
+            set[str]: listen addresses of the nvims that have sent messages.
+            bool: True if a new nvim may want to attach.
+        """
+        # pynvim may have already read messages while waiting for a response.
+        ready = {
+            addr
+            for addr, nvim_info in nvims.items()
+            if len_pending_messages(nvim_info.nvim) > 0
+            or len(nvim_info.deferred_notifications) > 0
+            or (nvim_info.reader is not None and nvim_info.reader.has_pending())
+        }
+        if len(ready) > 0:
+            return ready, False
+
+        sockets: dict[socket.socket, str | None] = {}
+        polled_addrs = set()
+        for addr, nvim_info in nvims.items():
+            sock = nvim_socket(nvim_info.nvim)
+            if sock is None:
+                polled_addrs.add(addr)
+            else:
+                sockets[sock] = addr
+            if nvim_info.reader is not None:
+                sockets[nvim_info.reader.wakeup_sock] = addr
+        if self.attach_listener.sock is not None:
+            sockets[self.attach_listener.sock] = None
+
+        if len(polled_addrs) > 0 or self.attach_listener.sock is None:
+            timeout = (
+                self.poll_interval
+                if timeout is None
+                else min(timeout, self.poll_interval)
+            )
+
+        if len(sockets) == 0:
+            time.sleep(timeout if timeout is not None else self.poll_interval)
+            return polled_addrs, self.attach_listener.sock is None
+
+        readable, _, _ = select.select(
+            list(sockets), [], [], None if timeout is None else max(timeout, 0)
+        )
+        ready = {addr for sock in readable if (addr := sockets[sock]) is not None}
+        attach_requested = self.attach_listener.sock is None
+        if self.attach_listener.sock in readable:
+            self.attach_listener.clear()
+            attach_requested = True
+        return ready | polled_addrs, attach_requested
@@ -4,8 +4,9 @@ import dataclasses
 import json
 import logging
 import os
+import time
+from collections import deque
 from dataclasses import dataclass
-from importlib.resources import files as resfiles
 from os import PathLike
 from pathlib import Path
 from typing import TYPE_CHECKING
@@ -16,34 +17,27 @@ from selenium.common.exceptions import (
 )
 from selenium.webdriver.common.by import By
 
+from . import driver_stats
 from . import selenium_helpers as sele
 from .buffer import JupyniumBuffer
+from .event_loop import nvim_socket_readable
 from .ipynb import cells_to_jupytext
-from .rpc_messages import len_pending_messages, receive_message
+from .kernel_requests import KernelRequest
+from .pinned_scripts import execute_pinned_script
+from .rpc_messages import grant_credits, len_pending_messages, receive_message
+from .window_tracking import open_window_handles
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+
     from pynvim.msgpack_rpc.session import Notification, Request
-    from selenium.webdriver.remote.webdriver import WebDriver
 
+    from .driver_protocol import Driver
     from .nvim import NvimInfo
 
 logger = logging.getLogger(__name__)
 
 
-update_cell_selection_js_code = (
-    resfiles("jupynium") / "js" / "update_cell_selection.js"
-).read_text()
-
-get_cell_inputs_js_code = (
-    resfiles("jupynium") / "js" / "get_cell_inputs.js"
-).read_text()
-
-kernel_inspect_js_code = (resfiles("jupynium") / "js" / "kernel_inspect.js").read_text()
-
-kernel_complete_js_code = (
-    resfiles("jupynium") / "js" / "kernel_complete.js"
-).read_text()
-
 CompletionItemKind = {
     "text": 1,
     "method": 2,
@@ -79,6 +73,23 @@ CompletionItemKind = {
 }
 
 
+# Events that only update the cell selection. Only the latest one matters.
+SELECTION_EVENTS = frozenset(
+    ("CursorMoved", "CursorMovedI", "visual_enter", "visual_leave")
+)
+# Same for scrolling the notebook to the cursor.
+SCROLL_EVENTS = frozenset(("scroll_to_cell", "scroll_to_output"))
+# The user is waiting for the result, so they are served before the other events.
+# They only depend on the text changes of their own buffer (see schedule_events()).
+INTERACTIVE_EVENTS = frozenset(
+    ("kernel_complete_async", "kernel_inspect", "kernel_get_spec")
+)
+
+
+# Seconds between checking the replies of running kernel requests.
+KERNEL_REQUEST_POLL_INTERVAL = 0.05
+
+
 class StartSyncError(Exception):
     pass
 
@@ -105,6 +116,34 @@ class OnLinesArgs:
             other.new_end_row,
         )
 
+    def merge(
+        self, other: OnLinesArgs, base_lines: Sequence[str]
+    ) -> OnLinesArgs | None:
+        """
+        Merge with the next on_lines into one minimal replaced row range.
+
+        Unlike chain(), the two changes can be anywhere in the buffer
+        (e.g. multiple cursors, :s over a range, formatters, macros).
+        self is relative to base_lines, and other is relative to the lines after self.
+
+        Returns:
+            OnLinesArgs | None: None if the rows of other are out of range.
+        """
+        num_added_rows = self.new_end_row - self.old_end_row
+        start_row = min(self.start_row, other.start_row)
+        # Rows after applying self
+        end_row = max(self.new_end_row, other.old_end_row)
+        if end_row - num_added_rows > len(base_lines):
+            return None
+
+        lines = list(base_lines[start_row : self.start_row])
+        lines.extend(self.lines)
+        lines.extend(base_lines[self.old_end_row : end_row - num_added_rows])
+        lines[other.start_row - start_row : other.old_end_row - start_row] = other.lines
+        return OnLinesArgs(
+            lines, start_row, end_row - num_added_rows, start_row + len(lines)
+        )
+
 
 @dataclass
 class UpdateSelectionArgs:
@@ -112,6 +151,12 @@ class UpdateSelectionArgs:
     visual_start_row: int
 
 
+@dataclass
+class ScrollArgs:
+    event_name: str
+    cursor_pos_row: int
+
+
 @dataclass
 class PrevLazyArgs:
     """
@@ -120,14 +165,27 @@ class PrevLazyArgs:
 
     on_lines_args: OnLinesArgs | None = None
     update_selection_args: UpdateSelectionArgs | None = None
+    scroll_args: ScrollArgs | None = None
 
-    def process(self, nvim_info: NvimInfo, driver: WebDriver, bufnr: int) -> None:
-        if self.on_lines_args is not None:
-            process_on_lines_event(nvim_info, driver, bufnr, self.on_lines_args)
-            self.on_lines_args = None
+    def process(self, nvim_info: NvimInfo, driver: Driver, bufnr: int) -> None:
+        self.process_on_lines(nvim_info, driver, bufnr)
         if self.update_selection_args is not None:
-            update_cell_selection(nvim_info, driver, bufnr, self.update_selection_args)
+            with driver_stats.handler("update_cell_selection"):
+                update_cell_selection(
+                    nvim_info, driver, bufnr, self.update_selection_args
+                )
             self.update_selection_args = None
+        if self.scroll_args is not None:
+            with driver_stats.handler(self.scroll_args.event_name):
+                process_scroll_event(nvim_info, driver, bufnr, self.scroll_args)
+            self.scroll_args = None
+
+    def process_on_lines(self, nvim_info: NvimInfo, driver: Driver, bufnr: int) -> None:
+        """Only the text changes, leaving the selection and scroll for later."""
+        if self.on_lines_args is not None:
+            with driver_stats.handler("on_lines"):
+                process_on_lines_event(nvim_info, driver, bufnr, self.on_lines_args)
+            self.on_lines_args = None
 
 
 @dataclass
@@ -138,10 +196,14 @@ class PrevLazyArgsPerBuf:
 
     data: dict[int, PrevLazyArgs] = dataclasses.field(default_factory=dict)
 
-    def process(self, bufnr: int, nvim_info: NvimInfo, driver: WebDriver) -> None:
+    def process(self, bufnr: int, nvim_info: NvimInfo, driver: Driver) -> None:
         if bufnr in self.data:
             self.data[bufnr].process(nvim_info, driver, bufnr)
 
+    def process_on_lines(self, bufnr: int, nvim_info: NvimInfo, driver: Driver) -> None:
+        if bufnr in self.data:
+            self.data[bufnr].process_on_lines(nvim_info, driver, bufnr)
+
     def process_all(self, nvim_info: NvimInfo, driver) -> None:
         for bufnr, lazy_args in self.data.items():
             lazy_args.process(nvim_info, driver, bufnr)
@@ -150,7 +212,7 @@ class PrevLazyArgsPerBuf:
     def lazy_on_lines_event(
         self,
         nvim_info: NvimInfo,
-        driver: WebDriver,
+        driver: Driver,
         bufnr: int,
         on_lines_args: OnLinesArgs,
     ) -> None:
@@ -174,41 +236,95 @@ class PrevLazyArgsPerBuf:
 
         self.data[bufnr].update_selection_args = update_selection_args
 
+    def overwrite_scroll(self, bufnr: int, scroll_args: ScrollArgs) -> None:
+        """
+        Same as overwrite_update_selection(). Only the last scroll matters.
+        """
+        if bufnr not in self.data:
+            self.data[bufnr] = PrevLazyArgs()
+
+        self.data[bufnr].scroll_args = scroll_args
+
 
-def process_events(nvim_info: NvimInfo, driver: WebDriver):
+def process_events(
+    nvim_info: NvimInfo, driver: Driver, time_budget: float | None = None
+):
     """
     Controls events for a single nvim, and a single cycle of events.
 
     For example, if there are pending messages do process them all.
+    With multiple nvims attached, the main loop calls this in turns (round-robin),
+    and time_budget stops one nvim from starving the others (e.g. :%s on a big file).
+    What's left is processed in the next round.
+
+    Args:
+        nvim_info: the nvim to process the events of
+        driver: the browser
+        time_budget: seconds. Stop receiving new events after this.
+            At least one event is processed. None for no limit.
 
     Returns:
         bool status: False if nvim needs to be cleared up.
         rpcrequest event: Notify nvim after cleared up. None if status==True or
                           no need to notify
     """
+    try:
+        with driver_stats.handler("process_events"):
+            return _process_events(nvim_info, driver, time_budget)
+    finally:
+        # Send the calls to nvim queued during the cycle, all at once.
+        nvim_info.rpc.flush()
+
+
+def _process_events(  # noqa: PLR0911
+    nvim_info: NvimInfo, driver: Driver, time_budget: float | None
+):
     # Check if the browser is still alive
-    if nvim_info.home_window not in driver.window_handles:
-        nvim_info.nvim.lua.Jupynium_notify.error(
+    if nvim_info.home_window not in open_window_handles(driver):
+        nvim_info.rpc.call_lua(
+            "Jupynium_notify.error",
             ["Do not close the main page. Detaching the nvim from Jupynium.."],
             "error_close_main_page",
-            async_=True,
         )
         return False, None
 
     # Check for each buffer
     nvim_info.check_window_alive_and_update(driver)
 
-    # Receive message from this nvim
-    # vim.g.jupynium_num_pending_msgs is not reliable
-    # but so far it seems to be always smaller than
-    # the actual number of pending messages
+    # Receive messages from this nvim.
+    # Notifications are read in the background if there is a reader (see NvimReader),
+    # and requests (or all messages without a reader) come from the main connection.
+    # Instead of asking nvim how many messages are pending (a round trip per message),
+    # check the socket without blocking, and grant the consumed number of credits
+    # back once at the end.
 
     prev_lazy_args_per_buf = PrevLazyArgsPerBuf()
-    while (
-        len_pending_messages(nvim_info.nvim) > 0
-        or nvim_info.nvim.vars["jupynium_num_pending_msgs"] > 0
-    ):
+    num_received = 0
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    while True:
+        if nvim_info.reader is not None:
+            status, num_notifications = process_reader_notifications(
+                nvim_info, driver, prev_lazy_args_per_buf, deadline
+            )
+            num_received += num_notifications
+            if not status:
+                return False, None
+
+        if deadline is not None and time.monotonic() >= deadline:
+            # Out of budget. Pending buffer changes are still processed below,
+            # so each buffer is left in sync.
+            break
+
+        if not (
+            len_pending_messages(nvim_info.nvim) > 0
+            or nvim_socket_readable(nvim_info.nvim)
+        ):
+            if nvim_info.reader is None or not nvim_info.reader.has_pending():
+                break
+            continue
+
         event: Request | Notification | None = receive_message(nvim_info.nvim)
+        num_received += 1
         logger.info(f"Event from nvim: {event}")
 
         if event is None:
@@ -219,23 +335,346 @@ def process_events(nvim_info: NvimInfo, driver: WebDriver):
         assert event.args is not None
 
         if event.type == "request":
-            status, request_event = process_request_event(nvim_info, driver, event)
+            # Sent with the number of notifications before it (see Jupynium_rpcrequest)
+            bufnr, num_notified, *request_args = event.args
+            event = event._replace(args=[bufnr, *request_args])
+            if nvim_info.reader is not None:
+                # Process the notifications sent before the request first,
+                # up to where the request is scheduled (see schedule_events()).
+                if not nvim_info.reader.wait_received(num_notified):
+                    logger.warning(
+                        "Notifications sent before the request haven't arrived."
+                    )
+                status, num_notifications = process_reader_notifications(
+                    nvim_info, driver, prev_lazy_args_per_buf, request=event
+                )
+                num_received += num_notifications
+                if not status:
+                    return False, None
+
+            if event.name in INTERACTIVE_EVENTS:
+                prev_lazy_args_per_buf.process_on_lines(
+                    event.args[0], nvim_info, driver
+                )
+            with driver_stats.handler(event.name):
+                status, request_event = process_request_event(nvim_info, driver, event)
             if not status:
                 return False, request_event
         else:
             # process and update prev_lazy_args
-            status = process_notification_event(
-                nvim_info, driver, event, prev_lazy_args_per_buf
-            )
+            with driver_stats.handler(event.name):
+                status = process_notification_event(
+                    nvim_info, driver, event, prev_lazy_args_per_buf
+                )
             if not status:
                 return False, None
 
     # After the loop (here) you need to process the last on_lines event.
     prev_lazy_args_per_buf.process_all(nvim_info, driver)
 
+    if num_received > 0:
+        grant_credits(nvim_info.rpc, num_received)
+
+    with driver_stats.handler("render_idle_markdown_cells"):
+        render_idle_markdown_cells(nvim_info, driver)
+    with driver_stats.handler("collect_kernel_replies"):
+        collect_kernel_replies(nvim_info, driver)
+
     return True, None
 
 
+def drop_superseded_events(
+    events: Sequence[Request | Notification],
+) -> list[Request | Notification]:
+    """
+    Discard completions and scrolls that a later one of the same buffer replaces.
+
+    Only the newest one per buffer would have an effect
+    (nvim ignores the completion of an outdated callback_id,
+    see Jupynium_kernel_complete_async_reply),
+    so the others are dropped before they cost any browser call.
+    Requests are kept because nvim is waiting for the response.
+    """
+
+    def supersede_key(event: Request | Notification) -> tuple[str, int] | None:
+        if event.type != "notification":
+            return None
+        if event.name == "kernel_complete_async":
+            return "complete", event.args[0]
+        if event.name in SCROLL_EVENTS:
+            return "scroll", event.args[0]
+        return None
+
+    keys = [supersede_key(event) for event in events]
+    latest: dict[tuple[str, int], int] = {}
+    for idx, key in enumerate(keys):
+        if key is not None:
+            latest[key] = idx
+
+    return [
+        event
+        for idx, (event, key) in enumerate(zip(events, keys))
+        if key is None or latest[key] == idx
+    ]
+
+
+def group_events_by_window(
+    events: Iterable[Request | Notification],
+    window_handles: dict[int, str],
+    current_window: str | None = None,
+) -> list[Request | Notification]:
+    """
+    Process the events of the same notebook window together.
+
+    Each window switch is a round trip to the browser, so the interleaved events
+    of several synced buffers are grouped by window,
+    keeping the order of the events within each window.
+    Events without a window (e.g. options, start_sync) stay where they are,
+    and the groups don't move across them.
+    The group of the current window comes first, because it doesn't need a switch.
+    """
+    grouped: list[Request | Notification] = []
+    # key = window handle, in the order of appearance
+    groups: dict[str, list[Request | Notification]] = {}
+
+    def flush_groups():
+        if current_window in groups:
+            grouped.extend(groups.pop(current_window))
+        for window_events in groups.values():
+            grouped.extend(window_events)
+        groups.clear()
+
+    for event in events:
+        window = window_handles.get(event.args[0])
+        if window is None:
+            flush_groups()
+            grouped.append(event)
+        else:
+            groups.setdefault(window, []).append(event)
+    flush_groups()
+    return grouped
+
+
+def schedule_events(
+    events: Iterable[Request | Notification],
+) -> list[Request | Notification]:
+    """
+    Order a batch of events by priority.
+
+    Text changes and actions are processed in the order they are sent,
+    and selection / scroll updates are lazy anyway (only the latest one matters).
+    Interactive events (e.g. completion) are what the user is waiting for,
+    so they move ahead of those updates and of the other buffers' events.
+    They don't move past their own buffer's text changes and actions,
+    or the other interactive events.
+    """
+    scheduled: list[Request | Notification] = []
+    for event in events:
+        if event.name not in INTERACTIVE_EVENTS:
+            scheduled.append(event)
+            continue
+
+        bufnr = event.args[0]
+        idx = len(scheduled)
+        while idx > 0:
+            prev_event = scheduled[idx - 1]
+            if prev_event.name in INTERACTIVE_EVENTS or (
+                prev_event.args[0] == bufnr
+                and prev_event.name not in SELECTION_EVENTS | SCROLL_EVENTS
+            ):
+                break
+            idx -= 1
+        scheduled.insert(idx, event)
+    return scheduled
+
+
+def process_reader_notifications(
+    nvim_info: NvimInfo,
+    driver: Driver,
+    prev_lazy_args_per_buf: PrevLazyArgsPerBuf,
+    deadline: float | None = None,
+    request: Request | None = None,
+) -> tuple[bool, int]:
+    """
+    Process the notifications received in the background (see NvimReader).
+
+    They are processed in the order of schedule_events().
+
+    Args:
+        nvim_info: the nvim
+        driver: the browser
+        prev_lazy_args_per_buf: lazy on_lines and selections of this cycle
+        deadline: monotonic time. The rest are deferred to the next round.
+        request: a request sent after the notifications.
+            Only the notifications scheduled before it are processed,
+            and the rest are deferred.
+
+    Returns:
+        bool status: False if nvim needs to be cleared up.
+        int: number of notifications received from nvim, to grant the credits back
+    """
+    assert nvim_info.reader is not None
+    notifications, num_received = nvim_info.reader.take()
+    deferred_notifications = nvim_info.deferred_notifications
+    events: list[Request | Notification] = [*deferred_notifications, *notifications]
+    if request is not None:
+        events.append(request)
+    scheduled = deque(
+        schedule_events(
+            group_events_by_window(
+                drop_superseded_events(events),
+                nvim_info.window_handles,
+                getattr(driver, "known_window_handle", None),
+            )
+        )
+    )
+    deferred_notifications.clear()
+
+    try:
+        while len(scheduled) > 0:
+            event = scheduled.popleft()
+            if event.type == "request":
+                # `request`, which the caller processes.
+                break
+            logger.info(f"Event from nvim: {event}")
+            with driver_stats.handler(event.name):
+                status = process_notification_event(
+                    nvim_info, driver, event, prev_lazy_args_per_buf
+                )
+            if not status:
+                return False, num_received
+            if (
+                request is None
+                and deadline is not None
+                and time.monotonic() >= deadline
+            ):
+                break
+    finally:
+        # The rest are left for the next round.
+        deferred_notifications.extend(
+            event for event in scheduled if event.type == "notification"
+        )
+    return True, num_received
+
+
+def render_idle_markdown_cells(nvim_info: NvimInfo, driver: Driver):
+    """
+    Render edited markdown cells after a while without changes.
+
+    Markdown cells are not rendered on every change because it can be slow
+    (e.g. MathJax). They are rendered when the cursor leaves the cell, when
+    requested (:JupyniumRenderMarkdown), or after some idle time (here).
+    """
+    nvim_info.next_timer = None
+    pending_bufnrs = [
+        bufnr
+        for bufnr, jupbuf in nvim_info.jupbufs.items()
+        if len(jupbuf.shadow.unrendered) > 0
+    ]
+    if len(pending_bufnrs) == 0:
+        return
+
+    idle_timeout = nvim_info.get_option("jupynium_markdown_render_idle_timeout", 1.0)
+    for bufnr in pending_bufnrs:
+        jupbuf = nvim_info.jupbufs[bufnr]
+        render_time = jupbuf.shadow.last_modified + idle_timeout
+        if time.monotonic() >= render_time:
+            driver.switch_to.window(nvim_info.window_handles[bufnr])
+            jupbuf.render_markdown_cells(driver)
+        elif nvim_info.next_timer is None or render_time < nvim_info.next_timer:
+            # Come back when it's time to render.
+            nvim_info.next_timer = render_time
+
+
+def collect_kernel_replies(nvim_info: NvimInfo, driver: Driver):
+    """
+    Deliver the replies of kernel completion / inspection that have arrived.
+
+    Come back soon while some are still running (see KernelRequests).
+    """
+    if len(nvim_info.kernel_requests) == 0:
+        return
+
+    finished = nvim_info.kernel_requests.collect(
+        driver, nvim_info.window_handles.values()
+    )
+    for request, reply in finished:
+        if request.name == "kernel_inspect":
+            logger.info(f"Kernel inspect: {reply}")
+            request.response.send(reply)
+            continue
+
+        logger.info(f"Kernel complete: {reply}")
+        if reply is None:
+            logger.info("Getting kernel completion timed out")
+            continue
+
+        # nvim ignores it if a newer request has replaced it.
+        nvim_info.rpc.call_lua(
+            "Jupynium_kernel_complete_async_reply",
+            request.callback_id,
+            kernel_complete_matches(reply, request.completion_plugin),
+        )
+
+    if len(nvim_info.kernel_requests) > 0:
+        poll_time = time.monotonic() + KERNEL_REQUEST_POLL_INTERVAL
+        if nvim_info.next_timer is None or poll_time < nvim_info.next_timer:
+            nvim_info.next_timer = poll_time
+
+
+def kernel_complete_matches(reply: dict, completion_plugin: str | None):
+    """
+    Convert the kernel's complete_reply to completion items.
+
+    Returns:
+        list of items for nvim-cmp, or a dict of items for blink.cmp
+    """
+    # Code from jupyter-kernel.nvim
+    has_experimental_types = (
+        "metadata" in reply and "_jupyter_types_experimental" in reply["metadata"]
+    )
+
+    if has_experimental_types:
+        replies = reply["metadata"]["_jupyter_types_experimental"]
+        matches = []
+        for match in replies:
+            if "signature" in match and match["signature"] != "":
+                matches.append(
+                    {
+                        "label": match.get("text", ""),
+                        "documentation": {
+                            "kind": "markdown",
+                            "value": f"```python\n{match['signature']}\n```",
+                        },
+                        # default kind: text = 1
+                        # sometimes match['type'] is '<unknown>'
+                        "kind": CompletionItemKind.get(match.get("type", "text"), 1),
+                    }
+                )
+            else:
+                matches.append(
+                    {
+                        "label": match.get("text", ""),
+                        # default kind: text = 1
+                        # sometimes match['type'] is '<unknown>'
+                        "kind": CompletionItemKind.get(match.get("type", "text"), 1),
+                    }
+                )
+    else:
+        matches = [{"label": m} for m in reply["matches"]]
+
+    if completion_plugin == "nvim-cmp":
+        return matches
+    if completion_plugin == "blink":
+        return {
+            "is_incomplete_forward": False,
+            "is_incomplete_backward": False,
+            "items": matches,
+            # context = context,
+        }
+    raise ValueError(f"Unknown completion plugin: {completion_plugin}")
+
+
 def start_sync_with_filename(
     bufnr: int,
     ipynb_filename: str,
@@ -245,7 +684,7 @@ def start_sync_with_filename(
     buf_filetype: str,
     conda_or_venv_path: str | None,
     nvim_info: NvimInfo,
-    driver: WebDriver,
+    driver: Driver,
 ):
     """
     Start sync using a filename (not tab index).
@@ -293,6 +732,7 @@ def start_sync_with_filename(
         sele.wait_until_notebook_loaded(driver)
 
         if ask:
+            nvim_info.rpc.flush()
             sync_input = nvim_info.nvim.eval(
                 """input("Press 'v' to sync from n[v]im, 'i' to load from [i]pynb and sync. (v/i/[c]ancel): ")"""
             )
@@ -303,15 +743,15 @@ def start_sync_with_filename(
 
         if sync_input in ["v", "V"]:
             # Start sync from vim to ipynb tab
-            nvim_info.attach_buffer(bufnr, content, new_window)
+            nvim_info.attach_buffer(bufnr, content, new_window, driver)
             nvim_info.jupbufs[bufnr].full_sync_to_notebook(driver)
         elif sync_input in ["i", "I"]:
             # load from ipynb tab and start sync
-            cell_types, texts = driver.execute_script(get_cell_inputs_js_code)
+            cell_types, texts, _ = execute_pinned_script(driver, "get_cell_inputs")
             jupy = cells_to_jupytext(cell_types, texts)
             nvim_info.nvim.buffers[bufnr][:] = jupy
 
-            nvim_info.attach_buffer(bufnr, jupy, new_window)
+            nvim_info.attach_buffer(bufnr, jupy, new_window, driver)
     else:
         new_btn = driver.find_element(By.ID, "new-buttons")
         driver.execute_script("arguments[0].scrollIntoView(true);", new_btn)
@@ -351,12 +791,12 @@ def start_sync_with_filename(
                 ipynb_filename,
             )
         # start sync
-        nvim_info.attach_buffer(bufnr, content, driver.current_window_handle)
+        nvim_info.attach_buffer(bufnr, content, driver.current_window_handle, driver)
         nvim_info.jupbufs[bufnr].full_sync_to_notebook(driver)
 
 
 def choose_default_kernel(  # noqa: PLR0911
-    driver: WebDriver, page_type: str, buf_filetype: str, conda_or_venv_path: str | None
+    driver: Driver, page_type: str, buf_filetype: str, conda_or_venv_path: str | None
 ):
     """Choose kernel based on buffer's filetype and conda env."""
     if page_type == "notebook":
@@ -436,7 +876,7 @@ def choose_default_kernel(  # noqa: PLR0911
     return None
 
 
-def process_request_event(nvim_info: NvimInfo, driver: WebDriver, event: Request):  # noqa: PLR0911
+def process_request_event(nvim_info: NvimInfo, driver: Driver, event: Request):  # noqa: PLR0911
     """
     Process a request event, where an event can be request or notification.
 
@@ -476,8 +916,8 @@ def process_request_event(nvim_info: NvimInfo, driver: WebDriver, event: Request
                     driver=driver,
                 )
             except StartSyncError as e:
-                nvim_info.nvim.lua.Jupynium_notify.error(
-                    ["Error while starting sync:", str(e)], async_=True
+                nvim_info.rpc.call_lua(
+                    "Jupynium_notify.error", ["Error while starting sync:", str(e)]
                 )
                 event.response.send("N")
                 return False, None
@@ -488,12 +928,15 @@ def process_request_event(nvim_info: NvimInfo, driver: WebDriver, event: Request
 
             continue_input = "y"
             if ask:
+                nvim_info.rpc.flush()
                 continue_input = nvim_info.nvim.eval(
                     "input('This will remove all content from the Notebook. "
                     "Continue? (y/n): ')"
                 )
             if continue_input in ["y", "Y"]:
-                nvim_info.attach_buffer(bufnr, content, driver.current_window_handle)
+                nvim_info.attach_buffer(
+                    bufnr, content, driver.current_window_handle, driver
+                )
                 nvim_info.jupbufs[bufnr].full_sync_to_notebook(driver)
                 ## Automatically setting kernel not activated when sync with tab index
                 ## In the future we could activate by doing the following
@@ -511,9 +954,8 @@ def process_request_event(nvim_info: NvimInfo, driver: WebDriver, event: Request
     elif event.name == "load_from_ipynb_tab":
         (tab_idx,) = event_args
         if tab_idx > len(driver.window_handles) or tab_idx < 1:
-            nvim_info.nvim.lua.Jupynium_notify.error(
-                [f"Tab {tab_idx} doesn't exist."],
-                async_=True,
+            nvim_info.rpc.call_lua(
+                "Jupynium_notify.error", [f"Tab {tab_idx} doesn't exist."]
             )
             event.response.send("N")
             return False, None
@@ -529,7 +971,7 @@ def process_request_event(nvim_info: NvimInfo, driver: WebDriver, event: Request
         logger.info(f"Current kernel name: {kernel_name}")
         logger.info(f"Kernel language: {kernel_language}")
 
-        cell_types, texts = driver.execute_script(get_cell_inputs_js_code)
+        cell_types, texts, _ = execute_pinned_script(driver, "get_cell_inputs")
         jupy = cells_to_jupytext(cell_types, texts, python=kernel_language == "python")
         nvim_info.nvim.buffers[bufnr][:] = jupy
         logger.info("Loaded ipynb to the nvim buffer.")
@@ -550,11 +992,21 @@ def process_request_event(nvim_info: NvimInfo, driver: WebDriver, event: Request
         return True, None
 
     elif event.name == "kernel_inspect":
+        # Respond when the kernel replies (see collect_kernel_replies()),
+        # and process the other nvims in the meantime.
         line, col = event_args
-        driver.switch_to.window(nvim_info.window_handles[bufnr])
-        inspect_result = driver.execute_async_script(kernel_inspect_js_code, line, col)
-        logger.info(f"Kernel inspect: {inspect_result}")
-        event.response.send(inspect_result)
+        nvim_info.kernel_requests.start(
+            driver,
+            KernelRequest(
+                event.name,
+                bufnr,
+                nvim_info.window_handles[bufnr],
+                response=event.response,
+            ),
+            "inspect",
+            line,
+            col,
+        )
         return True, None
 
     elif event.name == "execute_javascript":
@@ -568,6 +1020,13 @@ def process_request_event(nvim_info: NvimInfo, driver: WebDriver, event: Request
         event.response.send(ret_obj)
         return True, None
 
+    elif event.name == "driver_stats":
+        (reset,) = event_args
+        event.response.send(driver_stats.command_stats.summary())
+        if reset:
+            driver_stats.command_stats.reset()
+        return True, None
+
     elif event.name == "kernel_connect_info":
         driver.switch_to.window(nvim_info.window_handles[bufnr])
         kernel_id = driver.execute_script("return Jupyter.notebook.kernel.id")
@@ -580,21 +1039,6 @@ def process_request_event(nvim_info: NvimInfo, driver: WebDriver, event: Request
     return True, None
 
 
-def skip_bloated(nvim_info: NvimInfo):
-    if nvim_info.nvim.vars["jupynium_message_bloated"]:
-        logger.info("Message bloated. Skipping..")
-        if len_pending_messages(nvim_info.nvim) == 0:
-            nvim_info.nvim.vars["jupynium_num_pending_msgs"] = 0
-            nvim_info.nvim.vars["jupynium_message_bloated"] = False
-
-            logger.info("Reloading all buffers from nvim")
-            for buf_id in nvim_info.jupbufs:
-                nvim_info.nvim.lua.Jupynium_grab_entire_buffer(buf_id)
-
-        return True
-    return False
-
-
 def lazy_on_lines_event(
     nvim_info: NvimInfo,
     driver,
@@ -608,8 +1052,9 @@ def lazy_on_lines_event(
     Often, completion plugins like coc.nvim and nvim-cmp spams on_lines events.
     But they will have the same (bufnr, start_row, old_end_row, new_end_row) values.
     If the series of line changes are chainable, we can just process the last one.
-    In order to do that, process the previous on_lines only if current on_lines is
-    not chainable.
+    If not, they are merged into one range that covers both changes,
+    so there is only one update per buffer for each cycle of events.
+    The previous on_lines is processed only if they cannot be merged.
     After the loop you need to process the last one as well.
     """
     if previous_on_lines is None:
@@ -618,6 +1063,13 @@ def lazy_on_lines_event(
     if previous_on_lines.is_chainable(current_on_lines):
         return previous_on_lines.chain(current_on_lines)
 
+    # Otherwise, merge them into one range so that the notebook is updated once.
+    merged_on_lines = previous_on_lines.merge(
+        current_on_lines, nvim_info.jupbufs[bufnr].buf
+    )
+    if merged_on_lines is not None:
+        return merged_on_lines
+
     process_on_lines_event(nvim_info, driver, bufnr, previous_on_lines)
     return current_on_lines
 
@@ -639,15 +1091,12 @@ def process_on_lines_event(
 
 def process_notification_event(  # noqa: C901 PLR0912 PLR0915
     nvim_info: NvimInfo,
-    driver: WebDriver,
+    driver: Driver,
     event: Notification,
     prev_lazy_args_per_buf: PrevLazyArgsPerBuf | None = None,
 ):
     assert event.type == "notification"
 
-    if skip_bloated(nvim_info):
-        return True
-
     bufnr = event.args[0]
     event_args = event.args[1:]
     if event.name == "on_lines":
@@ -659,12 +1108,7 @@ def process_notification_event(  # noqa: C901 PLR0912 PLR0915
             prev_lazy_args_per_buf.lazy_on_lines_event(
                 nvim_info, driver, bufnr, current_on_lines
             )
-    elif event.name in [
-        "CursorMoved",
-        "CursorMovedI",
-        "visual_enter",
-        "visual_leave",
-    ]:
+    elif event.name in SELECTION_EVENTS:
         current_args = UpdateSelectionArgs(*event_args)
 
         if prev_lazy_args_per_buf is not None:
@@ -673,10 +1117,21 @@ def process_notification_event(  # noqa: C901 PLR0912 PLR0915
             prev_lazy_args_per_buf.overwrite_update_selection(bufnr, current_args)
         else:
             update_cell_selection(nvim_info, driver, bufnr, current_args)
+    elif event.name in SCROLL_EVENTS:
+        current_args = ScrollArgs(event.name, *event_args)
+
+        if prev_lazy_args_per_buf is not None:
+            prev_lazy_args_per_buf.overwrite_scroll(bufnr, current_args)
+        else:
+            process_scroll_event(nvim_info, driver, bufnr, current_args)
     else:
         # For all the other events, it requires lazy events to be performed in advance.
+        # Interactive events only need the text, and the rest can wait.
         if prev_lazy_args_per_buf is not None:
-            prev_lazy_args_per_buf.process(bufnr, nvim_info, driver)
+            if event.name in INTERACTIVE_EVENTS:
+                prev_lazy_args_per_buf.process_on_lines(bufnr, nvim_info, driver)
+            else:
+                prev_lazy_args_per_buf.process(bufnr, nvim_info, driver)
 
         if event.name == "scroll_ipynb":
             (scroll,) = event_args
@@ -699,9 +1154,8 @@ def process_notification_event(  # noqa: C901 PLR0912 PLR0915
             driver.execute_script("Jupyter.notebook.save_notebook();")
             driver.execute_script("Jupyter.notebook.save_checkpoint();")
 
-            if (
-                ".ju." in buf_filepath
-                and nvim_info.nvim.vars["jupynium_auto_download_ipynb"]
+            if ".ju." in buf_filepath and nvim_info.get_option(
+                "jupynium_auto_download_ipynb", default=True
             ):
                 # .ju.py -> .ipynb
                 output_ipynb_path = os.path.splitext(buf_filepath)[0]  # noqa: PTH122
@@ -738,10 +1192,10 @@ def process_notification_event(  # noqa: C901 PLR0912 PLR0915
             try:
                 download_ipynb(driver, nvim_info, bufnr, output_ipynb_path)
             except OSError as e:
-                nvim_info.nvim.lua.Jupynium_notify.error(
-                    ["Failed to download ipynb file to", output_ipynb_path],
+                nvim_info.rpc.call_lua(
+                    "Jupynium_notify.error",
+                    ["Failed to download ipynb file to", str(output_ipynb_path)],
                     "error_download_ipynb",
-                    async_=True,
                 )
                 logger.error(
                     f"Failed to download ipynb with error: {e}.\n"
@@ -775,89 +1229,34 @@ def process_notification_event(  # noqa: C901 PLR0912 PLR0915
             driver.execute_script(
                 "Jupyter.kernelselector.set_kernel(arguments[0])", kernel_name
             )
+            # A new kernel has a new ID.
+            nvim_info.kernel_requests.forget_client(nvim_info.window_handles[bufnr])
         elif event.name == "kernel_complete_async":
+            # The outdated ones in the same batch are already dropped
+            # (see drop_superseded_events()).
+            # The reply is delivered later (see collect_kernel_replies()).
             line, col, callback_id, completion_plugin = event_args
-            if (
-                nvim_info.nvim.vars["jupynium_kernel_complete_async_callback_id"]
-                != callback_id
-            ):
-                logger.info("Ignoring outdated kernel_complete_async request")
-                return True
-            driver.switch_to.window(nvim_info.window_handles[bufnr])
-            reply = driver.execute_async_script(kernel_complete_js_code, line, col)
-            logger.info(f"Kernel complete: {reply}")
-
-            if reply is None:
-                logger.info("Getting kernel completion timed out")
-                return True
-
-            # Code from jupyter-kernel.nvim
-            has_experimental_types = (
-                "metadata" in reply
-                and "_jupyter_types_experimental" in reply["metadata"]
+            nvim_info.kernel_requests.start(
+                driver,
+                KernelRequest(
+                    event.name,
+                    bufnr,
+                    nvim_info.window_handles[bufnr],
+                    callback_id=callback_id,
+                    completion_plugin=completion_plugin,
+                ),
+                "complete",
+                line,
+                col,
             )
 
-            if has_experimental_types:
-                replies = reply["metadata"]["_jupyter_types_experimental"]
-                matches = []
-                for match in replies:
-                    if "signature" in match and match["signature"] != "":
-                        matches.append(
-                            {
-                                "label": match.get("text", ""),
-                                "documentation": {
-                                    "kind": "markdown",
-                                    "value": f"```python\n{match['signature']}\n```",
-                                },
-                                # default kind: text = 1
-                                # sometimes match['type'] is '<unknown>'
-                                "kind": CompletionItemKind.get(
-                                    match.get("type", "text"), 1
-                                ),
-                            }
-                        )
-                    else:
-                        matches.append(
-                            {
-                                "label": match.get("text", ""),
-                                # default kind: text = 1
-                                # sometimes match['type'] is '<unknown>'
-                                "kind": CompletionItemKind.get(
-                                    match.get("type", "text"), 1
-                                ),
-                            }
-                        )
-            else:
-                matches = [{"label": m} for m in reply["matches"]]
-
-            if completion_plugin == "nvim-cmp":
-                pass
-            elif completion_plugin == "blink":
-                matches = {
-                    "is_incomplete_forward": False,
-                    "is_incomplete_backward": False,
-                    "items": matches,
-                    # context = context,
-                }
-            else:
-                raise ValueError(f"Unknown completion plugin: {completion_plugin}")
-
-            if (
-                nvim_info.nvim.vars["jupynium_kernel_complete_async_callback_id"]
-                != callback_id
-            ):
-                logger.info("Ignoring outdated kernel_complete_async request")
-                return True
-
-            nvim_info.nvim.lua.Jupynium_kernel_complete_async_callback(matches)
-
-        elif event.name == "scroll_to_cell":
-            (cursor_pos_row,) = event_args
-            scroll_to_cell(driver, nvim_info, bufnr, cursor_pos_row)
+        elif event.name == "options":
+            (options,) = event_args
+            nvim_info.options = options
 
-        elif event.name == "scroll_to_output":
-            (cursor_pos_row,) = event_args
-            scroll_to_output(driver, nvim_info, bufnr, cursor_pos_row)
+        elif event.name == "render_markdown":
+            driver.switch_to.window(nvim_info.window_handles[bufnr])
+            nvim_info.jupbufs[bufnr].render_markdown_cells(driver)
 
         elif event.name == "grab_entire_buf":
             # Refresh entire buffer from nvim
@@ -865,9 +1264,15 @@ def process_notification_event(  # noqa: C901 PLR0912 PLR0915
             # because it happens when you spam events and it slows down.
             (content,) = event_args
 
-            nvim_info.jupbufs[bufnr] = JupyniumBuffer(content)
+            new_jupbuf = JupyniumBuffer(content)
+            # The notebook hasn't changed, so keep what we know about it.
+            new_jupbuf.shadow = nvim_info.jupbufs[bufnr].shadow
+            nvim_info.jupbufs[bufnr] = new_jupbuf
             if driver.current_window_handle == nvim_info.window_handles[bufnr]:
-                nvim_info.jupbufs[bufnr].full_sync_to_notebook(driver)
+                # Also overwrite what has been edited in the browser
+                # since the model was last verified.
+                new_jupbuf.shadow.invalidate()
+                new_jupbuf.full_sync_to_notebook(driver)
 
         elif event.name == "BufUnload":
             logger.info("Buffer unloaded on nvim. Closing on Jupyter Notebook")
@@ -887,7 +1292,7 @@ def process_notification_event(  # noqa: C901 PLR0912 PLR0915
 
 def update_cell_selection(
     nvim_info: NvimInfo,
-    driver: WebDriver,
+    driver: Driver,
     bufnr: int,
     update_selection_args: UpdateSelectionArgs,
 ):
@@ -937,13 +1342,20 @@ def update_cell_selection(
 
         driver.switch_to.window(nvim_info.window_handles[bufnr])
 
-        selection_updated = driver.execute_script(
-            update_cell_selection_js_code, cell_index, cell_index_visual
+        selection_updated = execute_pinned_script(
+            driver, "update_cell_selection", cell_index, cell_index_visual
         )
 
-        autoscroll_enable = nvim_info.nvim.vars.get("jupynium_autoscroll_enable", True)
-        autoscroll_mode = nvim_info.nvim.vars.get("jupynium_autoscroll_mode", "always")
-        autoscroll_focus = nvim_info.nvim.vars.get("jupynium_autoscroll_focus", "input")
+        # Render the markdown cells that the cursor has left.
+        nvim_info.jupbufs[bufnr].render_markdown_cells(
+            driver, except_cell_idx=cell_index
+        )
+
+        autoscroll_enable = nvim_info.get_option(
+            "jupynium_autoscroll_enable", default=True
+        )
+        autoscroll_mode = nvim_info.get_option("jupynium_autoscroll_mode", "always")
+        autoscroll_focus = nvim_info.get_option("jupynium_autoscroll_focus", "input")
         if selection_updated and autoscroll_enable:
             if autoscroll_mode == "always":
                 do_scroll = True
@@ -962,7 +1374,7 @@ def update_cell_selection(
 
 
 def download_ipynb(
-    driver: WebDriver,
+    driver: Driver,
     nvim_info: NvimInfo,
     bufnr: int,
     output_ipynb_path: str | PathLike,
@@ -978,15 +1390,24 @@ def download_ipynb(
             f,
             indent=4,
         )
-        nvim_info.nvim.lua.Jupynium_notify.info(
+        nvim_info.rpc.call_lua(
+            "Jupynium_notify.info",
             ["Downloaded ipynb file to", output_ipynb_path],
             "download_ipynb",
-            async_=True,
         )
         logger.info(f"Downloaded ipynb to {output_ipynb_path}")
 
 
-def scroll_to_cell(driver: WebDriver, nvim_info: NvimInfo, bufnr: int, cursor_pos_row):
+def process_scroll_event(
+    nvim_info: NvimInfo, driver: Driver, bufnr: int, scroll_args: ScrollArgs
+):
+    if scroll_args.event_name == "scroll_to_cell":
+        scroll_to_cell(driver, nvim_info, bufnr, scroll_args.cursor_pos_row)
+    else:
+        scroll_to_output(driver, nvim_info, bufnr, scroll_args.cursor_pos_row)
+
+
+def scroll_to_cell(driver: Driver, nvim_info: NvimInfo, bufnr: int, cursor_pos_row):
     # Which cell?
     cell_index, _, _ = nvim_info.jupbufs[bufnr].get_cell_index_from_row(cursor_pos_row)
 
@@ -994,7 +1415,7 @@ def scroll_to_cell(driver: WebDriver, nvim_info: NvimInfo, bufnr: int, cursor_po
 
     driver.switch_to.window(nvim_info.window_handles[bufnr])
 
-    top_margin_percent = nvim_info.nvim.vars.get(
+    top_margin_percent = nvim_info.get_option(
         "jupynium_autoscroll_cell_top_margin_percent", 0
     )
     driver.execute_script(
@@ -1004,9 +1425,7 @@ def scroll_to_cell(driver: WebDriver, nvim_info: NvimInfo, bufnr: int, cursor_po
     )
 
 
-def scroll_to_output(
-    driver: WebDriver, nvim_info: NvimInfo, bufnr: int, cursor_pos_row
-):
+def scroll_to_output(driver: Driver, nvim_info: NvimInfo, bufnr: int, cursor_pos_row):
     # Which cell?
     cell_index, _, _ = nvim_info.jupbufs[bufnr].get_cell_index_from_row(cursor_pos_row)
 
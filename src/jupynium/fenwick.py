@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over a list of non-negative integers.
+
+    Used to answer "which cell is row N in" and "where does cell N start" in
+    O(log n) instead of walking the list of rows per cell.
+    Point updates are O(log n). Inserting or deleting an element requires a rebuild.
+    """
+
+    def __init__(self, values: Iterable[int] = ()):
+        self.build(values)
+
+    def build(self, values: Iterable[int]):
+        """Rebuild the tree in O(n)."""
+        tree = [0]
+        tree.extend(values)
+        size = len(tree) - 1
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._size = size
+
+    def add(self, idx: int, delta: int):
+        """Add delta to the idx-th (0-indexed) element."""
+        if not 0 <= idx < self._size:
+            raise IndexError(f"FenwickTree index {idx} out of range")
+        i = idx + 1
+        tree = self._tree
+        size = self._size
+        while i <= size:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, n: int) -> int:
+        """Sum of the first n elements."""
+        i = min(n, self._size)
+        total = 0
+        tree = self._tree
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def search(self, value: int) -> tuple[int, int]:
+        """
+        Find the first element where the running sum exceeds value.
+
+        Elements equal to zero are skipped, just like a linear scan would do.
+
+        Returns:
+            int: index of the element. Equals len(self) if value >= total.
+            int: sum of all elements before that index.
+        """
+        pos = 0
+        remaining = value
+        tree = self._tree
+        step = 1 << self._size.bit_length()
+        while step > 0:
+            nxt = pos + step
+            if nxt <= self._size and tree[nxt] <= remaining:
+                pos = nxt
+                remaining -= tree[nxt]
+            step >>= 1
+        return pos, value - remaining
+
+    @property
+    def total(self) -> int:
+        return self.prefix_sum(self._size)
+
+    def __len__(self):
+        return self._size
@@ -0,0 +1,122 @@
+// Apply a batch of notebook operations in a single execute_script call.
+// arguments[0]: list of operations. Each operation is an array of
+//   ['delete', cell_idx]
+//   ['insert', cell_idx, cell_type]
+//   ['cell_type', cell_idx, cell_type]
+//   ['resize', num_cells]            append or remove cells at the end
+//   ['expect_ncells', num_cells]     abort the rest if the number of cells differs
+//   ['set_text', start_cell_idx, [text, ...]]
+//   ['replace_lines', cell_idx, start_line, end_line, [line, ...]]
+//                                    replace lines [start_line, end_line) of the cell
+//   ['markdown_file', text]          whole buffer as a single markdown cell
+//   ['render', [cell_idx, ...]]      render markdown cells
+//   ['load', [[cell_type, text], ...]]
+//                                    replace all cells at once. Outputs of the cells
+//                                    with the same type and text are kept.
+// Setting text does not render markdown cells. It is deferred to the 'render' operation.
+// Returns the number of cells after applying the operations.
+var ops = arguments[0]
+var notebook = Jupyter.notebook
+
+for (var i = 0; i < ops.length; i++) {
+  var op = ops[i]
+  if (op[0] === 'delete') {
+    notebook.delete_cell(op[1])
+  } else if (op[0] === 'insert') {
+    if (op[1] === 0) {
+      notebook.insert_cell_above(op[2], 0)
+    } else {
+      notebook.insert_cell_below(op[2], op[1] - 1)
+    }
+  } else if (op[0] === 'cell_type') {
+    if (op[2] === 'markdown') {
+      notebook.cells_to_markdown([op[1]])
+    } else {
+      notebook.cells_to_code([op[1]])
+    }
+  } else if (op[0] === 'resize') {
+    while (notebook.ncells() < op[1]) {
+      notebook.insert_cell_below('code', notebook.ncells() - 1)
+    }
+    while (notebook.ncells() > op[1]) {
+      notebook.delete_cell(notebook.ncells() - 1)
+    }
+  } else if (op[0] === 'expect_ncells') {
+    if (notebook.ncells() !== op[1]) {
+      return notebook.ncells()
+    }
+  } else if (op[0] === 'set_text') {
+    var cells = notebook.get_cells()
+    var texts = op[2]
+    for (var j = 0; j < texts.length; j++) {
+      var cell = cells[op[1] + j]
+      cell.set_text(texts[j])
+    }
+  } else if (op[0] === 'replace_lines') {
+    // Only the changed lines are transferred and re-highlighted.
+    var cell = notebook.get_cell(op[1])
+    var cm = cell.code_mirror
+    var start_line = op[2]
+    var end_line = op[3]
+    var lines = op[4]
+    if (end_line < cm.lineCount()) {
+      var text = lines.length > 0 ? lines.join('\n') + '\n' : ''
+      cm.replaceRange(text, { line: start_line, ch: 0 }, { line: end_line, ch: 0 })
+    } else if (start_line > 0) {
+      // Replacing up to the end of the cell. Start from the end of the previous line.
+      var text = lines.length > 0 ? '\n' + lines.join('\n') : ''
+      cm.replaceRange(
+        text,
+        { line: start_line - 1, ch: cm.getLine(start_line - 1).length },
+        { line: end_line - 1, ch: cm.getLine(end_line - 1).length }
+      )
+    } else {
+      cell.set_text(lines.join('\n'))
+    }
+    if (cell.cell_type === 'markdown') {
+      // Show the source, like set_text does.
+      cell.unrender()
+    }
+  } else if (op[0] === 'markdown_file') {
+    notebook.cells_to_markdown([0])
+    notebook.get_cell(0).set_text(op[1])
+  } else if (op[0] === 'load') {
+    var old_cells = notebook.get_cells()
+    var old_cells_json = new Map()
+    for (var j = 0; j < old_cells.length; j++) {
+      var key = old_cells[j].cell_type + '\n' + old_cells[j].get_text()
+      if (!old_cells_json.has(key)) {
+        old_cells_json.set(key, [])
+      }
+      old_cells_json.get(key).push(old_cells[j].toJSON())
+    }
+
+    // Append the new cells and then delete the old ones,
+    // so that the notebook never becomes empty.
+    var new_cells = op[1]
+    for (var j = 0; j < new_cells.length; j++) {
+      var cell = notebook.insert_cell_at_index(new_cells[j][0], old_cells.length + j)
+      var matches = old_cells_json.get(new_cells[j][0] + '\n' + new_cells[j][1])
+      if (matches !== undefined && matches.length > 0) {
+        cell.fromJSON(matches.shift())
+      } else {
+        cell.set_text(new_cells[j][1])
+      }
+    }
+    var old_cell_indices = Array(old_cells.length)
+    for (var j = 0; j < old_cells.length; j++) {
+      old_cell_indices[j] = j
+    }
+    notebook.delete_cells(old_cell_indices)
+  } else if (op[0] === 'render') {
+    for (var j = 0; j < op[1].length; j++) {
+      var cell = notebook.get_cell(op[1][j])
+      if (cell.cell_type === 'markdown') {
+        cell.unrender()
+        cell.render()
+      }
+    }
+  }
+}
+
+return notebook.ncells()
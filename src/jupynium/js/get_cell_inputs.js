@@ -1,8 +1,11 @@
 var cells = Jupyter.notebook.get_cells()
 var cell_types = Array(cells.length)
 var inputs = Array(cells.length)
+// Markdown cells that are edited but not rendered yet, are shown as source.
+var rendered = Array(cells.length)
 for (i = 0; i < cells.length; i++) {
   cell_types[i] = cells[i].cell_type
   inputs[i] = cells[i].get_text()
+  rendered[i] = cells[i].cell_type !== 'markdown' || cells[i].rendered === true
 }
-return [cell_types, inputs]
+return [cell_types, inputs, rendered]
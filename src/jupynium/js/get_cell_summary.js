@@ -0,0 +1,8 @@
+// Cheap summary of the notebook, to check if it matches what we have sent.
+// Returns [[cell_type, text_length], ...]
+var cells = Jupyter.notebook.get_cells()
+var summary = Array(cells.length)
+for (var i = 0; i < cells.length; i++) {
+  summary[i] = [cells[i].cell_type, cells[i].get_text().length]
+}
+return summary
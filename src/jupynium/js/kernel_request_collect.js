@@ -0,0 +1,16 @@
+// Take the replies of the requests started by kernel_request_start.js.
+// arguments: request ids
+// Returns [request id, reply] of the finished ones. The reply is null if timed out.
+
+var replies = window.jupynium_kernel_replies
+var finished = []
+if (replies !== undefined) {
+  for (var i = 0; i < arguments[0].length; i++) {
+    var request_id = arguments[0][i]
+    if (request_id in replies) {
+      finished.push([request_id, replies[request_id]])
+      delete replies[request_id]
+    }
+  }
+}
+return finished
@@ -0,0 +1,38 @@
+// Start a kernel completion or inspection without waiting for the reply.
+// The reply is kept in the page until kernel_request_collect.js takes it.
+// Inspired by lkhphuc/jupyter-kernel.nvim
+// arguments: request id, "complete" or "inspect", a line of code, cursor position,
+//            timeout in milliseconds
+
+var request_id = arguments[0]
+var kind = arguments[1]
+var code = arguments[2]
+var cursor_pos = arguments[3]
+var timeout = arguments[4]
+
+if (window.jupynium_kernel_replies === undefined) {
+  window.jupynium_kernel_replies = {}
+}
+var replies = window.jupynium_kernel_replies
+
+var done = false
+function callback(result) {
+  if (!done) {
+    done = true
+    replies[request_id] = result.content
+  }
+}
+
+if (kind === "complete") {
+  Jupyter.notebook.kernel.complete(code, cursor_pos, callback)
+} else {
+  Jupyter.notebook.kernel.inspect(code, cursor_pos, callback)
+}
+
+// Give up if the kernel is busy for too long.
+setTimeout(function () {
+  if (!done) {
+    done = true
+    replies[request_id] = null
+  }
+}, timeout)
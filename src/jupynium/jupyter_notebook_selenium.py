@@ -1,15 +1,18 @@
 from __future__ import annotations
 
 import logging
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
+
+from .pinned_scripts import execute_pinned_script
 
 if TYPE_CHECKING:
-    from selenium.webdriver.remote.webdriver import WebDriver
+    from .driver_protocol import Driver
+    from .notebook_shadow import NotebookShadow
 
 logger = logging.getLogger(__name__)
 
 
-def insert_cell_at(driver: WebDriver, cell_type: str, cell_idx: int):
+def insert_cell_at(driver: Driver, cell_type: str, cell_idx: int):
     """
     Instead of insert_cell_below or insert_cell_above, it will select based on the given index.
 
@@ -31,3 +34,119 @@ def insert_cell_at(driver: WebDriver, cell_type: str, cell_idx: int):
             cell_type,
             cell_idx - 1,
         )
+
+
+class NotebookTransaction:
+    """
+    Collect notebook operations and apply them with a single `execute_script` call.
+
+    Each `execute_script` is a full WebDriver round trip,
+    so instead of deleting, inserting, converting and setting text cell by cell,
+    encode everything for one sync as a list of operations (see apply_notebook_ops.js).
+
+    Cell indices are Notebook indices (cell 1 in JupyniumBuffer is cell 0 in Notebook).
+    If a NotebookShadow is given, it mirrors the operations as they are added,
+    and is invalidated if the result of the commit disagrees.
+    """
+
+    def __init__(self, shadow: NotebookShadow | None = None):
+        self.ops: list[list[Any]] = []
+        self.shadow = shadow
+        self._expected_ncells: int | None = None
+
+    def _add_op(self, op: list[Any]):
+        self.ops.append(op)
+        if self.shadow is not None:
+            self.shadow.apply_op(op)
+
+    def delete_cell(self, cell_idx: int):
+        logger.info(f"Deleting cell {cell_idx} from Notebook")
+        self._add_op(["delete", cell_idx])
+
+    def insert_cell(self, cell_idx: int, cell_type: str):
+        """
+        If cell_idx == 0, insert above, otherwise insert below cell_idx - 1.
+        """
+        assert cell_type in ["code", "markdown"]
+        logger.info(f"Inserting {cell_type} cell {cell_idx} in Notebook")
+        self._add_op(["insert", cell_idx, cell_type])
+
+    def set_cell_type(self, cell_idx: int, cell_type: str):
+        if cell_type not in ["code", "markdown"]:
+            raise ValueError(f"Unknown cell type {cell_type}")
+        self._add_op(["cell_type", cell_idx, cell_type])
+
+    def resize(self, num_cells: int):
+        """Append or remove cells at the end so that the notebook has num_cells."""
+        self._add_op(["resize", num_cells])
+
+    def expect_ncells(self, num_cells: int):
+        """
+        Skip the rest of the operations if the notebook doesn't have num_cells.
+
+        The caller can tell by comparing the return value of commit().
+        """
+        self._expected_ncells = num_cells
+        self._add_op(["expect_ncells", num_cells])
+
+    def set_cells_text(self, start_cell_idx: int, texts: list[str]):
+        """Set texts of consecutive cells. Markdown cells will be rendered."""
+        self._add_op(["set_text", start_cell_idx, texts])
+
+    def replace_cell_lines(
+        self, cell_idx: int, start_line: int, end_line: int, lines: list[str]
+    ):
+        """
+        Replace lines [start_line, end_line) of a cell, using CodeMirror's replaceRange.
+
+        Unlike set_cells_text, only the changed lines are transferred and re-highlighted.
+        """
+        self._add_op(["replace_lines", cell_idx, start_line, end_line, lines])
+
+    def set_markdown_file_text(self, text: str):
+        """Markdown file mode: the whole buffer is a single markdown cell."""
+        self._add_op(["markdown_file", text])
+
+    def load_cells(self, cell_types: list[str], texts: list[str]):
+        """
+        Replace all cells in one go, instead of inserting and deleting one by one.
+
+        Cells that keep the same type and text keep their outputs.
+        """
+        assert len(cell_types) == len(texts)
+        logger.info(f"Loading {len(cell_types)} cells in Notebook")
+        self._add_op(["load", [list(cell) for cell in zip(cell_types, texts)]])
+
+    def render_markdown_cells(self, cell_indices: list[int]):
+        """Render markdown cells. Setting text doesn't render them."""
+        self._add_op(["render", cell_indices])
+
+    def commit(self, driver: Driver) -> int:
+        """
+        Apply all operations and clear them.
+
+        Returns:
+            int: number of cells in the notebook after applying the operations.
+        """
+        ops = self.ops
+        expected_ncells = self._expected_ncells
+        self.ops = []
+        self._expected_ncells = None
+        try:
+            ncells = execute_pinned_script(driver, "apply_notebook_ops", ops)
+        except Exception:
+            # We don't know how many operations have been applied.
+            if self.shadow is not None:
+                self.shadow.invalidate()
+            raise
+
+        if self.shadow is not None:
+            if expected_ncells is not None and ncells != expected_ncells:
+                # The rest of the operations were not applied.
+                self.shadow.invalidate()
+            else:
+                self.shadow.check_ncells(ncells)
+        return ncells
+
+    def __len__(self):
+        return len(self.ops)
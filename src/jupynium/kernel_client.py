@@ -0,0 +1,191 @@
+"""
+Talk to a kernel directly through the notebook server, without the browser.
+
+Completion and inspection go to the server's kernel channels (websocket)
+instead of `execute_script`, so they don't compete with the text sync
+for the single WebDriver session.
+The replies are received in a background thread.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any
+from urllib.parse import quote, urlencode, urlparse
+
+import websocket
+
+if TYPE_CHECKING:
+    from .driver_protocol import Driver
+
+logger = logging.getLogger(__name__)
+
+# Jupyter messaging protocol
+PROTOCOL_VERSION = "5.3"
+
+
+def kernel_channels_url(server_url: str, kernel_id: str, token: str | None = None):
+    """
+    Websocket URL of the kernel channels.
+
+    Args:
+        server_url: base URL of the notebook server, e.g. http://localhost:8888/
+        kernel_id: e.g. Jupyter.notebook.kernel.id
+        token: the server's token, if not authenticated with cookies
+    """
+    url = urlparse(server_url)
+    scheme = "wss" if url.scheme == "https" else "ws"
+    path = url.path.rstrip("/") + f"/api/kernels/{quote(kernel_id)}/channels"
+    query = "" if token is None else "?" + urlencode({"token": token})
+    return f"{scheme}://{url.netloc}{path}{query}"
+
+
+class KernelClient:
+    """
+    Send requests to a kernel and receive the replies in a background thread.
+
+    Each request returns a Future, so the caller can check it without blocking.
+    """
+
+    def __init__(
+        self,
+        server_url: str,
+        kernel_id: str,
+        token: str | None = None,
+        cookies: dict[str, str] | None = None,
+        timeout: float = 5.0,
+    ):
+        self.kernel_id = kernel_id
+        self.session_id = uuid.uuid4().hex
+        header = []
+        if cookies:
+            cookie = "; ".join(f"{name}={value}" for name, value in cookies.items())
+            header.append(f"Cookie: {cookie}")
+            if "_xsrf" in cookies:
+                header.append(f"X-XSRFToken: {cookies['_xsrf']}")
+
+        url = urlparse(server_url)
+        self._ws = websocket.create_connection(
+            kernel_channels_url(server_url, kernel_id, token),
+            header=header,
+            origin=f"{url.scheme}://{url.netloc}",
+            timeout=timeout,
+        )
+        # Block in the thread until a message arrives.
+        self._ws.settimeout(None)
+
+        # key = msg_id of the request
+        self._pending: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"jupynium-kernel-{kernel_id}", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def from_notebook_page(cls, driver: Driver) -> KernelClient:
+        """
+        Connect to the kernel of the notebook in the current window.
+
+        The browser's cookies are used to authenticate.
+        """
+        kernel_id, base_url, origin = driver.execute_script(
+            "return [Jupyter.notebook.kernel.id, Jupyter.notebook.base_url, "
+            "window.location.origin];"
+        )
+        cookies = {cookie["name"]: cookie["value"] for cookie in driver.get_cookies()}
+        return cls(origin + base_url, kernel_id, cookies=cookies)
+
+    def _run(self):
+        while True:
+            try:
+                message = self._ws.recv()
+                if isinstance(message, str) and message != "":
+                    message = json.loads(message)
+            except Exception:  # noqa: BLE001
+                # Including a malformed frame. We can't trust the rest either way.
+                message = ""
+            if message == "":
+                # recv() also returns an empty frame when the server closes.
+                if not self.closed:
+                    logger.info(f"Kernel channels closed: {self.kernel_id}")
+                break
+
+            if not isinstance(message, dict) or message.get("channel") != "shell":
+                # Binary messages (with buffers) are never a reply we asked for,
+                # nor the busy / idle status on iopub, with the same parent.
+                continue
+            msg_id = message.get("parent_header", {}).get("msg_id")
+            with self._lock:
+                future = self._pending.pop(msg_id, None)
+            if future is not None:
+                future.set_result(message.get("content", {}))
+
+        with self._lock:
+            self.closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(ConnectionError("Kernel channels closed"))
+
+    def request(self, msg_type: str, content: dict[str, Any]) -> Future:
+        """
+        Send a request on the shell channel.
+
+        Returns:
+            Future: the content of the reply
+
+        Raises:
+            ConnectionError: if the connection has been closed.
+        """
+        msg_id = uuid.uuid4().hex
+        message = {
+            "header": {
+                "msg_id": msg_id,
+                "msg_type": msg_type,
+                "username": "jupynium",
+                "session": self.session_id,
+                "date": datetime.now(timezone.utc).isoformat(),
+                "version": PROTOCOL_VERSION,
+            },
+            "parent_header": {},
+            "metadata": {},
+            "content": content,
+            "channel": "shell",
+            "buffers": [],
+        }
+        future: Future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("Kernel channels closed")
+            self._pending[msg_id] = future
+        try:
+            self._ws.send(json.dumps(message))
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(msg_id, None)
+            raise ConnectionError("Failed to send to the kernel") from e
+        return future
+
+    def complete(self, code: str, cursor_pos: int) -> Future:
+        return self.request(
+            "complete_request", {"code": code, "cursor_pos": cursor_pos}
+        )
+
+    def inspect(self, code: str, cursor_pos: int, detail_level: int = 0) -> Future:
+        return self.request(
+            "inspect_request",
+            {"code": code, "cursor_pos": cursor_pos, "detail_level": detail_level},
+        )
+
+    def close(self):
+        self.closed = True
+        with contextlib.suppress(Exception):
+            self._ws.close()
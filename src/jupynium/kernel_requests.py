@@ -0,0 +1,220 @@
+"""
+Kernel completion and inspection without blocking the event loop.
+
+With execute_async_script, Jupynium waits for the kernel's reply
+(for seconds while the kernel is busy executing a cell),
+and no other event of any nvim is processed in the meantime.
+Instead, the request is started in the notebook page and returns immediately,
+and the replies are collected in the following cycles.
+
+Optionally, the requests are sent to the kernel directly (see KernelClient),
+bypassing the browser entirely.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+from .kernel_client import KernelClient
+from .pinned_scripts import execute_pinned_script
+
+if TYPE_CHECKING:
+    from collections.abc import Collection
+    from concurrent.futures import Future
+
+    from .driver_protocol import Driver
+
+logger = logging.getLogger(__name__)
+
+
+# Blocking for more than 2 seconds for completion doesn't make sense.
+KERNEL_REQUEST_TIMEOUTS = {"complete": 2.0, "inspect": 5.0}
+
+_request_ids = itertools.count()
+
+
+@dataclass
+class KernelRequest:
+    """A completion or inspection waiting for the kernel's reply."""
+
+    name: str  # event name, e.g. kernel_complete_async
+    bufnr: int
+    window_handle: str
+    # kernel_complete_async
+    callback_id: str | None = None
+    completion_plugin: str | None = None
+    # To send the reply back to a request event (e.g. kernel_inspect)
+    response: Any = None
+    request_id: int = field(default_factory=lambda: next(_request_ids))
+    # Monotonic time to give up, in case the page has lost the request (reloaded).
+    deadline: float = float("inf")
+    superseded: bool = False
+    # The reply from the KernelClient. None if the request runs in the page.
+    future: Future | None = None
+
+
+class KernelRequests:
+    """
+    Kernel requests running in the notebook pages, or in the KernelClients.
+
+    Args:
+        use_kernel_client: send the requests to the kernels directly.
+            If the connection fails, it falls back to the page.
+    """
+
+    def __init__(self, use_kernel_client: bool = False):  # noqa: FBT001 FBT002
+        self.use_kernel_client = use_kernel_client
+        self.pending: list[KernelRequest] = []
+        # key = window handle of the notebook. None if failed to connect.
+        self.clients: dict[str, KernelClient | None] = {}
+
+    def _get_client(self, driver: Driver, window_handle: str) -> KernelClient | None:
+        client = self.clients.get(window_handle)
+        if client is not None and client.closed:
+            client = None
+        elif client is not None or window_handle in self.clients:
+            return client
+
+        driver.switch_to.window(window_handle)
+        try:
+            client = KernelClient.from_notebook_page(driver)
+        except Exception:
+            logger.exception(
+                "Failed to connect to the kernel. Using the browser instead."
+            )
+            client = None
+        self.clients[window_handle] = client
+        return client
+
+    def forget_client(self, window_handle: str):
+        """Disconnect from the kernel of the window (e.g. the kernel has changed)."""
+        client = self.clients.pop(window_handle, None)
+        if client is not None:
+            client.close()
+
+    def start(
+        self,
+        driver: Driver,
+        request: KernelRequest,
+        kind: str,
+        code_line: str,
+        col: int,
+    ):
+        """
+        Start a request and return without waiting.
+
+        Args:
+            driver: the browser
+            request: to be returned by collect() with the reply
+            kind: "complete" or "inspect"
+            code_line: a line of code
+            col: cursor position in the line
+        """
+        timeout = KERNEL_REQUEST_TIMEOUTS[kind]
+        client = None
+        if self.use_kernel_client:
+            client = self._get_client(driver, request.window_handle)
+
+        if client is not None:
+            try:
+                if kind == "complete":
+                    request.future = client.complete(code_line, col)
+                else:
+                    request.future = client.inspect(code_line, col)
+            except ConnectionError:
+                logger.warning("Lost the kernel connection. Using the browser.")
+                self.forget_client(request.window_handle)
+
+        if request.future is None:
+            driver.switch_to.window(request.window_handle)
+            execute_pinned_script(
+                driver,
+                "kernel_request_start",
+                request.request_id,
+                kind,
+                code_line,
+                col,
+                int(timeout * 1000),
+            )
+            timeout += 1.0
+        request.deadline = time.monotonic() + timeout
+
+        if request.name == "kernel_complete_async":
+            # Only the latest completion menu matters.
+            for pending in self.pending:
+                if pending.name == request.name and pending.bufnr == request.bufnr:
+                    pending.superseded = True
+        self.pending.append(request)
+
+    def collect(
+        self, driver: Driver, window_handles: Collection[str]
+    ) -> list[tuple[KernelRequest, Any]]:
+        """
+        Take the replies that have arrived.
+
+        The requests running in the pages take one script call per window,
+        and the ones sent to the KernelClients none.
+
+        Args:
+            driver: the browser
+            window_handles: windows that are still open.
+                The requests of the other windows are finished without replies.
+
+        Returns:
+            list of (request, reply). The reply is None if it failed or timed out.
+                Superseded requests are not returned.
+        """
+        finished: list[tuple[KernelRequest, Any]] = []
+        pending_per_window: dict[str, list[KernelRequest]] = {}
+        pending = self.pending
+        self.pending = []
+        now = time.monotonic()
+        for request in pending:
+            if request.future is None:
+                pending_per_window.setdefault(request.window_handle, []).append(request)
+            elif request.future.done():
+                if request.future.exception() is None:
+                    finished.append((request, request.future.result()))
+                else:
+                    finished.append((request, None))
+            elif now >= request.deadline:
+                finished.append((request, None))
+            else:
+                self.pending.append(request)
+
+        for window_handle, requests in pending_per_window.items():
+            if window_handle in window_handles:
+                driver.switch_to.window(window_handle)
+                replies = dict(
+                    execute_pinned_script(
+                        driver,
+                        "kernel_request_collect",
+                        [request.request_id for request in requests],
+                    )
+                )
+            else:
+                replies = {request.request_id: None for request in requests}
+
+            for request in requests:
+                if request.request_id in replies:
+                    finished.append((request, replies[request.request_id]))
+                elif now >= request.deadline:
+                    logger.warning(f"Kernel request has been lost: {request}")
+                    finished.append((request, None))
+                else:
+                    self.pending.append(request)
+
+        return [
+            (request, reply) for request, reply in finished if not request.superseded
+        ]
+
+    def close(self):
+        for window_handle in list(self.clients):
+            self.forget_client(window_handle)
+
+    def __len__(self):
+        return len(self.pending)
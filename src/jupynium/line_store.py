@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+from collections.abc import Iterable, Iterator, MutableSequence
+from itertools import chain
+from typing import overload
+
+from .fenwick import FenwickTree
+
+
+class LineStore(MutableSequence[str]):
+    """
+    List of buffer lines, stored in chunks.
+
+    A plain list shifts its whole tail whenever lines are inserted or removed,
+    which makes every line-count-changing edit O(n) on very large buffers.
+    Here, the lines are split into chunks of roughly `chunk_size` lines and the chunk
+    lengths are indexed with a Fenwick tree,
+    so an edit only touches the chunks it overlaps with.
+
+    It behaves like a list of strings, so the rest of the code doesn't need to know.
+    """
+
+    def __init__(self, lines: Iterable[str] = (), chunk_size: int = 256):
+        self.chunk_size = chunk_size
+        lines = list(lines)
+        self._chunks: list[list[str]] = [
+            lines[i : i + chunk_size] for i in range(0, len(lines), chunk_size)
+        ] or [[]]
+        self._len = len(lines)
+        self._index = FenwickTree(len(chunk) for chunk in self._chunks)
+
+    def _locate(self, row: int) -> tuple[int, int]:
+        """
+        Find the chunk that contains the row.
+
+        Returns:
+            int: chunk index
+            int: row index within the chunk
+
+        If row == len(self), it points at the end of the last chunk.
+        """
+        if row >= self._len:
+            return len(self._chunks) - 1, len(self._chunks[-1]) + row - self._len
+        chunk_idx, chunk_start_row = self._index.search(row)
+        return chunk_idx, row - chunk_start_row
+
+    def _normalise_index(self, idx: int) -> int:
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError("LineStore index out of range")
+        return idx
+
+    def get_lines(self, start: int, end: int) -> list[str]:
+        """Same as self[start:end] but without slice normalisation."""
+        start = max(start, 0)
+        end = min(end, self._len)
+        if start >= end:
+            return []
+
+        chunk_idx, offset = self._locate(start)
+        lines = []
+        num_lines = end - start
+        while len(lines) < num_lines:
+            chunk = self._chunks[chunk_idx]
+            lines.extend(chunk[offset : offset + num_lines - len(lines)])
+            chunk_idx += 1
+            offset = 0
+        return lines
+
+    def replace(self, start: int, end: int, lines: list[str]):
+        """
+        Replace self[start:end] with lines.
+
+        The cost is proportional to the size of the edit and the chunks it overlaps,
+        not the size of the whole buffer.
+        """
+        start = min(max(start, 0), self._len)
+        end = min(max(end, start), self._len)
+
+        start_chunk_idx, start_offset = self._locate(start)
+        start_chunk = self._chunks[start_chunk_idx]
+        if start_offset + end - start <= len(start_chunk):
+            # The edit is within a single chunk (most of the cases).
+            start_chunk[start_offset : start_offset + end - start] = lines
+            delta = len(lines) - (end - start)
+            self._len += delta
+            if delta == 0:
+                return
+            if self.chunk_size // 4 < len(start_chunk) <= 2 * self.chunk_size or (
+                len(self._chunks) == 1
+            ):
+                self._index.add(start_chunk_idx, delta)
+                return
+            self._rebalance(max(start_chunk_idx - 1, 0), start_chunk_idx + 2)
+            return
+
+        end_chunk_idx, end_offset = self._locate(end)
+        end_chunk = self._chunks[end_chunk_idx]
+        merged = start_chunk[:start_offset]
+        merged.extend(lines)
+        merged.extend(end_chunk[end_offset:])
+        self._chunks[start_chunk_idx : end_chunk_idx + 1] = [merged]
+        self._len += len(lines) - (end - start)
+        self._rebalance(max(start_chunk_idx - 1, 0), start_chunk_idx + 2)
+
+    def _rebalance(self, chunk_start: int, chunk_end: int):
+        """
+        Split large chunks and merge small ones in the range,
+        then rebuild the chunk index.
+        """
+        rebalanced: list[list[str]] = []
+        for chunk in self._chunks[chunk_start:chunk_end]:
+            if len(chunk) > 2 * self.chunk_size:
+                rebalanced.extend(
+                    chunk[i : i + self.chunk_size]
+                    for i in range(0, len(chunk), self.chunk_size)
+                )
+            elif len(chunk) == 0:
+                continue
+            elif (
+                len(rebalanced) > 0
+                and min(len(rebalanced[-1]), len(chunk)) <= self.chunk_size // 4
+                and len(rebalanced[-1]) + len(chunk) <= 2 * self.chunk_size
+            ):
+                rebalanced[-1].extend(chunk)
+            else:
+                rebalanced.append(chunk)
+        self._chunks[chunk_start:chunk_end] = rebalanced
+        if len(self._chunks) == 0:
+            self._chunks.append([])
+        self._index.build(len(chunk) for chunk in self._chunks)
+
+    @overload
+    def __getitem__(self, idx: int) -> str: ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> list[str]: ...
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self._len)
+            if step == 1:
+                return self.get_lines(start, stop)
+            return list(self)[idx]
+        chunk_idx, offset = self._locate(self._normalise_index(idx))
+        return self._chunks[chunk_idx][offset]
+
+    @overload
+    def __setitem__(self, idx: int, value: str) -> None: ...
+
+    @overload
+    def __setitem__(self, idx: slice, value: Iterable[str]) -> None: ...
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self._len)
+            if step != 1:
+                raise ValueError("LineStore does not support extended slices")
+            self.replace(start, stop, list(value))
+            return
+        chunk_idx, offset = self._locate(self._normalise_index(idx))
+        self._chunks[chunk_idx][offset] = value
+
+    def __delitem__(self, idx: int | slice):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self._len)
+            if step != 1:
+                raise ValueError("LineStore does not support extended slices")
+            self.replace(start, stop, [])
+            return
+        idx = self._normalise_index(idx)
+        self.replace(idx, idx + 1, [])
+
+    def insert(self, index: int, value: str):
+        if index < 0:
+            index = max(index + self._len, 0)
+        self.replace(index, index, [value])
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self) -> Iterator[str]:
+        return chain.from_iterable(self._chunks)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, (LineStore, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self):
+        return f"LineStore({list(self)!r})"
@@ -15,6 +15,7 @@ vim.api.nvim_create_user_command(
 )
 vim.api.nvim_create_user_command("JupyniumScrollToCell", "lua Jupynium_scroll_to_cell()", {})
 vim.api.nvim_create_user_command("JupyniumScrollToOutput", "lua Jupynium_scroll_to_output()", {})
+vim.api.nvim_create_user_command("JupyniumRenderMarkdown", "lua Jupynium_render_markdown()", {})
 vim.api.nvim_create_user_command("JupyniumSaveIpynb", "lua Jupynium_save_ipynb()", {})
 vim.api.nvim_create_user_command("JupyniumDownloadIpynb", Jupynium_download_ipynb_cmd, { nargs = "?" })
 vim.api.nvim_create_user_command("JupyniumAutoDownloadIpynbToggle", "lua Jupynium_auto_download_ipynb_toggle()", {})
@@ -27,3 +28,5 @@ vim.api.nvim_create_user_command("JupyniumKernelInterrupt", "lua Jupynium_kernel
 vim.api.nvim_create_user_command("JupyniumKernelSelect", "lua Jupynium_kernel_select()", {})
 vim.api.nvim_create_user_command("JupyniumKernelHover", "lua Jupynium_kernel_hover()", {})
 vim.api.nvim_create_user_command("JupyniumKernelOpenInTerminal", Jupynium_kernel_connect_cmd, { nargs = "?" })
+
+vim.api.nvim_create_user_command("JupyniumDriverStats", Jupynium_driver_stats_cmd, { nargs = "?" })
@@ -15,6 +15,10 @@ if vim.g.jupynium_autoscroll_mode == nil then
   vim.g.jupynium_autoscroll_mode = "always"
 end
 
+if vim.g.jupynium_autoscroll_focus == nil then
+  vim.g.jupynium_autoscroll_focus = "input"
+end
+
 if vim.g.jupynium_autoscroll_cell_top_margin_percent == nil then
   vim.g.jupynium_autoscroll_cell_top_margin_percent = true
 end
@@ -27,10 +31,13 @@ if vim.g.jupynium_scroll_cell_top_margin_percent == nil then
   vim.g.jupynium_scroll_cell_top_margin_percent = 20
 end
 
--- max messages = max(vim.api.nvim_buf_line_count(all_buffer), vim.g.jupynium_num_max_msgs)
--- If we're processing more than this many events, ignore everything and perform full-sync instead.
--- However, the full-sync can be more expensive depending on how big the files are.
--- It's an old method I implemented to make things faster a little, but the current lazy processing seems to work much better so we can maybe deprecate this.
+if vim.g.jupynium_markdown_render_idle_timeout == nil then
+  vim.g.jupynium_markdown_render_idle_timeout = 1.0
+end
+
+-- Number of messages that can be sent before Jupynium processes them (flow control credits).
+-- When Jupynium falls behind, buffer changes are queued and coalesced into a single range per buffer
+-- until it catches up.
 if vim.g.jupynium_num_max_msgs == nil then
   vim.g.jupynium_num_max_msgs = 1000
 end
@@ -41,6 +48,10 @@ if vim.g.jupynium_channel_id == nil then
   vim.g.jupynium_channel_id = -1
 end
 
+if vim.g.jupynium_event_channel_id == nil then
+  vim.g.jupynium_event_channel_id = -1
+end
+
 if vim.g.jupynium_notify_ignore_codes == nil then
   vim.g.jupynium_notify_ignore_codes = {} --- @type table<string, boolean>
 end
@@ -1,7 +1,17 @@
-vim.g.jupynium_message_bloated = false
+-- Flow control: Jupynium grants credits, and each message sent uses one.
+-- Jupynium grants them back once per cycle of events (Jupynium_grant_credits).
+-- When we run out of credits, messages are queued and buffer changes are coalesced
+-- into a single row range per buffer, so overload results in bigger batched updates.
+Jupynium_credits = 0
 
--- This number is not strictly accurate. We only use this to detect blockage (bloated)
-vim.g.jupynium_num_pending_msgs = 0
+-- Number of messages sent to Jupynium but not acknowledged yet (for information).
+-- Not a g: variable, so that sending doesn't trigger the g: watchers (see Jupynium_option_changed).
+local num_pending_msgs = 0
+
+---@return integer
+function Jupynium_num_pending_msgs()
+  return num_pending_msgs
+end
 
 -- Remove syncing without sending stop message.
 -- Use when initialising or no Jupynium server is running.
@@ -19,50 +29,174 @@ end
 Jupynium_syncing_bufs = {} -- key = bufnr, value = 1
 Jupynium_bufs_attached = {} -- key = bufnr, value = 1
 
+-- Messages waiting for credits, in order.
+-- Each item is { event = string, buf = integer, args = table }
+-- or for on_lines, { event = "on_lines", buf = integer, start_row, old_end_row, new_end_row, lines }
+-- Only the last item can be an on_lines without lines. It keeps growing while
+-- the buffer changes, and the lines are read when anything else is queued after it.
+local queued_msgs = {}
+-- Latest cursor / visual selection per buffer, waiting for credits.
+-- Only the latest one matters, so the older ones are dropped.
+local queued_selections = {} -- key = bufnr, value = { event = string, args = table }
+
+local selection_events = {
+  CursorMoved = true,
+  CursorMovedI = true,
+  visual_enter = true,
+  visual_leave = true,
+}
+
+-- Number of notifications sent to the event channel.
+-- Jupynium reads notifications and requests from separate connections,
+-- so before a request it makes sure that all notifications sent before it have arrived.
+local num_notified = 0
+
 function Jupynium_reset_channel()
   vim.g.jupynium_channel_id = -1
-  vim.g.jupynium_message_bloated = false
-  vim.g.jupynium_num_pending_msgs = 0
+  vim.g.jupynium_event_channel_id = -1
+  num_notified = 0
+  num_pending_msgs = 0
+  Jupynium_credits = 0
+  queued_msgs = {}
+  queued_selections = {}
   Jupynium_reset_sync()
 end
 
-local function get_line_count_all_buffers()
-  local line_count = 0
-  for buf_id, _ in pairs(Jupynium_syncing_bufs) do
-    line_count = line_count + vim.api.nvim_buf_line_count(buf_id)
+local function send(method, event, buf, ...)
+  if vim.g.jupynium_channel_id == nil or vim.g.jupynium_channel_id <= 0 then
+    Jupynium_reset_channel()
+    return
   end
-  return line_count
-end
 
-get_line_count_all_buffers()
+  -- Notifications go to the event channel if Jupynium has one (read in the background).
+  -- Requests always go to the main channel, because Jupynium may call nvim
+  -- while we wait for the response, and only that channel is served in the meantime.
+  local channel_id = vim.g.jupynium_channel_id
+  if method == vim.rpcnotify and vim.g.jupynium_event_channel_id ~= nil and vim.g.jupynium_event_channel_id > 0 then
+    channel_id = vim.g.jupynium_event_channel_id
+    num_notified = num_notified + 1
+  end
 
-local function get_num_max_events()
-  return math.max(vim.g.jupynium_num_max_msgs, get_line_count_all_buffers())
+  Jupynium_credits = Jupynium_credits - 1
+  num_pending_msgs = num_pending_msgs + 1
+  local status, res = pcall(method, channel_id, event, buf, ...)
+  if not status then
+    print "Jupynium: RPC channel closed. Stop sending all notifications."
+    Jupynium_reset_channel()
+  else
+    return res
+  end
 end
 
-local function rpc(method, event, buf, ...)
-  if vim.g.jupynium_channel_id ~= nil and vim.g.jupynium_channel_id > 0 then
-    -- If bloated, wait until the messages are cleared
-    -- Jupynium server should detect this and clear the messages
-    -- And send grab_entire_buf
-    if vim.g.jupynium_message_bloated then
+local function read_queued_lines(msg)
+  if msg.event == "on_lines" and msg.lines == nil then
+    msg.lines = vim.api.nvim_buf_get_lines(msg.buf, msg.start_row, msg.new_end_row, false)
+  end
+end
+
+local function send_queued_msg(msg)
+  if msg.event == "on_lines" then
+    if Jupynium_syncing_bufs[msg.buf] == nil then
       return
     end
+    read_queued_lines(msg)
+    send(vim.rpcnotify, "on_lines", msg.buf, msg.lines, msg.start_row, msg.old_end_row, msg.new_end_row)
+  else
+    send(vim.rpcnotify, msg.event, msg.buf, unpack(msg.args, 1, msg.args.n))
+  end
+end
 
-    if vim.g.jupynium_num_pending_msgs < get_num_max_events() then
-      vim.g.jupynium_num_pending_msgs = vim.g.jupynium_num_pending_msgs + 1
-      local status, res = pcall(method, vim.g.jupynium_channel_id, event, buf, ...)
-      if not status then
-        print "Jupynium: RPC channel closed. Stop sending all notifications."
-        Jupynium_reset_channel()
-      else
-        return res
+---Send the queued messages as long as we have credits.
+---@param force boolean? Send everything regardless of credits (e.g. before a request)
+local function flush(force)
+  local num_sent = 0
+  while num_sent < #queued_msgs and (force or Jupynium_credits > 0) do
+    num_sent = num_sent + 1
+    send_queued_msg(queued_msgs[num_sent])
+  end
+  local remaining_msgs = {}
+  for i = num_sent + 1, #queued_msgs do
+    table.insert(remaining_msgs, queued_msgs[i])
+  end
+  queued_msgs = remaining_msgs
+
+  if #queued_msgs == 0 then
+    for buf, selection in pairs(queued_selections) do
+      if not force and Jupynium_credits <= 0 then
+        break
       end
-    else
-      vim.g.jupynium_message_bloated = true
+      queued_selections[buf] = nil
+      send(vim.rpcnotify, selection.event, buf, unpack(selection.args, 1, selection.args.n))
     end
+  end
+end
+
+---Queue a buffer change, merging it into the previous one if possible.
+---Rows are relative to the buffer after all the previous changes.
+local function queue_on_lines(buf, start_row, old_end_row, new_end_row)
+  local last = queued_msgs[#queued_msgs]
+  if last ~= nil and last.event == "on_lines" and last.buf == buf and last.lines == nil then
+    -- The queued change replaced rows [start_row, old_end_row) of the original buffer
+    -- with rows [start_row, new_end_row) of the current buffer.
+    -- Extend it to cover this change as well.
+    local end_row = math.max(last.new_end_row, old_end_row)
+    last.old_end_row = last.old_end_row + (end_row - last.new_end_row)
+    last.new_end_row = end_row + (new_end_row - old_end_row)
+    last.start_row = math.min(last.start_row, start_row)
+    return
+  end
+
+  if last ~= nil then
+    read_queued_lines(last)
+  end
+  table.insert(queued_msgs, {
+    event = "on_lines",
+    buf = buf,
+    start_row = start_row,
+    old_end_row = old_end_row,
+    new_end_row = new_end_row,
+  })
+end
+
+local function queue(event, buf, ...)
+  if selection_events[event] then
+    queued_selections[buf] = { event = event, args = { n = select("#", ...), ... } }
+    return
+  end
+
+  if #queued_msgs > 0 then
+    read_queued_lines(queued_msgs[#queued_msgs])
+  end
+
+  -- Other events may depend on the selection (e.g. execute_selected_cells)
+  if queued_selections[buf] ~= nil then
+    local selection = queued_selections[buf]
+    queued_selections[buf] = nil
+    table.insert(queued_msgs, { event = selection.event, buf = buf, args = selection.args })
+  end
+  table.insert(queued_msgs, { event = event, buf = buf, args = { n = select("#", ...), ... } })
+end
+
+---Called by Jupynium after consuming messages.
+---@param num_credits integer
+function Jupynium_grant_credits(num_credits)
+  Jupynium_credits = Jupynium_credits + num_credits
+  num_pending_msgs = math.max(num_pending_msgs - num_credits, 0)
+  flush()
+end
+
+---Send a buffer change. If out of credits, it will be coalesced with the other changes.
+---@param buf integer
+---@param start_row integer
+---@param old_end_row integer
+---@param new_end_row integer
+function Jupynium_on_lines(buf, start_row, old_end_row, new_end_row)
+  if Jupynium_credits > 0 and #queued_msgs == 0 then
+    local lines = vim.api.nvim_buf_get_lines(buf, start_row, new_end_row, false)
+    send(vim.rpcnotify, "on_lines", buf, lines, start_row, old_end_row, new_end_row)
   else
-    Jupynium_reset_channel()
+    queue_on_lines(buf, start_row, old_end_row, new_end_row)
+    flush()
   end
 end
 
@@ -73,7 +207,13 @@ function Jupynium_rpcnotify(event, buf, ensure_syncing, ...)
       return
     end
   end
-  rpc(vim.rpcnotify, event, buf, ...)
+
+  if Jupynium_credits > 0 and #queued_msgs == 0 and queued_selections[buf] == nil then
+    send(vim.rpcnotify, event, buf, ...)
+  else
+    queue(event, buf, ...)
+    flush()
+  end
 end
 
 ---block until jupynium responds to the message
@@ -91,10 +231,57 @@ function Jupynium_rpcrequest(event, buf, ensure_syncing, ...)
     end
   end
 
-  local response = rpc(vim.rpcrequest, event, buf, ...)
+  -- Requests are sent regardless of credits, but the queued messages go first.
+  flush(true)
+  -- With the number of notifications sent before, so that Jupynium processes them first.
+  local response = send(vim.rpcrequest, event, buf, num_notified, ...)
   return response
 end
 
+-- Options that Jupynium reads while processing events. key = name of g: variable
+-- Instead of Jupynium asking for them every time, we send all of them
+-- when attached and whenever one of them changes.
+local watched_options = {}
+local options_push_scheduled = false
+
+function Jupynium_push_options()
+  local options = vim.empty_dict()
+  for name, _ in pairs(watched_options) do
+    options[name] = vim.g[name]
+  end
+  Jupynium_rpcnotify("options", 0, false, options)
+end
+
+---Called by Jupynium when attached.
+---@param names string[] g: variables to send
+function Jupynium_watch_options(names)
+  watched_options = {}
+  for _, name in ipairs(names) do
+    watched_options[name] = true
+  end
+  Jupynium_push_options()
+end
+
+function Jupynium_option_changed(name)
+  if watched_options[name] == nil or options_push_scheduled then
+    return
+  end
+  -- setup() changes many options at once. Send them once.
+  options_push_scheduled = true
+  vim.schedule(function()
+    options_push_scheduled = false
+    Jupynium_push_options()
+  end)
+end
+
+vim.cmd [[
+  function! Jupynium_option_changed(dict, key, change) abort
+    call v:lua.Jupynium_option_changed(a:key)
+  endfunction
+  silent! call dictwatcherdel(g:, 'jupynium_*', 'Jupynium_option_changed')
+  call dictwatcheradd(g:, 'jupynium_*', 'Jupynium_option_changed')
+]]
+
 --- API: Execute javascript in the browser. It will switch to the correct tab before executing.
 ---@param bufnr integer | nil If given, before executing the code it will switch to the tab of this buffer. Requires syncing in advance.
 ---@param code string Javascript code
@@ -313,8 +500,7 @@ function Jupynium_start_sync(bufnr, ipynb_filename, ask)
         return true
       end
 
-      local lines = vim.api.nvim_buf_get_lines(bufnr, start_row, new_end_row, false)
-      Jupynium_rpcnotify("on_lines", bufnr, true, lines, start_row, old_end_row, new_end_row)
+      Jupynium_on_lines(bufnr, start_row, old_end_row, new_end_row)
     end,
   })
 
@@ -386,6 +572,18 @@ function Jupynium_scroll_to_output(bufnr)
   Jupynium_rpcnotify("scroll_to_output", bufnr, true, cursor_pos[1] - 1)
 end
 
+function Jupynium_render_markdown(bufnr)
+  if bufnr == nil or bufnr == 0 then
+    bufnr = vim.api.nvim_get_current_buf()
+  end
+  if Jupynium_syncing_bufs[bufnr] == nil then
+    Jupynium_notify.error { [[Cannot render markdown without synchronising.]], [[Run `:JupyniumStartSync`]] }
+    return
+  end
+
+  Jupynium_rpcnotify("render_markdown", bufnr, true)
+end
+
 function Jupynium_save_ipynb(bufnr)
   if bufnr == nil or bufnr == 0 then
     bufnr = vim.api.nvim_get_current_buf()
@@ -458,6 +656,26 @@ function Jupynium_autoscroll_toggle()
   Jupynium_notify.info { "Autoscroll is now ", vim.g.jupynium_autoscroll and "on" or "off" }
 end
 
+function Jupynium_driver_stats(reset)
+  if vim.g.jupynium_channel_id == nil or vim.g.jupynium_channel_id <= 0 then
+    Jupynium_notify.error { [[Jupynium is not attached.]], [[Run `:JupyniumAttachToServer`]] }
+    return
+  end
+
+  local stats = Jupynium_rpcrequest("driver_stats", 0, false, reset == true)
+  if stats ~= nil then
+    vim.api.nvim_echo({ { stats } }, true, {})
+  end
+end
+
+function Jupynium_driver_stats_cmd(args)
+  if args.args ~= "" and args.args ~= "reset" then
+    Jupynium_notify.error { [[Usage: :JupyniumDriverStats [reset]]] }
+    return
+  end
+  Jupynium_driver_stats(args.args == "reset")
+end
+
 function Jupynium_clear_selected_cells_outputs(bufnr)
   if bufnr == nil or bufnr == 0 then
     bufnr = vim.api.nvim_get_current_buf()
@@ -742,6 +960,17 @@ function Jupynium_kernel_complete_async(bufnr, code_line, col, callback, complet
   Jupynium_rpcnotify("kernel_complete_async", bufnr, true, code_line, col, callback_id, completion_plugin)
 end
 
+--- Called from python with the completion of a Jupynium_kernel_complete_async request.
+---@param callback_id string
+---@param matches table
+function Jupynium_kernel_complete_async_reply(callback_id, matches)
+  if callback_id ~= vim.g.jupynium_kernel_complete_async_callback_id then
+    -- A newer request replaced it.
+    return
+  end
+  Jupynium_kernel_complete_async_callback(matches)
+end
+
 function Jupynium_get_kernel_connect_shcmd(bufnr, hostname)
   if bufnr == nil or bufnr == 0 then
     bufnr = vim.api.nvim_get_current_buf()
@@ -0,0 +1,420 @@
+"""
+Talk to Firefox's Marionette directly, without geckodriver.
+
+With Selenium, every command goes to geckodriver (HTTP and JSON), which relays it
+to Marionette in Firefox. Here, the commands are sent to Marionette's socket,
+which saves a process hop for every (usually tiny) `execute_script`.
+
+Only the part of the WebDriver API that Jupynium uses is implemented,
+and the errors are raised as the same Selenium exceptions.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.errorhandler import ErrorHandler
+
+if TYPE_CHECKING:
+    from os import PathLike
+
+logger = logging.getLogger(__name__)
+
+# W3C WebDriver element reference
+ELEMENT_KEY = "element-6066-11e4-a52e-4f735466cecf"
+
+# Same as Selenium's default HTTP timeout.
+COMMAND_TIMEOUT = 120.0
+
+
+class MarionetteConnection:
+    """
+    Marionette protocol (level 3) over a socket.
+
+    Messages are `<length>:<json>`. A command is `[0, id, name, parameters]`,
+    and its response is `[1, id, error, result]`.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = COMMAND_TIMEOUT):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile("rb")
+        self._msg_id = 0
+        self.hello = self._receive()
+        if self.hello.get("marionetteProtocol", 0) < 3:
+            self.close()
+            raise WebDriverException(f"Unsupported Marionette protocol: {self.hello}")
+
+    def _receive(self) -> Any:
+        length = b""
+        while (char := self._file.read(1)) != b":":
+            if not char:
+                raise ConnectionError("Marionette closed the connection")
+            length += char
+        data = self._file.read(int(length))
+        if len(data) < int(length):
+            raise ConnectionError("Marionette closed the connection")
+        return json.loads(data)
+
+    def send(self, name: str, parameters: dict[str, Any] | None = None) -> Any:
+        """
+        Send a command and wait for its result.
+
+        Raises:
+            WebDriverException: (or a subclass) the command failed,
+                or the connection is lost.
+        """
+        self._msg_id += 1
+        data = json.dumps([0, self._msg_id, name, parameters or {}]).encode()
+        try:
+            self._sock.sendall(f"{len(data)}:".encode() + data)
+            while True:
+                _, msg_id, error, result = self._receive()
+                # Otherwise, a late response of a command that timed out.
+                if msg_id == self._msg_id:
+                    break
+        except (OSError, ValueError) as e:
+            raise WebDriverException(f"Failed to send {name} to Marionette") from e
+
+        if error is not None:
+            ErrorHandler().check_response(
+                {"status": error.get("error"), "value": error}
+            )
+        return result
+
+    def close(self):
+        with contextlib.suppress(OSError):
+            self._file.close()
+            self._sock.close()
+
+
+def _values(result: Any) -> list:
+    # Lists are sent as is, but older versions wrap them like other values.
+    if isinstance(result, dict):
+        return result["value"]
+    return result
+
+
+class MarionetteElement:
+    """The part of Selenium's WebElement that Jupynium uses."""
+
+    def __init__(self, driver: MarionetteDriver, element_id: str):
+        self._driver = driver
+        self.id = element_id
+
+    def find_element(self, by: str, value: str) -> MarionetteElement:
+        return self._driver.find_element(by, value, _parent=self)
+
+    def find_elements(self, by: str, value: str) -> list[MarionetteElement]:
+        return self._driver.find_elements(by, value, _parent=self)
+
+    def click(self):
+        self._driver.send("WebDriver:ElementClick", {"id": self.id})
+
+    @property
+    def text(self) -> str:
+        return self._driver.send("WebDriver:GetElementText", {"id": self.id})["value"]
+
+    def get_attribute(self, name: str) -> str | None:
+        return self._driver.send(
+            "WebDriver:GetElementAttribute", {"id": self.id, "name": name}
+        )["value"]
+
+    def __eq__(self, other):
+        return isinstance(other, MarionetteElement) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class _MarionetteSwitchTo:
+    def __init__(self, driver: MarionetteDriver):
+        self._driver = driver
+
+    def window(self, window_name: str):
+        self._driver.send("WebDriver:SwitchToWindow", {"handle": window_name})
+
+    def new_window(self, type_hint: str | None = None):
+        handle = self._driver.send("WebDriver:NewWindow", {"type": type_hint})
+        self.window(handle["handle"])
+
+
+class MarionetteDriver:
+    """
+    The part of Selenium's WebDriver that Jupynium uses, over Marionette.
+
+    Args:
+        connection: connected to Firefox's Marionette
+        firefox: stopped on quit(), if given.
+    """
+
+    def __init__(
+        self,
+        connection: MarionetteConnection,
+        firefox: FirefoxProcess | None = None,
+    ):
+        self.connection = connection
+        self.firefox = firefox
+        session = self.send("WebDriver:NewSession", {})
+        self.session_id = session["sessionId"]
+        self.capabilities = session["capabilities"]
+        self.switch_to = _MarionetteSwitchTo(self)
+
+    def send(self, name: str, parameters: dict[str, Any] | None = None) -> Any:
+        return self.connection.send(name, parameters)
+
+    def _wrap(self, value: Any) -> Any:
+        if isinstance(value, MarionetteElement):
+            return {ELEMENT_KEY: value.id}
+        if isinstance(value, (list, tuple)):
+            return [self._wrap(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self._wrap(item) for key, item in value.items()}
+        return value
+
+    def _unwrap(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self._unwrap(item) for item in value]
+        if isinstance(value, dict):
+            if len(value) == 1 and ELEMENT_KEY in value:
+                return MarionetteElement(self, value[ELEMENT_KEY])
+            return {key: self._unwrap(item) for key, item in value.items()}
+        return value
+
+    def execute_script(self, script: str, *args) -> Any:
+        result = self.send(
+            "WebDriver:ExecuteScript", {"script": script, "args": self._wrap(args)}
+        )
+        return self._unwrap(result["value"])
+
+    def execute_async_script(self, script: str, *args) -> Any:
+        result = self.send(
+            "WebDriver:ExecuteAsyncScript",
+            {"script": script, "args": self._wrap(args)},
+        )
+        return self._unwrap(result["value"])
+
+    def get(self, url: str):
+        self.send("WebDriver:Navigate", {"url": url})
+
+    @property
+    def current_url(self) -> str:
+        return self.send("WebDriver:GetCurrentURL")["value"]
+
+    @property
+    def window_handles(self) -> list[str]:
+        return _values(self.send("WebDriver:GetWindowHandles"))
+
+    @property
+    def current_window_handle(self) -> str:
+        return self.send("WebDriver:GetWindowHandle")["value"]
+
+    def find_element(
+        self, by: str, value: str, _parent: MarionetteElement | None = None
+    ) -> MarionetteElement:
+        parameters = {"using": by, "value": value}
+        if _parent is not None:
+            parameters["element"] = _parent.id
+        result = self.send("WebDriver:FindElement", parameters)
+        return self._unwrap(result["value"])
+
+    def find_elements(
+        self, by: str, value: str, _parent: MarionetteElement | None = None
+    ) -> list[MarionetteElement]:
+        parameters = {"using": by, "value": value}
+        if _parent is not None:
+            parameters["element"] = _parent.id
+        return self._unwrap(_values(self.send("WebDriver:FindElements", parameters)))
+
+    def get_cookies(self) -> list[dict[str, Any]]:
+        return _values(self.send("WebDriver:GetCookies"))
+
+    def close(self):
+        self.send("WebDriver:CloseWindow")
+
+    def quit(self):
+        # Fails if already closed
+        with contextlib.suppress(WebDriverException):
+            self.send("Marionette:Quit", {"flags": ["eForceQuit"]})
+        self.connection.close()
+        if self.firefox is not None:
+            self.firefox.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.quit()
+
+
+def find_firefox_binary() -> str:
+    """
+    Firefox executable in PATH, or at the default install location.
+
+    Raises:
+        WebDriverException: if not found.
+    """
+    for name in ("firefox", "firefox-bin"):
+        path = shutil.which(name)
+        if path is not None:
+            return path
+    for path in (
+        "/Applications/Firefox.app/Contents/MacOS/firefox",
+        r"C:\Program Files\Mozilla Firefox\firefox.exe",
+        r"C:\Program Files (x86)\Mozilla Firefox\firefox.exe",
+    ):
+        if Path(path).exists():
+            return path
+    raise WebDriverException("Firefox binary not found. Add it to PATH.")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FirefoxProcess:
+    """
+    Firefox with Marionette enabled.
+
+    The given profile is used in place, so the session (logins, cookies, etc.)
+    is kept. The preferences are added to its user.js, which is backed up
+    and restored on stop() (like geckodriver does). If Jupynium was killed
+    before that, the backup is restored on the next start.
+    Without a profile, a temporary one is used and removed on stop().
+    """
+
+    USER_JS_BACKUP = "user.js.jupynium-backup"
+
+    def __init__(
+        self,
+        profile_path: str | PathLike | None = None,
+        preferences: dict[str, Any] | None = None,
+        firefox_binary: str | None = None,
+    ):
+        self.binary = firefox_binary or find_firefox_binary()
+        self.port = _free_port()
+        self.preferences = {**(preferences or {}), "marionette.port": self.port}
+
+        self.temporary_profile = profile_path is None
+        if profile_path is None:
+            self.profile_path = Path(tempfile.mkdtemp(prefix="jupynium-firefox-"))
+        else:
+            self.profile_path = Path(profile_path)
+        self.process: subprocess.Popen | None = None
+
+    @property
+    def user_js(self) -> Path:
+        return self.profile_path / "user.js"
+
+    @property
+    def user_js_backup(self) -> Path:
+        # Empty if there was no user.js
+        return self.profile_path / self.USER_JS_BACKUP
+
+    def write_profile(self):
+        """Add the preferences to user.js, after backing it up."""
+        # Left by a Jupynium that didn't quit properly
+        self.restore_profile()
+
+        user_js = self.user_js
+        original = user_js.read_text() if user_js.exists() else ""
+        self.user_js_backup.write_text(original)
+        lines = [original] if original else []
+        lines += [
+            f"user_pref({json.dumps(name)}, {json.dumps(value)});"
+            for name, value in self.preferences.items()
+        ]
+        user_js.write_text("\n".join(lines) + "\n")
+
+    def restore_profile(self):
+        """Restore user.js from the backup, if any."""
+        backup = self.user_js_backup
+        if not backup.exists():
+            return
+        if backup.stat().st_size == 0:
+            self.user_js.unlink(missing_ok=True)
+            backup.unlink()
+        else:
+            backup.replace(self.user_js)
+
+    def start(self, timeout: float = 60.0) -> MarionetteConnection:
+        """
+        Start Firefox and connect to its Marionette.
+
+        Raises:
+            WebDriverException: if Firefox exits or Marionette does not answer.
+        """
+        try:
+            self.write_profile()
+        except OSError:
+            self.stop()
+            raise
+        self.process = subprocess.Popen(
+            [
+                self.binary,
+                "-marionette",
+                "-no-remote",
+                "-profile",
+                str(self.profile_path),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env={**os.environ, "MOZ_CRASHREPORTER_DISABLE": "1"},
+        )
+
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process.poll() is not None:
+                self.stop()
+                raise WebDriverException(
+                    f"Firefox exited with code {self.process.returncode}"
+                )
+            try:
+                return MarionetteConnection("127.0.0.1", self.port)
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.stop(timeout=0)
+                    raise WebDriverException(
+                        f"Timed out connecting to Marionette on port {self.port}"
+                    ) from None
+                time.sleep(0.1)
+
+    def stop(self, timeout: float = 10.0):
+        """Wait for Firefox to quit (kill it after the timeout) and clean up."""
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.temporary_profile:
+            shutil.rmtree(self.profile_path, ignore_errors=True)
+        else:
+            self.restore_profile()
+
+
+def marionette_firefox(
+    profile_path: str | PathLike | None = None,
+    preferences: dict[str, Any] | None = None,
+) -> MarionetteDriver:
+    """Start Firefox and control it through Marionette."""
+    firefox = FirefoxProcess(profile_path, preferences)
+    connection = firefox.start()
+    try:
+        return MarionetteDriver(connection, firefox)
+    except WebDriverException:
+        connection.close()
+        firefox.stop(timeout=0)
+        raise
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import TYPE_CHECKING, Any
+
+from .pinned_scripts import execute_pinned_script
+
+if TYPE_CHECKING:
+    from .driver_protocol import Driver
+
+logger = logging.getLogger(__name__)
+
+
+def _js_length(text: str) -> int:
+    """Length of a string in JavaScript (UTF-16 code units)."""
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+class NotebookShadow:
+    """
+    Python-side model of a synced notebook: cell count, types and last-sent text.
+
+    It mirrors every operation we send (see NotebookTransaction),
+    so we don't have to ask the browser what the notebook looks like.
+    The model is verified against the browser only periodically,
+    or when we have a reason to suspect it (e.g. after an error).
+    """
+
+    def __init__(self, verify_interval: float = 10.0):
+        """
+        Initialise an empty, invalid model.
+
+        Args:
+            verify_interval: seconds between checks against the browser
+        """
+        self.verify_interval = verify_interval
+        self.cell_types: list[str] = []
+        self.texts: list[str] = []
+        # If False, we don't know what the notebook looks like.
+        self.valid = False
+        self.last_verified = time.monotonic()
+        # Markdown cells whose text has changed but are not rendered yet.
+        self.unrendered: set[int] = set()
+        self.last_modified = time.monotonic()
+
+    @property
+    def ncells(self):
+        return len(self.cell_types)
+
+    def reset(self, cell_types: list[str], texts: list[str], rendered: list[bool]):
+        assert len(cell_types) == len(texts) == len(rendered)
+        self.cell_types = list(cell_types)
+        self.texts = list(texts)
+        self.valid = True
+        self.last_verified = time.monotonic()
+        # The browser may still show markdown cells edited before the reset.
+        self.unrendered = {
+            i
+            for i, (cell_type, is_rendered) in enumerate(zip(cell_types, rendered))
+            if cell_type == "markdown" and not is_rendered
+        }
+
+    def invalidate(self):
+        """Something went wrong (suspicion). Do not trust the model anymore."""
+        self.valid = False
+
+    def load_from_notebook(self, driver: Driver):
+        """Read the cell types, texts and rendered markdown cells from the browser."""
+        logger.info("Loading the notebook model from the browser")
+        cell_types, texts, rendered = execute_pinned_script(driver, "get_cell_inputs")
+        self.reset(cell_types, texts, rendered)
+
+    def needs_verification(self) -> bool:
+        return (
+            not self.valid
+            or time.monotonic() - self.last_verified >= self.verify_interval
+        )
+
+    def verify(self, driver: Driver) -> bool:
+        """
+        Check the model against the browser.
+
+        To keep it cheap, only the cell types and text lengths are compared.
+
+        Returns:
+            bool: False if the notebook has drifted from the model.
+        """
+        self.last_verified = time.monotonic()
+        summary = execute_pinned_script(driver, "get_cell_summary")
+        expected = [
+            [cell_type, _js_length(text)]
+            for cell_type, text in zip(self.cell_types, self.texts)
+        ]
+        if summary != expected:
+            logger.warning("Notebook has drifted from what Jupynium has sent.")
+            self.invalidate()
+            return False
+        return True
+
+    def is_synced(self, cell_idx: int, cell_type: str, text: str) -> bool:
+        """Whether the notebook cell already has this type and text."""
+        return (
+            self.valid
+            and cell_idx < self.ncells
+            and self.cell_types[cell_idx] == cell_type
+            and self.texts[cell_idx] == text
+        )
+
+    def apply_op(self, op: list[Any]):
+        """
+        Mirror an operation of apply_notebook_ops.js.
+
+        It is applied when the operation is added to the transaction,
+        so that the following operations can be compared against the model.
+        The transaction invalidates the model if the result disagrees.
+        """
+        if not self.valid:
+            return
+
+        name = op[0]
+        if name == "delete":
+            del self.cell_types[op[1]]
+            del self.texts[op[1]]
+            self.unrendered = {i - (i > op[1]) for i in self.unrendered if i != op[1]}
+        elif name == "insert":
+            self.cell_types.insert(op[1], op[2])
+            self.texts.insert(op[1], "")
+            self.unrendered = {i + (i >= op[1]) for i in self.unrendered}
+        elif name == "cell_type":
+            self.cell_types[op[1]] = op[2]
+            if op[2] == "markdown":
+                self.unrendered.add(op[1])
+            else:
+                self.unrendered.discard(op[1])
+        elif name == "resize":
+            num_new_cells = op[1] - self.ncells
+            if num_new_cells > 0:
+                self.cell_types.extend(["code"] * num_new_cells)
+                self.texts.extend([""] * num_new_cells)
+            else:
+                del self.cell_types[op[1] :]
+                del self.texts[op[1] :]
+                self.unrendered = {i for i in self.unrendered if i < op[1]}
+        elif name == "set_text":
+            self.texts[op[1] : op[1] + len(op[2])] = op[2]
+            self.unrendered.update(
+                i
+                for i in range(op[1], op[1] + len(op[2]))
+                if self.cell_types[i] == "markdown"
+            )
+            self.last_modified = time.monotonic()
+        elif name == "replace_lines":
+            lines = self.texts[op[1]].split("\n")
+            lines[op[2] : op[3]] = op[4]
+            self.texts[op[1]] = "\n".join(lines)
+            if self.cell_types[op[1]] == "markdown":
+                self.unrendered.add(op[1])
+            self.last_modified = time.monotonic()
+        elif name == "markdown_file":
+            self.cell_types[0] = "markdown"
+            self.texts[0] = op[1]
+            self.unrendered.add(0)
+            self.last_modified = time.monotonic()
+        elif name == "load":
+            self.cell_types = [cell_type for cell_type, _ in op[1]]
+            self.texts = [text for _, text in op[1]]
+            self.unrendered = {
+                i
+                for i, cell_type in enumerate(self.cell_types)
+                if cell_type == "markdown"
+            }
+            self.last_modified = time.monotonic()
+        elif name == "render":
+            self.unrendered.difference_update(op[1])
+
+    def check_ncells(self, ncells: int):
+        """Invalidate the model if the notebook doesn't have the expected cells."""
+        if self.valid and self.ncells != ncells:
+            logger.warning(
+                f"Notebook has {ncells} cells but Jupynium expected {self.ncells}."
+            )
+            self.invalidate()
@@ -2,14 +2,22 @@ from __future__ import annotations
 
 import contextlib
 import logging
+from collections import deque
 from dataclasses import dataclass, field
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
 from .buffer import JupyniumBuffer
+from .kernel_requests import KernelRequests
+from .pinned_scripts import install_pinned_scripts
+from .pynvim_helpers import EVENT_OPTION_VARS, RpcBatch
+from .window_tracking import open_window_handles
 
 if TYPE_CHECKING:
     import pynvim
-    from selenium.webdriver.remote.webdriver import WebDriver
+    from pynvim.msgpack_rpc.session import Notification
+
+    from .driver_protocol import Driver
+    from .nvim_reader import NvimReader
 
 logger = logging.getLogger(__name__)
 
@@ -23,50 +31,101 @@ class NvimInfo:
     jupbufs: dict[int, JupyniumBuffer] = field(default_factory=dict)  # key = buffer ID
     window_handles: dict[int, str] = field(default_factory=dict)  # key = buffer ID
     auto_close_tab: bool = True
+    # Receives the notifications in the background. If None, they are received
+    # from `nvim` like the requests.
+    reader: NvimReader | None = None
+    # Notifications taken from the reader but left for the next round,
+    # because the time budget has run out (see process_events()).
+    deferred_notifications: deque[Notification] = field(default_factory=deque)
+    # Monotonic time when events need to be processed even without any message
+    # (e.g. rendering markdown cells after idle time).
+    next_timer: float | None = None
+    # Calls to nvim batched per cycle of events.
+    rpc: RpcBatch = field(init=False, repr=False)
+    # Latest options sent by nvim (see get_option()).
+    options: dict[str, Any] | None = None
+    # Kernel completion / inspection waiting for the replies.
+    kernel_requests: KernelRequests = field(default_factory=KernelRequests)
+
+    def __post_init__(self):
+        self.rpc = RpcBatch(self.nvim, EVENT_OPTION_VARS)
+
+    def get_option(self, name: str, default: Any = None) -> Any:
+        """
+        Get an option (g: variable in EVENT_OPTION_VARS).
+
+        Nvim sends them when attached and whenever they change,
+        so we only ask nvim if they haven't arrived yet.
+        """
+        if self.options is None:
+            return self.rpc.get_var(name, default)
+        return self.options.get(name, default)
 
-    def attach_buffer(self, buf_id: int, content: list[str], window_handle: str):
+    def attach_buffer(
+        self,
+        buf_id: int,
+        content: list[str],
+        window_handle: str,
+        driver: Driver | None = None,
+    ):
+        """
+        Start syncing the buffer to the notebook in the window.
+
+        If driver is given, the scripts of the hot path are installed in the window
+        beforehand (see pinned_scripts).
+        """
         if buf_id in self.jupbufs or buf_id in self.window_handles:
             logger.warning(f"Buffer {buf_id} is already attached")
 
+        if driver is not None:
+            driver.switch_to.window(window_handle)
+            install_pinned_scripts(driver)
+
         self.jupbufs[buf_id] = JupyniumBuffer(content)
         self.window_handles[buf_id] = window_handle
 
-    def detach_buffer(self, buf_id: int, driver: WebDriver):
+    def detach_buffer(self, buf_id: int, driver: Driver):
         if buf_id in self.jupbufs:
             del self.jupbufs[buf_id]
         if buf_id in self.window_handles:
-            if (
-                self.auto_close_tab
-                and self.window_handles[buf_id] in driver.window_handles
-            ):
+            self.kernel_requests.forget_client(self.window_handles[buf_id])
+            if self.auto_close_tab and self.window_handles[
+                buf_id
+            ] in open_window_handles(driver):
                 driver.switch_to.window(self.window_handles[buf_id])
                 driver.close()
                 driver.switch_to.window(self.home_window)
             del self.window_handles[buf_id]
 
-    def check_window_alive_and_update(self, driver: WebDriver):
+    def check_window_alive_and_update(self, driver: Driver):
         detach_buffer_list = []
+        window_handles = open_window_handles(driver)
         for buf_id, window in self.window_handles.items():
-            if window not in driver.window_handles:
-                self.nvim.lua.Jupynium_notify.error(
+            if window not in window_handles:
+                self.rpc.call_lua(
+                    "Jupynium_notify.error",
                     [
                         "Notebook closed.",
                         f"Detaching the buffer {buf_id} from Jupynium..",
                     ],
                     "notebook_closed",
-                    async_=True,
                 )
-                self.nvim.lua.Jupynium_stop_sync(buf_id)
+                self.rpc.call_lua("Jupynium_stop_sync", buf_id)
                 detach_buffer_list.append(buf_id)
 
         for buf_id in detach_buffer_list:
             self.detach_buffer(buf_id, driver)
 
-    def close(self, driver: WebDriver):
+    def close(self, driver: Driver):
         with contextlib.suppress(Exception):
             # Even if you fail it's not a big problem
+            self.rpc.flush()
             self.nvim.lua.Jupynium_reset_channel(async_=True)
 
+        if self.reader is not None:
+            self.reader.close()
+        self.kernel_requests.close()
+
         for buf_id in list(self.jupbufs.keys()):
             self.detach_buffer(buf_id, driver)
 
@@ -0,0 +1,213 @@
+"""
+Read nvim's notifications in a background thread.
+
+Selenium calls can take seconds (e.g. rendering markdown, kernel completion),
+and nothing reads from nvim in the meantime.
+The reader receives the notifications on its own connection and coalesces them
+as they arrive, so the main thread always gets an already-compacted batch.
+
+Requests are still sent to the main connection. While nvim waits for a response,
+it only serves the channel it is waiting on, and processing a request may call nvim.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+import socket
+import threading
+from typing import TYPE_CHECKING
+
+from pynvim.msgpack_rpc.session import Notification
+
+from .events_control import SCROLL_EVENTS, SELECTION_EVENTS, OnLinesArgs
+from .pynvim_helpers import attach
+
+if TYPE_CHECKING:
+    from os import PathLike
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationQueue:
+    """
+    Notifications that haven't been processed yet, coalesced as they arrive.
+
+    Same as the lazy processing in process_events(): chainable on_lines of a buffer
+    become one, and only the latest cursor / visual selection (and scroll)
+    of a buffer is kept.
+    Any other event of the buffer stops the coalescing,
+    because the changes before it have to be processed first.
+    """
+
+    def __init__(self):
+        self.notifications: list[Notification] = []
+        # Number of notifications received, before coalescing.
+        self.num_received = 0
+        # key = buffer ID, value = index of the notification to coalesce with
+        self._last_on_lines: dict[int, int] = {}
+        self._last_selection: dict[int, int] = {}
+        self._last_scroll: dict[int, int] = {}
+
+    def append(self, notification: Notification):
+        self.num_received += 1
+        bufnr = notification.args[0]
+        if notification.name == "on_lines":
+            idx = self._last_on_lines.get(bufnr)
+            if idx is not None:
+                prev_on_lines = OnLinesArgs(*self.notifications[idx].args[1:])
+                on_lines = OnLinesArgs(*notification.args[1:])
+                if prev_on_lines.is_chainable(on_lines):
+                    chained = prev_on_lines.chain(on_lines)
+                    self.notifications[idx] = Notification(
+                        "notification",
+                        "on_lines",
+                        [
+                            bufnr,
+                            chained.lines,
+                            chained.start_row,
+                            chained.old_end_row,
+                            chained.new_end_row,
+                        ],
+                    )
+                    return
+            self._last_on_lines[bufnr] = len(self.notifications)
+        elif notification.name in SELECTION_EVENTS:
+            idx = self._last_selection.get(bufnr)
+            if idx is not None:
+                self.notifications[idx] = notification
+                return
+            self._last_selection[bufnr] = len(self.notifications)
+        elif notification.name in SCROLL_EVENTS:
+            idx = self._last_scroll.get(bufnr)
+            if idx is not None:
+                self.notifications[idx] = notification
+                return
+            self._last_scroll[bufnr] = len(self.notifications)
+        else:
+            self._last_on_lines.pop(bufnr, None)
+            self._last_selection.pop(bufnr, None)
+            self._last_scroll.pop(bufnr, None)
+
+        self.notifications.append(notification)
+
+    def __len__(self):
+        return len(self.notifications)
+
+
+class NvimReader:
+    """
+    Receive the notifications of an nvim in a background thread.
+
+    It has its own connection because pynvim is not thread-safe.
+    The thread starts right away.
+    Pass its channel_id to attach_and_init() so that nvim sends the notifications here.
+    The main thread waits on wakeup_sock and gets the notifications with take().
+    """
+
+    def __init__(self, nvim_listen_addr: str | PathLike):
+        self.nvim = attach(nvim_listen_addr)
+        self.channel_id: int = self.nvim.channel_id
+        self.disconnected = False
+
+        self._queue = NotificationQueue()
+        # Total number of notifications received (see wait_received()).
+        self._num_received = 0
+        self._cond = threading.Condition()
+        self._closing = False
+
+        # Readable while there are notifications to take, so that select() can wait.
+        # The thread only writes and the main thread only reads.
+        self.wakeup_sock, self._wakeup_write_sock = socket.socketpair()
+        self.wakeup_sock.settimeout(0.0)
+        self._wakeup_write_sock.settimeout(0.0)
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"jupynium-reader-{self.channel_id}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self):
+        while not self._closing:
+            try:
+                message = self.nvim.next_message()
+            except Exception:  # noqa: BLE001
+                logger.info("Nvim has closed the event channel.")
+                break
+            if message is None:
+                # Stopped by close()
+                break
+            if message.type != "notification":
+                logger.error(f"Unexpected request on the event channel: {message}")
+                message.response.send("Requests are not handled here", error=True)
+                continue
+
+            with self._cond:
+                if len(self._queue) == 0:
+                    self._wakeup()
+                self._queue.append(message)
+                self._num_received += 1
+                self._cond.notify_all()
+
+        with self._cond:
+            self.disconnected = True
+            self._wakeup()
+            self._cond.notify_all()
+        self._wakeup_write_sock.close()
+        with contextlib.suppress(Exception):
+            self.nvim.close()
+
+    def _wakeup(self):
+        with contextlib.suppress(OSError):
+            self._wakeup_write_sock.send(b"\0")
+
+    def has_pending(self) -> bool:
+        """Whether take() has something to return (or an error to raise)."""
+        with self._cond:
+            return len(self._queue) > 0 or self.disconnected
+
+    def take(self) -> tuple[list[Notification], int]:
+        """
+        Take all queued notifications.
+
+        Returns:
+            list[Notification]: coalesced notifications, in order
+            int: number of notifications received from nvim, before coalescing
+
+        Raises:
+            OSError: if nvim has disconnected and there is nothing left to take.
+        """
+        with self._cond:
+            with contextlib.suppress(BlockingIOError):
+                while self.wakeup_sock.recv(64):
+                    pass
+            queue = self._queue
+            if len(queue) == 0 and self.disconnected:
+                raise OSError("Nvim has disconnected")
+            self._queue = NotificationQueue()
+        return queue.notifications, queue.num_received
+
+    def wait_received(self, num_received: int, timeout: float = 1.0) -> bool:
+        """
+        Wait until `num_received` notifications have arrived since the start.
+
+        A request arrives on the main connection,
+        possibly before the notifications that nvim has sent before it.
+
+        Returns:
+            bool: False if it timed out.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._num_received >= num_received or self.disconnected,
+                timeout,
+            )
+
+    def close(self):
+        """Stop the thread, which closes the connection."""
+        self._closing = True
+        with contextlib.suppress(Exception):
+            self.nvim.async_call(self.nvim.stop_loop)
+        self.wakeup_sock.close()
@@ -0,0 +1,81 @@
+"""
+Scripts of the hot path, installed in each notebook tab and called by name.
+
+`execute_script` sends the whole script with every call, and the browser parses
+it every time. Instead, they are installed as functions in the tab once
+(see NvimInfo.attach_buffer()), and only the name and the arguments are sent.
+If the tab has lost them (e.g. reloaded), they are installed again automatically.
+"""
+
+from __future__ import annotations
+
+import logging
+from importlib.resources import files as resfiles
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .driver_protocol import Driver
+
+logger = logging.getLogger(__name__)
+
+
+# key = name, value = source (js/<name>.js).
+# Written for execute_script, e.g. `arguments` and top-level `return`,
+# which work the same in a function body.
+PINNED_SCRIPTS = {
+    name: (resfiles("jupynium") / "js" / f"{name}.js").read_text()
+    for name in (
+        "apply_notebook_ops",
+        "get_cell_inputs",
+        "get_cell_summary",
+        "update_cell_selection",
+        "kernel_request_start",
+        "kernel_request_collect",
+    )
+}
+
+# Returned when the scripts are not installed in the tab.
+NOT_INSTALLED = "jupynium_scripts_not_installed"
+
+# arguments: name, the script's arguments...
+call_pinned_script_js_code = f"""
+var scripts = window.jupynium_scripts
+if (scripts === undefined || !(arguments[0] in scripts)) {{
+  return {{"{NOT_INSTALLED}": true}}
+}}
+return scripts[arguments[0]].apply(null, Array.prototype.slice.call(arguments, 1))
+"""
+
+# arguments: {name: source}, name to call (or null), the script's arguments...
+install_pinned_scripts_js_code = """
+var sources = arguments[0]
+window.jupynium_scripts = {}
+for (var name in sources) {
+  window.jupynium_scripts[name] = new Function(sources[name])
+}
+if (arguments[1] !== null) {
+  return window.jupynium_scripts[arguments[1]].apply(
+    null, Array.prototype.slice.call(arguments, 2)
+  )
+}
+"""
+
+
+def install_pinned_scripts(driver: Driver):
+    """Install the scripts in the current window."""
+    driver.execute_script(install_pinned_scripts_js_code, PINNED_SCRIPTS, None)
+
+
+def execute_pinned_script(driver: Driver, name: str, *args) -> Any:
+    """
+    Same as `driver.execute_script(PINNED_SCRIPTS[name], *args)`.
+
+    It installs the scripts in the current window if needed.
+    """
+    result = driver.execute_script(call_pinned_script_js_code, name, *args)
+    if isinstance(result, dict) and result.get(NOT_INSTALLED):
+        logger.info("Installing the scripts in the notebook tab.")
+        result = driver.execute_script(
+            install_pinned_scripts_js_code, PINNED_SCRIPTS, name, *args
+        )
+    return result
@@ -3,19 +3,33 @@ from __future__ import annotations
 import logging
 import time
 from importlib.resources import files as resfiles
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
 import pynvim
 
+from .rpc_messages import grant_credits
+
 if TYPE_CHECKING:
+    from collections.abc import Iterable
     from os import PathLike
 
 logger = logging.getLogger(__name__)
 
+# Options read while processing events. Nvim sends them when attached and
+# whenever they change (see NvimInfo.get_option()).
+EVENT_OPTION_VARS = (
+    "jupynium_auto_download_ipynb",
+    "jupynium_autoscroll_enable",
+    "jupynium_autoscroll_mode",
+    "jupynium_autoscroll_focus",
+    "jupynium_autoscroll_cell_top_margin_percent",
+    "jupynium_markdown_render_idle_timeout",
+)
+
 
-def attach_and_init(nvim_listen_addr: str | PathLike):
+def attach(nvim_listen_addr: str | PathLike) -> pynvim.Nvim:
+    """Connect to nvim, retrying for a few seconds while it is starting."""
     nvim_listen_addr = str(nvim_listen_addr)
-    logger.info("nvim addr: %s", nvim_listen_addr)
     for _ in range(30):
         try:
             if ":" in nvim_listen_addr:
@@ -33,7 +47,22 @@ def attach_and_init(nvim_listen_addr: str | PathLike):
             break
     else:
         raise TimeoutError("Timeout while waiting for nvim to start")
+    return nvim
+
+
+def attach_and_init(
+    nvim_listen_addr: str | PathLike, event_channel_id: int | None = None
+):
+    """
+    Attach to nvim and load the Jupynium helpers.
 
+    Args:
+        nvim_listen_addr: TCP address (host:port) or socket path of nvim
+        event_channel_id: channel that nvim sends notifications to
+            (see NvimReader). If None, they are sent to this connection.
+    """
+    logger.info("nvim addr: %s", nvim_listen_addr)
+    nvim = attach(nvim_listen_addr)
     logger.info("nvim attached")
 
     # existing_channel_id = nvim.vars.get("jupynium_channel_id", None)
@@ -41,7 +70,11 @@ def attach_and_init(nvim_listen_addr: str | PathLike):
     logger.info("Initialising..")
     logger.info(f"Communicating with channel_id {nvim.channel_id}")
     nvim.vars["jupynium_channel_id"] = nvim.channel_id
-    nvim.vars["jupynium_num_pending_msgs"] = 0
+    if event_channel_id is not None:
+        logger.info(f"Receiving notifications with channel_id {event_channel_id}")
+    nvim.vars["jupynium_event_channel_id"] = (
+        -1 if event_channel_id is None else event_channel_id
+    )
     # Define helper functions
     # Must come at the beginning
     lua_code = (resfiles("jupynium") / "lua" / "defaults.lua").read_text()
@@ -62,6 +95,13 @@ def attach_and_init(nvim_listen_addr: str | PathLike):
     lua_code = (resfiles("jupynium") / "lua" / "cmp.lua").read_text()
     nvim.exec_lua(lua_code)
 
+    # Flow control: nvim can send this many messages before we process them.
+    # Afterwards, we grant as many credits as we consume.
+    grant_credits(nvim, nvim.vars.get("jupynium_num_max_msgs", 1000))
+
+    # Nvim sends the options now and whenever they change.
+    nvim.lua.Jupynium_watch_options(EVENT_OPTION_VARS, async_=True)
+
     nvim.lua.Jupynium_notify.info(
         [
             "Jupynium successfully attached and initialised.",
@@ -72,3 +112,67 @@ def attach_and_init(nvim_listen_addr: str | PathLike):
     )
 
     return nvim
+
+
+class RpcBatch:
+    """
+    Batch the calls to nvim during a cycle of events.
+
+    Each synchronous call is a round trip to nvim. Instead,
+    - the options are read together with one nvim_call_atomic when one is needed,
+      and cached until the end of the cycle.
+    - the calls that don't need a reply (e.g. notifications) are queued,
+      and sent with one asynchronous nvim_call_atomic at the end of the cycle.
+
+    Call nvim directly only where the reply is needed right away.
+    Flush before blocking on nvim (e.g. input()), so that the queued calls come first.
+    """
+
+    def __init__(self, nvim: pynvim.Nvim, var_names: Iterable[str] = ()):
+        self.nvim = nvim
+        self.var_names = tuple(var_names)
+        self._vars: dict[str, Any] = {}
+        self._fetched_var_names: set[str] = set()
+        self._calls: list[list[Any]] = []
+
+    def get_var(self, name: str, default: Any = None) -> Any:
+        """Read a global variable (g:), or the default if it's not set."""
+        if name not in self._fetched_var_names:
+            if len(self._fetched_var_names) == 0:
+                self._fetch_vars([name, *(n for n in self.var_names if n != name)])
+            else:
+                self._fetch_vars([name])
+        return self._vars.get(name, default)
+
+    def _fetch_vars(self, names: list[str]):
+        self._fetched_var_names.update(names)
+        while len(names) > 0:
+            results, error = self.nvim.request(
+                "nvim_call_atomic", [["nvim_get_var", [name]] for name in names]
+            )
+            self._vars.update(zip(names, results))
+            if error is None:
+                break
+            # The variable is not set, and nvim stops at the first error.
+            names = names[error[0] + 1 :]
+
+    def call_lua(self, function: str, *args: Any):
+        """
+        Queue a call to a global Lua function, without waiting for the result.
+
+        Args:
+            function: name of the function, e.g. "Jupynium_notify.info"
+            *args: arguments of the function
+        """
+        # With pcall, an error doesn't stop the rest of the batch.
+        self._calls.append(["nvim_exec_lua", [f"pcall({function}, ...)", list(args)]])
+
+    def flush(self):
+        """Send the queued calls, and forget the options read in this cycle."""
+        self._vars.clear()
+        self._fetched_var_names.clear()
+        if len(self._calls) == 0:
+            return
+        calls = self._calls
+        self._calls = []
+        self.nvim.request("nvim_call_atomic", calls, async_=True)
@@ -3,9 +3,13 @@ from __future__ import annotations
 import logging
 from typing import TYPE_CHECKING
 
+import pynvim
+
 if TYPE_CHECKING:
     from pynvim import Nvim
 
+    from .pynvim_helpers import RpcBatch
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,18 +18,24 @@ def len_pending_messages(nvim: Nvim):
 
 
 def receive_message(nvim: Nvim):
-    event = nvim.next_message()
+    return nvim.next_message()
+
 
-    # This value is not strictly accurate.
-    # It is correct most of the time, but when you send too many messages at once
-    # (e.g. change visual selection using mouse) it can be wrong
-    # (smaller than the actual number)
-    # It is only here to detect bloated state (too many messages)
-    nvim.vars["jupynium_num_pending_msgs"] = max(
-        nvim.vars.get("jupynium_num_pending_msgs", 0) - 1, 0
-    )
+def grant_credits(nvim: Nvim | RpcBatch, num_credits: int):
+    """
+    Allow nvim to send more messages, without waiting for a response.
+
+    Nvim uses a credit per message. Without credits, it queues the messages and
+    coalesces buffer changes until we grant more. Grant the number of consumed
+    messages once per cycle of events, not per message.
 
-    return event
+    Args:
+        nvim: With an RpcBatch, the credits are sent with the batch.
+    """
+    if isinstance(nvim, pynvim.Nvim):
+        nvim.lua.Jupynium_grant_credits(num_credits, async_=True)
+    else:
+        nvim.call_lua("Jupynium_grant_credits", num_credits)
 
 
 def receive_all_pending_messages(nvim: Nvim):
@@ -38,6 +48,8 @@ def receive_all_pending_messages(nvim: Nvim):
     while len_pending_messages(nvim) > 0:
         events.append(receive_message(nvim))
 
+    if len(events) > 0:
+        grant_credits(nvim, len(events))
     return events
 
 
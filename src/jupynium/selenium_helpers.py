@@ -6,18 +6,20 @@ from typing import TYPE_CHECKING
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
+
+from .driver_protocol import driver_wait
+from .window_tracking import open_window_handles
 
 if TYPE_CHECKING:
-    from selenium.webdriver.remote.webdriver import WebDriver
+    from .driver_protocol import Driver
 
 logger = logging.getLogger(__name__)
 
 
-def wait_until_notebook_loaded(driver: WebDriver, timeout: int = 30):
+def wait_until_notebook_loaded(driver: Driver, timeout: int = 30):
     """Wait until the Jupyter Notebook is loaded."""
     try:
-        WebDriverWait(driver, timeout).until(
+        driver_wait(driver, timeout).until(
             EC.presence_of_element_located((By.ID, "notebook-container"))
         )
     except TimeoutException:
@@ -25,7 +27,7 @@ def wait_until_notebook_loaded(driver: WebDriver, timeout: int = 30):
         driver.quit()
 
     try:
-        WebDriverWait(driver, timeout).until(
+        driver_wait(driver, timeout).until(
             # Sometimes if kernel is null, it will hang, so we check that.
             lambda d: (
                 d.execute_script("return Jupyter.notebook.kernel == null") is False
@@ -36,7 +38,7 @@ def wait_until_notebook_loaded(driver: WebDriver, timeout: int = 30):
         driver.quit()
 
     try:
-        WebDriverWait(driver, timeout).until(
+        driver_wait(driver, timeout).until(
             # Sometimes if kernel is null, it will hang, so we check that.
             lambda d: (
                 d.execute_script("return Jupyter.notebook.kernel.is_connected()")
@@ -48,10 +50,10 @@ def wait_until_notebook_loaded(driver: WebDriver, timeout: int = 30):
         driver.quit()
 
 
-def wait_until_notebook_list_loaded(driver: WebDriver, timeout: int = 10):
+def wait_until_notebook_list_loaded(driver: Driver, timeout: int = 10):
     """Wait until the Jupyter Notebook home page (list of files) is loaded."""
     try:
-        WebDriverWait(driver, timeout).until(
+        driver_wait(driver, timeout).until(
             EC.presence_of_element_located(
                 (By.CSS_SELECTOR, "#notebook_list > div > div > a > span")
             )
@@ -61,10 +63,10 @@ def wait_until_notebook_list_loaded(driver: WebDriver, timeout: int = 10):
         driver.quit()
 
 
-def wait_until_loaded(driver: WebDriver, timeout: int = 10):
+def wait_until_loaded(driver: Driver, timeout: int = 10):
     """Wait until the page is ready."""
     try:
-        WebDriverWait(driver, timeout).until(
+        driver_wait(driver, timeout).until(
             lambda d: d.execute_script("return document.readyState") == "complete"
         )
     except TimeoutException:
@@ -73,20 +75,20 @@ def wait_until_loaded(driver: WebDriver, timeout: int = 10):
 
 
 def wait_until_new_window(
-    driver: WebDriver, current_handles: list[str], timeout: int = 10
+    driver: Driver, current_handles: list[str], timeout: int = 10
 ):
     """Wait until the page is ready."""
     try:
-        WebDriverWait(driver, timeout).until(EC.new_window_is_opened(current_handles))
+        driver_wait(driver, timeout).until(EC.new_window_is_opened(current_handles))
     except TimeoutException:
         logger.exception("Timed out waiting for a new window to open")
         driver.quit()
 
 
-def is_browser_disconnected(driver: WebDriver):
+def is_browser_disconnected(driver: Driver):
     """Check if the browser is disconnected."""
     try:
-        _ = driver.window_handles
+        _ = open_window_handles(driver)
     except Exception:  # noqa: BLE001
         return True
     return False
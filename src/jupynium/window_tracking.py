@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Any
+
+from selenium.common.exceptions import NoSuchWindowException
+
+if TYPE_CHECKING:
+    from collections.abc import Collection, Sequence
+
+    from .driver_protocol import Driver, Element
+
+logger = logging.getLogger(__name__)
+
+
+class _TrackedSwitchTo:
+    """`driver.switch_to` that skips switching to the window it is already on."""
+
+    def __init__(self, tracked_driver: WindowTrackingDriver):
+        self._tracked_driver = tracked_driver
+
+    def window(self, window_name: str) -> None:
+        tracked_driver = self._tracked_driver
+        if window_name == tracked_driver.known_window_handle:
+            return
+        # If it fails, we don't know where we are.
+        tracked_driver.known_window_handle = None
+        try:
+            tracked_driver.driver.switch_to.window(window_name)
+        except NoSuchWindowException:
+            # Some windows have been closed.
+            tracked_driver.expire_window_handles()
+            raise
+        tracked_driver.known_window_handle = window_name
+        if tracked_driver.window_handles_snapshot is not None:
+            tracked_driver.window_handles_snapshot.add(window_name)
+
+    def new_window(self, type_hint: str | None = None) -> None:
+        self._tracked_driver.known_window_handle = None
+        self._tracked_driver.expire_window_handles()
+        self._tracked_driver.driver.switch_to.new_window(type_hint)
+
+
+class WindowTrackingDriver:
+    """
+    WebDriver that remembers which window it is on.
+
+    Every `driver.switch_to.window()` is a round trip to the browser
+    (and Firefox may do focus work), even if it is already on that window,
+    which is the case most of the time with one synced notebook.
+    Here, redundant switches are skipped, and `current_window_handle` is answered
+    without asking the browser.
+
+    The window only changes through this object (the user clicking on a tab
+    doesn't change the WebDriver's window), so the tracking stays correct.
+    The other commands are forwarded to the wrapped driver.
+
+    It also keeps a snapshot of the open windows for the liveness checks
+    (see open_window_handles()).
+    """
+
+    def __init__(self, driver: Driver):
+        self.driver = driver
+        # None if unknown (e.g. after closing the window, or a failed switch)
+        self.known_window_handle: str | None = None
+        self.switch_to = _TrackedSwitchTo(self)
+        # None if it needs to be fetched again.
+        self.window_handles_snapshot: set[str] | None = None
+
+    def open_window_handles(self) -> set[str]:
+        """
+        Window handles, fetched at most once until expire_window_handles().
+
+        Checking whether the notebook tabs are still open takes a round trip per
+        check, for every synced buffer of every nvim. Instead, they all share one
+        snapshot per iteration of the event loop.
+        Only use it for such checks, and use `window_handles` to find new windows.
+        """
+        if self.window_handles_snapshot is None:
+            self.window_handles_snapshot = set(self.driver.window_handles)
+        return self.window_handles_snapshot
+
+    def expire_window_handles(self):
+        self.window_handles_snapshot = None
+
+    @property
+    def current_window_handle(self) -> str:
+        if self.known_window_handle is None:
+            self.known_window_handle = self.driver.current_window_handle
+        return self.known_window_handle
+
+    @property
+    def window_handles(self) -> list[str]:
+        return self.driver.window_handles
+
+    def execute_script(self, script: str, *args) -> Any:
+        return self.driver.execute_script(script, *args)
+
+    def execute_async_script(self, script: str, *args) -> Any:
+        return self.driver.execute_async_script(script, *args)
+
+    def find_element(self, by: str, value: str) -> Element:
+        return self.driver.find_element(by, value)
+
+    def find_elements(self, by: str, value: str) -> Sequence[Element]:
+        return self.driver.find_elements(by, value)
+
+    def get(self, url: str) -> None:
+        self.driver.get(url)
+
+    def get_cookies(self) -> list[dict]:
+        return self.driver.get_cookies()
+
+    def close(self) -> None:
+        if (
+            self.window_handles_snapshot is not None
+            and self.known_window_handle is not None
+        ):
+            self.window_handles_snapshot.discard(self.known_window_handle)
+        else:
+            self.expire_window_handles()
+        self.known_window_handle = None
+        self.driver.close()
+
+    def quit(self) -> None:
+        self.known_window_handle = None
+        self.expire_window_handles()
+        self.driver.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.quit()
+
+
+def open_window_handles(driver: Driver) -> Collection[str]:
+    """
+    Window handles for the liveness checks (see WindowTrackingDriver).
+
+    Other drivers are simply asked.
+    """
+    if isinstance(driver, WindowTrackingDriver):
+        return driver.open_window_handles()
+    return driver.window_handles
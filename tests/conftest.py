@@ -8,6 +8,138 @@ import pytest
 
 from jupynium import pynvim_helpers
 from jupynium.buffer import JupyniumBuffer
+from jupynium.pinned_scripts import call_pinned_script_js_code
+from jupynium.rpc_messages import grant_credits, receive_message
+
+
+class FakeNotebookDriver:
+    """
+    Minimal stand-in for the WebDriver, simulating a Jupyter Notebook in python.
+
+    Only understands apply_notebook_ops.js and the scripts reading the cells
+    (called by name, see pinned_scripts), and counts the execute_script calls.
+    """
+
+    def __init__(self, num_cells: int = 1):
+        self.cells = [{"cell_type": "code", "text": ""} for _ in range(num_cells)]
+        self.num_execute_script = 0
+        self.num_texts_set = 0
+        self.num_lines_replaced = 0
+        self.num_cells_rendered = 0
+
+    def _insert(self, cell_idx: int, cell_type: str = "code"):
+        self.cells.insert(cell_idx, {"cell_type": cell_type, "text": ""})
+
+    def _unrender(self, cell_idx: int):
+        # Markdown cells show their source until rendered.
+        if self.cells[cell_idx]["cell_type"] == "markdown":
+            self.cells[cell_idx]["rendered"] = False
+        else:
+            self.cells[cell_idx].pop("rendered", None)
+
+    def _render(self, cell_indices: list[int]):
+        self.num_cells_rendered += len(cell_indices)
+        for cell_idx in cell_indices:
+            self.cells[cell_idx].pop("rendered", None)
+
+    def execute_script(self, script: str, *args):
+        self.num_execute_script += 1
+        assert script == call_pinned_script_js_code
+        name, *args = args
+        if name == "get_cell_inputs":
+            rendered = [cell.get("rendered", True) for cell in self.cells]
+            return [self.cell_types, self.texts, rendered]
+        if name == "get_cell_summary":
+            return [[cell["cell_type"], len(cell["text"])] for cell in self.cells]
+
+        assert name == "apply_notebook_ops"
+        for op in args[0]:
+            name, *op_args = op
+            if name == "delete":
+                del self.cells[op_args[0]]
+            elif name == "insert":
+                self._insert(op_args[0], op_args[1])
+            elif name == "cell_type":
+                self.cells[op_args[0]]["cell_type"] = op_args[1]
+                self._unrender(op_args[0])
+            elif name == "resize":
+                while len(self.cells) < op_args[0]:
+                    self._insert(len(self.cells))
+                del self.cells[op_args[0] :]
+            elif name == "expect_ncells":
+                if len(self.cells) != op_args[0]:
+                    return len(self.cells)
+            elif name == "set_text":
+                self.num_texts_set += len(op_args[1])
+                for i, text in enumerate(op_args[1]):
+                    self.cells[op_args[0] + i]["text"] = text
+                    self._unrender(op_args[0] + i)
+            elif name == "replace_lines":
+                cell_lines = self.cells[op_args[0]]["text"].split("\n")
+                cell_lines[op_args[1] : op_args[2]] = op_args[3]
+                self.cells[op_args[0]]["text"] = "\n".join(cell_lines)
+                self._unrender(op_args[0])
+                self.num_lines_replaced += len(op_args[3])
+            elif name == "markdown_file":
+                self.cells[0] = {"cell_type": "markdown", "text": op_args[0]}
+                self._unrender(0)
+            elif name == "load":
+                outputs = {}
+                for cell in self.cells:
+                    key = (cell["cell_type"], cell["text"])
+                    outputs.setdefault(key, []).append(cell.get("outputs"))
+                self.cells = []
+                for cell_type, text in op_args[0]:
+                    self.cells.append({"cell_type": cell_type, "text": text})
+                    self._unrender(len(self.cells) - 1)
+                    matches = outputs.get((cell_type, text))
+                    if matches:
+                        self.cells[-1]["outputs"] = matches.pop(0)
+                self.num_texts_set += len(op_args[0])
+            elif name == "render":
+                self._render(op_args[0])
+            else:
+                raise ValueError(f"Unknown op {name}")
+        return len(self.cells)
+
+    @property
+    def cell_types(self):
+        return [cell["cell_type"] for cell in self.cells]
+
+    @property
+    def texts(self):
+        return [cell["text"] for cell in self.cells]
+
+
+@pytest.fixture
+def fake_driver():
+    return FakeNotebookDriver()
+
+
+class FakeNvim:
+    """Records the nvim_call_atomic requests, and serves nvim_get_var from a dict."""
+
+    def __init__(self, variables=None):
+        self.variables = {} if variables is None else variables
+        self.requests = []
+
+    def request(self, method, calls, *, async_=False):
+        assert method == "nvim_call_atomic"
+        self.requests.append((calls, async_))
+        results = []
+        for idx, (name, args) in enumerate(calls):
+            if name == "nvim_get_var":
+                if args[0] not in self.variables:
+                    return [results, [idx, 0, f"Key not found: {args[0]}"]]
+                results.append(self.variables[args[0]])
+            else:
+                results.append(None)
+        return [results, None]
+
+
+@pytest.fixture
+def fake_nvim():
+    return FakeNvim()
 
 
 @pytest.fixture(scope="session")
@@ -24,6 +156,10 @@ def nvim_1():
         )
         # os.system(f"nvim --clean --headless --listen {path} &")
         nvim = pynvim_helpers.attach_and_init(path)
+        # Nvim sends the options right after attaching.
+        event = receive_message(nvim)
+        assert event.name == "options"
+        grant_credits(nvim, 1)
 
         yield nvim
 
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import random
+
 import pytest
 
-from jupynium.buffer import JupyniumBuffer
+from jupynium.buffer import JupyniumBuffer, _diff_lines
 
 
 def test_buffer_1():
@@ -256,3 +258,295 @@ def test_on_lines_content(
 
     final_buf = JupyniumBuffer(final_content)
     assert buffer == final_buf
+
+
+def _random_line(rng: random.Random):
+    return rng.choice(["# %%", "# %% [md]", "# %% [markdown]", "a", "# b", '"""', ""])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_on_lines_row_index(seed):
+    """
+    The incrementally updated row index should agree with a full re-analysis.
+    """
+    rng = random.Random(seed)
+    buffer = JupyniumBuffer([_random_line(rng) for _ in range(50)])
+    for _ in range(200):
+        start_row = rng.randint(0, buffer.num_rows)
+        old_end_row = rng.randint(start_row, min(start_row + 3, buffer.num_rows))
+        lines = [_random_line(rng) for _ in range(rng.randint(0, 3))]
+        if start_row == old_end_row == buffer.num_rows and len(lines) == 0:
+            continue
+        buffer._on_lines_update_buf(
+            lines, start_row, old_end_row, start_row + len(lines)
+        )
+        buffer._check_validity()
+
+        fully_analysed_buf = JupyniumBuffer(list(buffer.buf))
+        assert buffer.num_rows_per_cell == fully_analysed_buf.num_rows_per_cell
+        for row in range(buffer.num_rows):
+            assert buffer.get_cell_index_from_row(
+                row
+            ) == buffer.get_cell_index_from_row(row, buffer.num_rows_per_cell)
+
+
+def test_full_sync_to_notebook(fake_driver):
+    buffer = JupyniumBuffer(["a", "# %%", "b", "# %% [md]", "# c", "# %%", "# %time"])
+    buffer.full_sync_to_notebook(fake_driver)
+    assert fake_driver.cell_types == ["code", "markdown", "code"]
+    assert fake_driver.texts == ["b", "c", "%time"]
+    # Read the notebook, then apply the differences
+    assert fake_driver.num_execute_script == 2
+
+
+def test_full_sync_only_changed_cells(fake_driver):
+    content = ["header"]
+    for i in range(2000):
+        content.extend(["# %% [md]" if i % 2 else "# %%", f"# line {i}"])
+    buffer = JupyniumBuffer(content)
+    buffer.full_sync_to_notebook(fake_driver)
+    assert fake_driver.num_texts_set == 2000
+
+    # e.g. after grab_entire_buf
+    content[2] = "changed 0"
+    content[1000] = "# changed"
+    content[3999] = "# %%"
+    shadow = buffer.shadow
+    buffer = JupyniumBuffer(content)
+    buffer.shadow = shadow
+    fake_driver.num_execute_script = 0
+    fake_driver.num_texts_set = 0
+    buffer.full_sync_to_notebook(fake_driver)
+    assert fake_driver.num_execute_script == 1
+    assert fake_driver.num_texts_set == 3
+    assert fake_driver.cell_types == buffer.cell_types[1:]
+    assert fake_driver.texts == buffer.get_cells_text(1, buffer.num_cells - 1)
+
+
+@pytest.mark.parametrize(
+    "content,lines,start_row,old_end_row,new_end_row",
+    [
+        (["a", "# %%", "b", "c"], ["bb"], 2, 3, 3),
+        (["a", "# %%", "b", "c"], ["# %% [md]", "d"], 3, 3, 5),
+        (["a", "# %%", "b", "# %%", "c"], [], 3, 4, 3),
+        (["a", "# %%", "b", "# %%", "c"], ["# %% [md]"], 3, 4, 4),
+    ],
+)
+def test_process_on_lines_single_round_trip(
+    fake_driver, content, lines, start_row, old_end_row, new_end_row
+):
+    buffer = JupyniumBuffer(content)
+    buffer.full_sync_to_notebook(fake_driver)
+    fake_driver.num_execute_script = 0
+
+    buffer.process_on_lines(
+        fake_driver,
+        strip=True,
+        lines=lines,
+        start_row=start_row,
+        old_end_row=old_end_row,
+        new_end_row=new_end_row,
+    )
+    assert fake_driver.num_execute_script == 1
+
+    expected = JupyniumBuffer(list(buffer.buf))
+    assert fake_driver.cell_types == expected.cell_types[1:]
+    assert fake_driver.texts == expected.get_cells_text(1, expected.num_cells - 1)
+
+
+def test_process_on_lines_ncells_mismatch(fake_driver):
+    buffer = JupyniumBuffer(["a", "# %%", "b", "# %%", "c"])
+    buffer.full_sync_to_notebook(fake_driver)
+    # Someone deleted a cell in the browser
+    del fake_driver.cells[0]
+    buffer.process_on_lines(
+        fake_driver, strip=True, lines=["cc"], start_row=4, old_end_row=5, new_end_row=5
+    )
+    assert fake_driver.texts == ["b", "cc"]
+
+
+def test_shadow_mirrors_notebook(fake_driver):
+    buffer = JupyniumBuffer(["a", "# %%", "b", "# %% [md]", "c"])
+    assert not buffer.shadow.valid
+    buffer.full_sync_to_notebook(fake_driver)
+    assert buffer.shadow.valid
+
+    for lines, start_row, old_end_row, new_end_row in [
+        (["# %%", "d"], 5, 5, 7),
+        ([], 1, 3, 1),
+        (["# %% [md]", "e", "# %%"], 0, 0, 3),
+    ]:
+        buffer.process_on_lines(
+            fake_driver,
+            strip=True,
+            lines=lines,
+            start_row=start_row,
+            old_end_row=old_end_row,
+            new_end_row=new_end_row,
+        )
+        assert buffer.shadow.valid
+        assert buffer.shadow.cell_types == fake_driver.cell_types
+        assert buffer.shadow.texts == fake_driver.texts
+
+
+def test_shadow_verify_drift(fake_driver):
+    buffer = JupyniumBuffer(["a", "# %%", "b", "# %%", "c"])
+    buffer.full_sync_to_notebook(fake_driver)
+    assert buffer.shadow.verify(fake_driver)
+
+    # Someone edited a cell in the browser. Same number of cells.
+    fake_driver.cells[0]["text"] = "modified"
+    buffer.shadow.verify_interval = 0
+    buffer.process_on_lines(
+        fake_driver, strip=True, lines=["cc"], start_row=4, old_end_row=5, new_end_row=5
+    )
+    # Drift detected and fixed with a full sync
+    assert buffer.shadow.valid
+    assert fake_driver.texts == ["b", "cc"]
+
+
+def test_shadow_load_on_suspicion(fake_driver):
+    fake_driver.cells = [
+        {"cell_type": "markdown", "text": "x"},
+        {"cell_type": "code", "text": "y"},
+    ]
+    buffer = JupyniumBuffer(["a", "# %% [md]", "x", "# %%", "y"])
+    buffer.process_on_lines(
+        fake_driver, strip=True, lines=["z"], start_row=4, old_end_row=5, new_end_row=5
+    )
+    assert buffer.shadow.valid
+    assert buffer.shadow.texts == ["x", "z"] == fake_driver.texts
+
+
+@pytest.mark.parametrize(
+    "old_lines,new_lines,expected",
+    [
+        (["a", "b", "c"], ["a", "b", "c"], (3, 3, 3)),
+        (["a", "b", "c"], ["a", "x", "c"], (1, 2, 2)),
+        (["a", "b", "c"], ["a", "c"], (1, 2, 1)),
+        (["a", "b"], ["a", "b", "b"], (2, 2, 3)),
+        (["a", "b"], ["x", "y"], (0, 2, 2)),
+        ([""], ["", ""], (1, 1, 2)),
+    ],
+)
+def test_diff_lines(old_lines, new_lines, expected):
+    assert _diff_lines(old_lines, new_lines) == expected
+
+
+def test_partial_sync_replace_lines(fake_driver):
+    content = ["header", "# %%", *(f"x = {i}" for i in range(500)), "# %% [md]", "# a"]
+    buffer = JupyniumBuffer(content)
+    buffer.full_sync_to_notebook(fake_driver)
+    fake_driver.num_texts_set = 0
+
+    for lines, start_row, old_end_row, new_end_row in [
+        (["y = 1"], 100, 101, 101),
+        (["y = 2", "y = 3"], 2, 2, 4),
+        ([], 400, 404, 400),
+        (["z = 1"], 499, 499, 500),
+        (["# a", "# c"], 502, 503, 504),
+    ]:
+        buffer.process_on_lines(
+            fake_driver,
+            strip=True,
+            lines=lines,
+            start_row=start_row,
+            old_end_row=old_end_row,
+            new_end_row=new_end_row,
+        )
+        assert fake_driver.texts == buffer.get_cells_text(1, buffer.num_cells - 1)
+        assert buffer.shadow.texts == fake_driver.texts
+
+    assert fake_driver.num_texts_set == 0
+    assert fake_driver.num_lines_replaced == 5
+
+
+def test_deferred_markdown_render(fake_driver):
+    buffer = JupyniumBuffer(["a", "# %% [md]", "# b", "# %%", "c", "# %% [md]", "# d"])
+    buffer.full_sync_to_notebook(fake_driver)
+    assert buffer.shadow.unrendered == {0, 2}
+    assert fake_driver.num_cells_rendered == 0
+
+    buffer.render_markdown_cells(fake_driver)
+    assert buffer.shadow.unrendered == set()
+    assert fake_driver.num_cells_rendered == 2
+
+    # Editing a markdown cell doesn't render it
+    buffer.process_on_lines(
+        fake_driver,
+        strip=True,
+        lines=["# dd"],
+        start_row=6,
+        old_end_row=7,
+        new_end_row=7,
+    )
+    assert buffer.shadow.unrendered == {2}
+    # Inserting a cell above shifts the unrendered cell
+    buffer.process_on_lines(
+        fake_driver,
+        strip=True,
+        lines=["# %%", "e"],
+        start_row=1,
+        old_end_row=1,
+        new_end_row=3,
+    )
+    assert buffer.shadow.unrendered == {3}
+    assert fake_driver.num_cells_rendered == 2
+
+    # The cell being edited is not rendered
+    buffer.render_markdown_cells(fake_driver, except_cell_idx=3)
+    assert fake_driver.num_cells_rendered == 2
+    buffer.render_markdown_cells(fake_driver, except_cell_idx=0)
+    assert fake_driver.num_cells_rendered == 3
+    assert buffer.shadow.unrendered == set()
+
+
+def test_full_sync_load_keeps_outputs(fake_driver):
+    buffer = JupyniumBuffer(["", "# %%", "a", "# %%", "b"])
+    buffer.full_sync_to_notebook(fake_driver)
+    assert fake_driver.num_execute_script == 2
+    fake_driver.cells[0]["outputs"] = ["output a"]
+    fake_driver.cells[1]["outputs"] = ["output b"]
+
+    # A cell inserted above: the cells don't line up by index anymore.
+    buffer = JupyniumBuffer(["", "# %%", "new", "# %%", "a", "# %% [md]", "b"])
+    buffer.shadow.invalidate()
+    buffer.full_sync_to_notebook(fake_driver)
+    assert fake_driver.cell_types == ["code", "code", "markdown"]
+    assert fake_driver.texts == ["new", "a", "b"]
+    assert [cell.get("outputs") for cell in fake_driver.cells] == [
+        None,
+        ["output a"],
+        None,
+    ]
+    assert buffer.shadow.texts == fake_driver.texts
+
+
+def test_render_markdown_after_reload(fake_driver):
+    buffer = JupyniumBuffer(["a", "# %% [md]", "# b", "# %%", "c"])
+    buffer.full_sync_to_notebook(fake_driver)
+    buffer.render_markdown_cells(fake_driver)
+    assert fake_driver.num_cells_rendered == 1
+
+    # Edited, but not rendered yet
+    buffer.process_on_lines(
+        fake_driver,
+        strip=True,
+        lines=["# bb"],
+        start_row=2,
+        old_end_row=3,
+        new_end_row=3,
+    )
+    assert buffer.shadow.unrendered == {0}
+
+    # The model is reloaded from the browser (e.g. after a suspicion)
+    buffer.shadow.invalidate()
+    buffer.process_on_lines(
+        fake_driver, strip=True, lines=["cc"], start_row=4, old_end_row=5, new_end_row=5
+    )
+    assert buffer.shadow.valid
+    assert buffer.shadow.unrendered == {0}
+
+    buffer.render_markdown_cells(fake_driver)
+    assert fake_driver.num_cells_rendered == 2
+    assert buffer.shadow.unrendered == set()
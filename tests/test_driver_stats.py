@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+from jupynium.driver_stats import CommandStats, InstrumentedDriver, handler
+
+
+class FakeDriver:
+    def __init__(self):
+        self.windows = ["w1", "w2"]
+        self.current_window = "w1"
+        self.switch_to = SimpleNamespace(window=self._switch)
+
+    def _switch(self, window_handle):
+        self.current_window = window_handle
+
+    @property
+    def window_handles(self):
+        return list(self.windows)
+
+    def execute_script(self, script, *args):
+        return args
+
+    def quit(self):
+        pass
+
+
+def test_instrumented_driver_counts_per_handler():
+    stats = CommandStats()
+    driver = InstrumentedDriver(FakeDriver(), stats=stats)
+
+    assert driver.execute_script("return arguments", 1, 2) == (1, 2)
+    with handler("on_lines"):
+        driver.switch_to.window("w2")
+        driver.execute_script("")
+        driver.execute_script("")
+        with handler("update_cell_selection"):
+            driver.execute_script("")
+    assert driver.window_handles == ["w1", "w2"]
+    # Not a command
+    driver.quit()
+    assert driver.driver.current_window == "w2"
+
+    assert {key: stat.count for key, stat in stats.stats.items()} == {
+        ("main", "execute_script"): 1,
+        ("on_lines", "switch_to.window"): 1,
+        ("on_lines", "execute_script"): 2,
+        ("update_cell_selection", "execute_script"): 1,
+        ("main", "window_handles"): 1,
+    }
+    assert stats.total().count == 6
+    assert stats.by_command()["execute_script"].count == 4
+    assert stats.by_handler()["on_lines"].count == 3
+
+    summary = stats.summary()
+    assert "on_lines: switch_to.window" in summary
+
+    stats.reset()
+    assert stats.total().count == 0
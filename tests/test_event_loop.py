@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import socket
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from jupynium.event_loop import (
+    AttachListener,
+    EventWaiter,
+    notify_attach,
+    nvim_socket,
+)
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX"), reason="Unix sockets are not supported"
+)
+
+
+def test_event_waiter_timeout(tmp_path):
+    attach_listener = AttachListener(tmp_path / "wakeup.sock")
+    event_waiter = EventWaiter(attach_listener)
+
+    start = time.monotonic()
+    ready, attach_requested = event_waiter.wait({}, 0.1)
+    assert time.monotonic() - start >= 0.09
+    assert ready == set()
+    assert not attach_requested
+    attach_listener.close()
+
+
+def test_event_waiter_attach(tmp_path):
+    path = tmp_path / "wakeup.sock"
+    attach_listener = AttachListener(path)
+    event_waiter = EventWaiter(attach_listener)
+
+    notify_attach(path)
+    notify_attach(path)
+    start = time.monotonic()
+    ready, attach_requested = event_waiter.wait({}, None)
+    assert time.monotonic() - start < 1
+    assert ready == set()
+    assert attach_requested
+
+    # All wake-ups have been consumed
+    _, attach_requested = event_waiter.wait({}, 0)
+    assert not attach_requested
+
+    attach_listener.close()
+    assert not path.exists()
+    # Nobody is listening
+    notify_attach(path)
+
+
+def test_nvim_socket_without_pynvim_internals():
+    sock = socket.socket()
+    transport = SimpleNamespace(get_extra_info={"socket": sock}.get)
+    nvim = SimpleNamespace(
+        _session=SimpleNamespace(
+            _async_session=SimpleNamespace(loop=SimpleNamespace(_transport=transport))
+        )
+    )
+    assert nvim_socket(nvim) is sock
+    sock.close()
+
+    # e.g. another pynvim release: polled instead.
+    assert nvim_socket(SimpleNamespace(_session=SimpleNamespace())) is None
@@ -3,7 +3,11 @@ from __future__ import annotations
 import time
 from typing import TYPE_CHECKING
 
-from jupynium.rpc_messages import receive_all_pending_messages, receive_message
+from jupynium.rpc_messages import (
+    grant_credits,
+    receive_all_pending_messages,
+    receive_message,
+)
 
 if TYPE_CHECKING:
     from pynvim import Nvim
@@ -11,7 +15,7 @@ if TYPE_CHECKING:
 
 def test_event_default_variables(nvim_1: Nvim):
     assert nvim_1.vars["jupynium_channel_id"] > 0
-    assert nvim_1.vars["jupynium_num_pending_msgs"] == 0
+    assert nvim_1.lua.Jupynium_num_pending_msgs() == 0
 
 
 def test_event_before_start_sync(nvim_1: Nvim):
@@ -22,13 +26,14 @@ def test_event_before_start_sync(nvim_1: Nvim):
     nvim_1.feedkeys(
         nvim_1.replace_termcodes("<esc>", from_part=True, do_lt=True, special=True)
     )
-    assert nvim_1.vars["jupynium_num_pending_msgs"] == 0
+    assert nvim_1.lua.Jupynium_num_pending_msgs() == 0
 
 
 def test_event_start_sync_cancel(nvim_1: Nvim):
     nvim_1.lua.Jupynium_start_sync(async_=True)
-    assert nvim_1.vars["jupynium_num_pending_msgs"] == 1
+    assert nvim_1.lua.Jupynium_num_pending_msgs() == 1
     event = receive_message(nvim_1)
+    grant_credits(nvim_1, 1)
     assert event is not None
     assert event[0] == "request"
     assert event[1] == "start_sync"
@@ -41,13 +46,14 @@ def test_event_start_sync_cancel(nvim_1: Nvim):
     nvim_1.feedkeys(
         nvim_1.replace_termcodes("<esc>", from_part=True, do_lt=True, special=True)
     )
-    assert nvim_1.vars["jupynium_num_pending_msgs"] == 0
+    assert nvim_1.lua.Jupynium_num_pending_msgs() == 0
 
 
 def test_event_start_sync(nvim_1: Nvim):
     nvim_1.lua.Jupynium_start_sync(async_=True)
-    assert nvim_1.vars["jupynium_num_pending_msgs"] == 1
+    assert nvim_1.lua.Jupynium_num_pending_msgs() == 1
     event = receive_message(nvim_1)
+    grant_credits(nvim_1, 1)
     assert event is not None
     assert event[0] == "request"
     assert event[1] == "start_sync"
@@ -61,7 +67,7 @@ def test_event_start_sync(nvim_1: Nvim):
         nvim_1.replace_termcodes("<esc>", from_part=True, do_lt=True, special=True)
     )
 
-    assert nvim_1.vars["jupynium_num_pending_msgs"] > 0
+    assert nvim_1.lua.Jupynium_num_pending_msgs() > 0
 
     count_cursormoved_i = 0
 
@@ -78,8 +84,9 @@ def test_event_start_sync(nvim_1: Nvim):
 
 def test_event_stop_sync(nvim_1: Nvim):
     nvim_1.lua.Jupynium_stop_sync(async_=True)
-    assert nvim_1.vars["jupynium_num_pending_msgs"] == 1
+    assert nvim_1.lua.Jupynium_num_pending_msgs() == 1
     event = receive_message(nvim_1)
+    grant_credits(nvim_1, 1)
     assert event is not None
     assert event[0] == "notification"
     assert event[1] == "stop_sync"
@@ -92,4 +99,4 @@ def test_event_stop_sync(nvim_1: Nvim):
         nvim_1.replace_termcodes("<esc>", from_part=True, do_lt=True, special=True)
     )
 
-    assert nvim_1.vars["jupynium_num_pending_msgs"] == 0
+    assert nvim_1.lua.Jupynium_num_pending_msgs() == 0
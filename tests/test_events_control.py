@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import random
+import time
+
+from pynvim.msgpack_rpc.session import Notification
+
+from jupynium.buffer import JupyniumBuffer
+from jupynium.events_control import (
+    OnLinesArgs,
+    PrevLazyArgsPerBuf,
+    drop_superseded_events,
+    group_events_by_window,
+    process_notification_event,
+    process_reader_notifications,
+    schedule_events,
+)
+from jupynium.nvim import NvimInfo
+
+
+def apply_on_lines(lines: list[str], on_lines: OnLinesArgs) -> list[str]:
+    assert len(on_lines.lines) == on_lines.new_end_row - on_lines.start_row
+    return lines[: on_lines.start_row] + on_lines.lines + lines[on_lines.old_end_row :]
+
+
+def random_on_lines(rng: random.Random, lines: list[str]) -> OnLinesArgs:
+    start_row = rng.randint(0, len(lines))
+    old_end_row = rng.randint(start_row, min(start_row + 3, len(lines)))
+    new_lines = [f"line {rng.random():.3f}" for _ in range(rng.randint(0, 3))]
+    return OnLinesArgs(new_lines, start_row, old_end_row, start_row + len(new_lines))
+
+
+def test_on_lines_merge():
+    rng = random.Random(0)
+    for _ in range(200):
+        base_lines = [f"base {i}" for i in range(rng.randint(0, 20))]
+        lines = base_lines
+        merged = None
+        for _ in range(rng.randint(1, 6)):
+            on_lines = random_on_lines(rng, lines)
+            lines = apply_on_lines(lines, on_lines)
+            merged = on_lines if merged is None else merged.merge(on_lines, base_lines)
+            assert merged is not None
+
+        assert merged is not None
+        assert apply_on_lines(base_lines, merged) == lines
+
+
+def test_on_lines_merge_minimal_range():
+    base_lines = [str(i) for i in range(10)]
+    # Two substitutions (e.g. :s) on rows 2 and 5
+    first = OnLinesArgs(["a"], 2, 3, 3)
+    second = OnLinesArgs(["b"], 5, 6, 6)
+    assert first.merge(second, base_lines) == OnLinesArgs(["a", "3", "4", "b"], 2, 6, 6)
+    # Out of range
+    assert first.merge(OnLinesArgs([], 10, 11, 10), base_lines) is None
+
+
+class FakeReader:
+    def __init__(self, notifications):
+        self.notifications = notifications
+
+    def take(self):
+        notifications = self.notifications
+        self.notifications = []
+        return notifications, len(notifications)
+
+
+def test_process_reader_notifications_deadline(fake_nvim):
+    notifications = [
+        Notification("notification", "options", [0, {"jupynium_autoscroll_mode": i}])
+        for i in range(3)
+    ]
+    nvim_info = NvimInfo(fake_nvim, "home", reader=FakeReader(notifications))
+
+    # Out of time. Only one is processed and the rest are left for the next round.
+    status, num_received = process_reader_notifications(
+        nvim_info, None, PrevLazyArgsPerBuf(), deadline=time.monotonic()
+    )
+    assert status
+    assert num_received == 3
+    assert nvim_info.get_option("jupynium_autoscroll_mode") == 0
+    assert list(nvim_info.deferred_notifications) == notifications[1:]
+
+    status, num_received = process_reader_notifications(
+        nvim_info, None, PrevLazyArgsPerBuf()
+    )
+    assert status
+    assert num_received == 0
+    assert nvim_info.get_option("jupynium_autoscroll_mode") == 2
+    assert len(nvim_info.deferred_notifications) == 0
+
+
+def notification(name, *args):
+    return Notification("notification", name, list(args))
+
+
+def test_schedule_events():
+    events = [
+        notification("on_lines", 1, ["a"], 0, 1, 1),
+        notification("CursorMovedI", 1, 0, 0),
+        notification("execute_selected_cells", 2),
+        notification("on_lines", 1, ["ab"], 0, 1, 1),
+        notification("scroll_to_cell", 1, 0),
+        notification("kernel_complete_async", 1, "ab", 2, 1, "nvim-cmp"),
+        notification("CursorMoved", 2, 3, 3),
+        notification("kernel_complete_async", 2, "x", 1, 2, "nvim-cmp"),
+    ]
+    # Completion moves ahead of the selection / scroll and the other buffer's events,
+    # but not past its buffer's text changes or the other completion.
+    assert schedule_events(events) == [
+        events[0],
+        events[1],
+        events[2],
+        events[3],
+        events[5],
+        events[7],
+        events[4],
+        events[6],
+    ]
+
+
+def test_drop_superseded_events():
+    events = [
+        notification("kernel_complete_async", 1, "a", 1, 1, "nvim-cmp"),
+        notification("scroll_to_cell", 1, 0),
+        notification("on_lines", 1, ["ab"], 0, 1, 1),
+        notification("kernel_complete_async", 2, "x", 1, 2, "nvim-cmp"),
+        notification("scroll_to_output", 1, 0),
+        notification("kernel_complete_async", 1, "ab", 2, 3, "nvim-cmp"),
+    ]
+    assert drop_superseded_events(events) == [
+        events[2],
+        events[3],
+        events[4],
+        events[5],
+    ]
+
+
+def test_group_events_by_window():
+    events = [
+        notification("on_lines", 1, ["a"], 0, 1, 1),
+        notification("on_lines", 2, ["x"], 0, 1, 1),
+        notification("CursorMovedI", 1, 0, 0),
+        notification("execute_selected_cells", 2),
+        notification("options", 0, {}),
+        notification("CursorMoved", 1, 1, 1),
+        notification("CursorMoved", 2, 1, 1),
+    ]
+    window_handles = {1: "w1", 2: "w2"}
+    assert group_events_by_window(events, window_handles) == [
+        events[0],
+        events[2],
+        events[1],
+        events[3],
+        events[4],
+        events[5],
+        events[6],
+    ]
+    # No need to switch for the current window.
+    assert group_events_by_window(events, window_handles, "w2") == [
+        events[1],
+        events[3],
+        events[0],
+        events[2],
+        events[4],
+        events[6],
+        events[5],
+    ]
+
+
+def test_grab_entire_buf_overwrites_browser_edits(fake_nvim, fake_driver):
+    content = ["a", "# %%", "b", "# %%", "c"]
+    nvim_info = NvimInfo(fake_nvim, "home")
+    nvim_info.jupbufs[1] = JupyniumBuffer(content)
+    nvim_info.window_handles[1] = "w1"
+    fake_driver.current_window_handle = "w1"
+    nvim_info.jupbufs[1].full_sync_to_notebook(fake_driver)
+
+    # Edited in the browser, and the model hasn't been verified since.
+    fake_driver.cells[0]["text"] = "x"
+    process_notification_event(
+        nvim_info, fake_driver, notification("grab_entire_buf", 1, content)
+    )
+    assert fake_driver.texts == ["b", "c"]
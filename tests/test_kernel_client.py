@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+import queue
+import secrets
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+import websocket
+
+from jupynium.kernel_client import KernelClient, kernel_channels_url
+
+
+def test_kernel_channels_url():
+    assert (
+        kernel_channels_url("http://localhost:8888/", "abc")
+        == "ws://localhost:8888/api/kernels/abc/channels"
+    )
+    assert (
+        kernel_channels_url("https://example.com/nbclassic/", "abc", "t0ken")
+        == "wss://example.com/nbclassic/api/kernels/abc/channels?token=t0ken"
+    )
+
+
+class FakeWebSocket:
+    """Frames to receive are put in `frames`."""
+
+    def __init__(self):
+        self.frames: queue.Queue = queue.Queue()
+        self.sent = []
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self):
+        return self.frames.get()
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("frame", ["", "not json"])
+def test_kernel_client_closed_by_server(monkeypatch, frame):
+    ws = FakeWebSocket()
+    monkeypatch.setattr(websocket, "create_connection", lambda *args, **kwargs: ws)
+    client = KernelClient("http://localhost:8888/", "abc")
+
+    future = client.complete("pri", 3)
+    ws.frames.put(frame)
+    # Pending requests fail instead of waiting for their deadline.
+    with pytest.raises(ConnectionError):
+        future.result(timeout=5)
+    assert client.closed
+    with pytest.raises(ConnectionError):
+        client.complete("pri", 3)
+
+
+@pytest.fixture
+def jupyter_server():
+    """Start a local Jupyter server, and yield its URL and token."""
+    pytest.importorskip("jupyter_server")
+    pytest.importorskip("ipykernel")
+
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+    token = secrets.token_urlsafe(16)
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "jupyter_server",
+            "--no-browser",
+            "--allow-root",
+            f"--port={port}",
+            f"--IdentityProvider.token={token}",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    server_url = f"http://localhost:{port}/"
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(f"{server_url}api/status?token={token}")
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield server_url, token
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def test_kernel_client(jupyter_server):
+    server_url, token = jupyter_server
+    request = urllib.request.Request(
+        f"{server_url}api/kernels?token={token}", data=b"{}", method="POST"
+    )
+    with urllib.request.urlopen(request) as response:
+        kernel_id = json.load(response)["id"]
+
+    client = KernelClient(server_url, kernel_id, token=token)
+    try:
+        reply = client.complete("pri", 3).result(timeout=30)
+        assert reply["status"] == "ok"
+        assert "print" in reply["matches"]
+
+        reply = client.inspect("print", 5).result(timeout=30)
+        assert reply["status"] == "ok"
+        assert reply["found"]
+    finally:
+        client.close()
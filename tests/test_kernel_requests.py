@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from jupynium.kernel_requests import KernelRequest, KernelRequests
+from jupynium.pinned_scripts import call_pinned_script_js_code
+
+
+class FakeKernelDriver:
+    """Keeps the started requests per window, and the kernel replies on demand."""
+
+    def __init__(self):
+        self.current_window = None
+        self.started: dict[str, dict[int, tuple]] = {}
+        self.replies: dict[str, dict[int, dict | None]] = {}
+        self.switch_to = SimpleNamespace(window=self._switch)
+
+    def _switch(self, window_handle):
+        self.current_window = window_handle
+
+    def execute_script(self, script, *args):
+        window = self.current_window
+        assert script == call_pinned_script_js_code
+        name, *args = args
+        if name == "kernel_request_start":
+            request_id, *request = args
+            self.started.setdefault(window, {})[request_id] = tuple(request)
+            return None
+        assert name == "kernel_request_collect"
+        replies = self.replies.setdefault(window, {})
+        return [
+            [request_id, replies.pop(request_id)]
+            for request_id in args[0]
+            if request_id in replies
+        ]
+
+    def reply(self, window, request_id, content):
+        del self.started[window][request_id]
+        self.replies.setdefault(window, {})[request_id] = content
+
+
+def test_kernel_requests_collect():
+    driver = FakeKernelDriver()
+    kernel_requests = KernelRequests()
+
+    inspect = KernelRequest("kernel_inspect", 1, "w1")
+    complete = KernelRequest("kernel_complete_async", 2, "w2", callback_id="0x1")
+    kernel_requests.start(driver, inspect, "inspect", "print", 3)
+    kernel_requests.start(driver, complete, "complete", "pri", 3)
+    assert driver.started["w1"][inspect.request_id] == ("inspect", "print", 3, 5000)
+    assert len(kernel_requests) == 2
+
+    # Nothing has arrived yet
+    assert kernel_requests.collect(driver, ["w1", "w2"]) == []
+    assert len(kernel_requests) == 2
+
+    driver.reply("w2", complete.request_id, {"matches": ["print"]})
+    assert kernel_requests.collect(driver, ["w1", "w2"]) == [
+        (complete, {"matches": ["print"]})
+    ]
+
+    # Tab closed
+    assert kernel_requests.collect(driver, ["w2"]) == [(inspect, None)]
+    assert len(kernel_requests) == 0
+
+
+def test_kernel_requests_superseded_completion():
+    driver = FakeKernelDriver()
+    kernel_requests = KernelRequests()
+
+    old = KernelRequest("kernel_complete_async", 1, "w1", callback_id="0x1")
+    new = KernelRequest("kernel_complete_async", 1, "w1", callback_id="0x2")
+    kernel_requests.start(driver, old, "complete", "pr", 2)
+    kernel_requests.start(driver, new, "complete", "pri", 3)
+
+    driver.reply("w1", old.request_id, {"matches": ["print", "property"]})
+    driver.reply("w1", new.request_id, {"matches": ["print"]})
+    assert kernel_requests.collect(driver, ["w1"]) == [(new, {"matches": ["print"]})]
+    assert len(kernel_requests) == 0
+
+
+class FakeKernelClient:
+    closed = False
+
+    def __init__(self):
+        self.futures = []
+
+    def complete(self, code, cursor_pos):
+        self.futures.append(Future())
+        return self.futures[-1]
+
+
+def test_kernel_requests_with_kernel_client():
+    driver = FakeKernelDriver()
+    kernel_requests = KernelRequests(use_kernel_client=True)
+    client = FakeKernelClient()
+    kernel_requests.clients["w1"] = client
+
+    request = KernelRequest("kernel_complete_async", 1, "w1", callback_id="0x1")
+    kernel_requests.start(driver, request, "complete", "pri", 3)
+    # Not through the browser
+    assert driver.started == {}
+
+    assert kernel_requests.collect(driver, ["w1"]) == []
+    client.futures[0].set_result({"matches": ["print"]})
+    assert kernel_requests.collect(driver, ["w1"]) == [
+        (request, {"matches": ["print"]})
+    ]
+    assert driver.current_window is None
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from jupynium.line_store import LineStore
+
+
+def test_line_store_list_like():
+    store = LineStore(["a", "b", "c", "d", "e"], chunk_size=2)
+    assert len(store) == 5
+    assert store == ["a", "b", "c", "d", "e"]
+    assert store[0] == "a"
+    assert store[-1] == "e"
+    assert store[1:4] == ["b", "c", "d"]
+    store.append("f")
+    store[2] = "C"
+    del store[0]
+    assert list(store) == ["b", "C", "d", "e", "f"]
+    assert "\n".join(store) == "b\nC\nd\ne\nf"
+
+    with pytest.raises(IndexError):
+        store[5]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_line_store_replace(seed):
+    rng = random.Random(seed)
+    reference = [str(i) for i in range(100)]
+    store = LineStore(reference, chunk_size=8)
+    for i in range(500):
+        start = rng.randint(0, len(reference))
+        end = rng.randint(start, min(start + 40, len(reference)))
+        lines = [f"{i}-{j}" for j in range(rng.randint(0, 40))]
+        reference[start:end] = lines
+        store.replace(start, end, lines)
+
+        assert len(store) == len(reference)
+        assert store == reference
+        start = rng.randint(0, len(reference))
+        end = rng.randint(start, len(reference))
+        assert store.get_lines(start, end) == reference[start:end]
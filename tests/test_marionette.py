@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import json
+import socket
+import threading
+
+import pytest
+from selenium.common.exceptions import NoSuchWindowException
+from selenium.webdriver.common.by import By
+
+from jupynium.marionette import (
+    ELEMENT_KEY,
+    FirefoxProcess,
+    MarionetteConnection,
+    MarionetteDriver,
+    MarionetteElement,
+)
+
+
+class FakeMarionette:
+    """Answers Marionette commands on a local socket, and records them."""
+
+    def __init__(self):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.commands = []
+        self.windows = ["w1", "w2"]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _send(self, conn, message):
+        data = json.dumps(message).encode()
+        conn.sendall(f"{len(data)}:".encode() + data)
+
+    def _serve(self):
+        conn, _ = self.server.accept()
+        file = conn.makefile("rb")
+        self._send(conn, {"applicationType": "gecko", "marionetteProtocol": 3})
+        while True:
+            length = b""
+            while (char := file.read(1)) != b":":
+                if not char:
+                    return
+                length += char
+            _, msg_id, name, parameters = json.loads(file.read(int(length)))
+            self.commands.append((name, parameters))
+            error, result = self.handle(name, parameters)
+            self._send(conn, [1, msg_id, error, result])
+
+    def handle(self, name, parameters):  # noqa: PLR0911
+        if name == "WebDriver:NewSession":
+            return None, {"sessionId": "s1", "capabilities": {}}
+        if name == "WebDriver:GetWindowHandles":
+            return None, self.windows
+        if name == "WebDriver:SwitchToWindow":
+            if parameters["handle"] not in self.windows:
+                return {
+                    "error": "no such window",
+                    "message": "",
+                    "stacktrace": "",
+                }, None
+            return None, {"value": None}
+        if name == "WebDriver:ExecuteScript":
+            return None, {"value": parameters["args"]}
+        if name == "WebDriver:FindElement":
+            return None, {"value": {ELEMENT_KEY: "e1"}}
+        if name == "WebDriver:GetElementText":
+            return None, {"value": "Untitled.ipynb"}
+        return None, {"value": None}
+
+
+def test_marionette_driver():
+    marionette = FakeMarionette()
+    driver = MarionetteDriver(MarionetteConnection("127.0.0.1", marionette.port))
+
+    assert driver.window_handles == ["w1", "w2"]
+    driver.switch_to.window("w2")
+    with pytest.raises(NoSuchWindowException):
+        driver.switch_to.window("w3")
+
+    assert driver.execute_script("return arguments", 1, [2, "a"]) == [1, [2, "a"]]
+
+    notebook_item = driver.find_element(By.ID, "notebook_list")
+    notebook_elem = notebook_item.find_element(By.CSS_SELECTOR, "a > span")
+    assert notebook_elem == MarionetteElement(driver, "e1")
+    assert notebook_elem.text == "Untitled.ipynb"
+    # Elements are sent as references, and come back as elements.
+    assert driver.execute_script("", notebook_elem) == [notebook_elem]
+    notebook_elem.click()
+
+    assert marionette.commands[-5:] == [
+        ("WebDriver:FindElement", {"using": "id", "value": "notebook_list"}),
+        (
+            "WebDriver:FindElement",
+            {"using": "css selector", "value": "a > span", "element": "e1"},
+        ),
+        ("WebDriver:GetElementText", {"id": "e1"}),
+        ("WebDriver:ExecuteScript", {"script": "", "args": [{ELEMENT_KEY: "e1"}]}),
+        ("WebDriver:ElementClick", {"id": "e1"}),
+    ]
+    driver.quit()
+
+
+def test_firefox_process_profile(tmp_path):
+    user_js = tmp_path / "user.js"
+    user_js.write_text('user_pref("browser.startup.page", 3);\n')
+
+    firefox = FirefoxProcess(
+        tmp_path, {"browser.link.open_newwindow": 3}, firefox_binary="firefox"
+    )
+    assert firefox.profile_path == tmp_path
+    firefox.write_profile()
+    assert user_js.read_text() == (
+        'user_pref("browser.startup.page", 3);\n\n'
+        'user_pref("browser.link.open_newwindow", 3);\n'
+        f'user_pref("marionette.port", {firefox.port});\n'
+    )
+
+    firefox.stop()
+    assert user_js.read_text() == 'user_pref("browser.startup.page", 3);\n'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["user.js"]
+
+
+def test_firefox_process_profile_without_user_js(tmp_path):
+    firefox = FirefoxProcess(tmp_path, firefox_binary="firefox")
+    firefox.write_profile()
+    assert (tmp_path / "user.js").exists()
+
+    # Killed without restoring. The next start restores it first.
+    firefox = FirefoxProcess(tmp_path, firefox_binary="firefox")
+    firefox.write_profile()
+    assert (tmp_path / "user.js").read_text() == (
+        f'user_pref("marionette.port", {firefox.port});\n'
+    )
+    firefox.stop()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_firefox_process_temporary_profile():
+    firefox = FirefoxProcess(firefox_binary="firefox")
+    firefox.write_profile()
+    assert (firefox.profile_path / "user.js").exists()
+    firefox.stop()
+    assert not firefox.profile_path.exists()
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from pynvim.msgpack_rpc.session import Notification
+
+from jupynium.events_control import process_notification_event
+from jupynium.nvim import NvimInfo
+from jupynium.pynvim_helpers import EVENT_OPTION_VARS
+
+
+def test_get_option(fake_nvim):
+    fake_nvim.variables = dict.fromkeys(EVENT_OPTION_VARS, 0)
+    fake_nvim.variables["jupynium_autoscroll_mode"] = "invisible"
+    nvim_info = NvimInfo(fake_nvim, "home")
+
+    # Before nvim sends the options, they are read from nvim.
+    assert nvim_info.get_option("jupynium_autoscroll_mode", "always") == "invisible"
+    assert len(fake_nvim.requests) == 1
+    nvim_info.rpc.flush()
+
+    process_notification_event(
+        nvim_info,
+        None,
+        Notification(
+            "notification", "options", [0, {"jupynium_autoscroll_mode": "always"}]
+        ),
+    )
+    assert nvim_info.get_option("jupynium_autoscroll_mode") == "always"
+    assert nvim_info.get_option("jupynium_autoscroll_focus", "input") == "input"
+    assert len(fake_nvim.requests) == 1
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from pynvim.msgpack_rpc.session import Notification
+
+from jupynium.nvim_reader import NotificationQueue
+
+
+def notification(name, *args):
+    return Notification("notification", name, list(args))
+
+
+def test_notification_queue_chain_on_lines():
+    queue = NotificationQueue()
+    queue.append(notification("on_lines", 1, ["a"], 3, 4, 4))
+    queue.append(notification("CursorMovedI", 1, 3, 3))
+    queue.append(notification("on_lines", 1, ["ab"], 3, 4, 4))
+    queue.append(notification("on_lines", 2, ["x"], 0, 0, 1))
+    queue.append(notification("CursorMovedI", 1, 3, 3))
+    queue.append(notification("on_lines", 1, ["abc", ""], 3, 4, 5))
+
+    assert queue.num_received == 6
+    assert queue.notifications == [
+        notification("on_lines", 1, ["abc", ""], 3, 4, 5),
+        notification("CursorMovedI", 1, 3, 3),
+        notification("on_lines", 2, ["x"], 0, 0, 1),
+    ]
+
+
+def test_notification_queue_not_chainable():
+    queue = NotificationQueue()
+    queue.append(notification("on_lines", 1, ["a"], 3, 4, 4))
+    queue.append(notification("on_lines", 1, ["b"], 7, 8, 8))
+    queue.append(notification("on_lines", 1, ["c"], 7, 8, 8))
+
+    assert queue.notifications == [
+        notification("on_lines", 1, ["a"], 3, 4, 4),
+        notification("on_lines", 1, ["c"], 7, 8, 8),
+    ]
+
+
+def test_notification_queue_other_events_stop_coalescing():
+    queue = NotificationQueue()
+    queue.append(notification("on_lines", 1, ["a"], 3, 4, 4))
+    queue.append(notification("visual_enter", 1, 5, 3))
+    queue.append(notification("execute_selected_cells", 1))
+    queue.append(notification("on_lines", 1, ["ab"], 3, 4, 4))
+    queue.append(notification("visual_leave", 1, 5, 5))
+    queue.append(notification("CursorMoved", 1, 6, 6))
+
+    assert queue.num_received == 6
+    assert queue.notifications == [
+        notification("on_lines", 1, ["a"], 3, 4, 4),
+        notification("visual_enter", 1, 5, 3),
+        notification("execute_selected_cells", 1),
+        notification("on_lines", 1, ["ab"], 3, 4, 4),
+        notification("CursorMoved", 1, 6, 6),
+    ]
+
+
+def test_notification_queue_keep_latest_scroll():
+    queue = NotificationQueue()
+    queue.append(notification("scroll_to_cell", 1, 3))
+    queue.append(notification("CursorMoved", 1, 3, 3))
+    queue.append(notification("scroll_to_output", 1, 5))
+    queue.append(notification("scroll_to_cell", 2, 1))
+
+    assert queue.notifications == [
+        notification("scroll_to_output", 1, 5),
+        notification("CursorMoved", 1, 3, 3),
+        notification("scroll_to_cell", 2, 1),
+    ]
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from jupynium.pinned_scripts import (
+    NOT_INSTALLED,
+    PINNED_SCRIPTS,
+    call_pinned_script_js_code,
+    execute_pinned_script,
+    install_pinned_scripts,
+    install_pinned_scripts_js_code,
+)
+
+
+class FakeTabDriver:
+    """A tab that runs the installed scripts by returning their name and args."""
+
+    def __init__(self):
+        self.installed = None
+        self.scripts_sent = []
+
+    def execute_script(self, script, *args):
+        self.scripts_sent.append(script)
+        if script == install_pinned_scripts_js_code:
+            self.installed = dict(args[0])
+            name, *args = args[1:]
+            if name is None:
+                return None
+        else:
+            assert script == call_pinned_script_js_code
+            name, *args = args
+            if self.installed is None:
+                return {NOT_INSTALLED: True}
+        assert name in self.installed
+        return [name, *args]
+
+    def reload(self):
+        self.installed = None
+
+
+def test_execute_pinned_script():
+    driver = FakeTabDriver()
+    install_pinned_scripts(driver)
+    assert driver.installed == PINNED_SCRIPTS
+
+    assert execute_pinned_script(driver, "get_cell_summary") == ["get_cell_summary"]
+    assert driver.scripts_sent[-1] == call_pinned_script_js_code
+
+    # Installed again after the page is reloaded.
+    driver.reload()
+    num_scripts_sent = len(driver.scripts_sent)
+    assert execute_pinned_script(driver, "update_cell_selection", 1, 2) == [
+        "update_cell_selection",
+        1,
+        2,
+    ]
+    assert driver.scripts_sent[num_scripts_sent:] == [
+        call_pinned_script_js_code,
+        install_pinned_scripts_js_code,
+    ]
+    assert execute_pinned_script(driver, "get_cell_inputs") == ["get_cell_inputs"]
+    assert driver.scripts_sent[-1] == call_pinned_script_js_code
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from jupynium.pynvim_helpers import RpcBatch
+from jupynium.rpc_messages import grant_credits
+
+
+def test_rpc_batch_get_var(fake_nvim):
+    nvim = fake_nvim
+    nvim.variables = {"a": 1, "c": 3}
+    rpc = RpcBatch(nvim, ["a", "b", "c"])
+
+    assert rpc.get_var("c") == 3
+    # All options are read at once.
+    assert len(nvim.requests) == 1
+    assert rpc.get_var("a") == 1
+    assert rpc.get_var("b", "default") == "default"
+    assert len(nvim.requests) == 1
+
+    # Not a prefetched option
+    assert rpc.get_var("d", 4) == 4
+    assert len(nvim.requests) == 2
+
+    # Options are read again in the next cycle.
+    rpc.flush()
+    nvim.variables["a"] = 10
+    assert rpc.get_var("a") == 10
+    # nvim stops at "b" which is not set, and the rest are read again.
+    assert len(nvim.requests) == 4
+    assert rpc.get_var("c") == 3
+    assert len(nvim.requests) == 4
+
+
+def test_rpc_batch_call_lua(fake_nvim):
+    nvim = fake_nvim
+    rpc = RpcBatch(nvim)
+
+    rpc.flush()
+    assert nvim.requests == []
+
+    rpc.call_lua("Jupynium_notify.info", ["hello"], "code")
+    grant_credits(rpc, 3)
+    assert nvim.requests == []
+
+    rpc.flush()
+    assert nvim.requests == [
+        (
+            [
+                [
+                    "nvim_exec_lua",
+                    ["pcall(Jupynium_notify.info, ...)", [["hello"], "code"]],
+                ],
+                ["nvim_exec_lua", ["pcall(Jupynium_grant_credits, ...)", [3]]],
+            ],
+            True,
+        )
+    ]
+
+    rpc.flush()
+    assert len(nvim.requests) == 1
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+from jupynium.window_tracking import WindowTrackingDriver, open_window_handles
+
+
+class FakeWindowDriver:
+    def __init__(self):
+        self.current_window_handle = "home"
+        self.handles = ["home"]
+        self.num_switches = 0
+        self.num_window_handles = 0
+        self.switch_to = SimpleNamespace(window=self._switch)
+
+    def _switch(self, window_name):
+        self.num_switches += 1
+        self.current_window_handle = window_name
+
+    def close(self):
+        self.handles.remove(self.current_window_handle)
+        self.current_window_handle = None
+
+    @property
+    def window_handles(self):
+        self.num_window_handles += 1
+        return list(self.handles)
+
+
+def test_window_tracking_driver():
+    fake_driver = FakeWindowDriver()
+    driver = WindowTrackingDriver(fake_driver)
+
+    assert driver.current_window_handle == "home"
+    driver.switch_to.window("home")
+    assert fake_driver.num_switches == 0
+
+    fake_driver.handles.append("w1")
+    driver.switch_to.window("w1")
+    driver.switch_to.window("w1")
+    assert fake_driver.num_switches == 1
+    assert driver.current_window_handle == "w1"
+
+    driver.close()
+    driver.switch_to.window("w1")
+    assert fake_driver.num_switches == 2
+
+    # Forwarded to the driver
+    assert driver.window_handles == ["home"]
+
+
+def test_open_window_handles_snapshot():
+    fake_driver = FakeWindowDriver()
+    fake_driver.handles.extend(["w1", "w2"])
+    driver = WindowTrackingDriver(fake_driver)
+
+    assert open_window_handles(driver) == {"home", "w1", "w2"}
+    assert open_window_handles(driver) == {"home", "w1", "w2"}
+    assert fake_driver.num_window_handles == 1
+
+    # Closed by Jupynium
+    driver.switch_to.window("w1")
+    driver.close()
+    assert open_window_handles(driver) == {"home", "w2"}
+    assert fake_driver.num_window_handles == 1
+
+    # Closed by the user, noticed in the next iteration.
+    fake_driver.handles.remove("w2")
+    driver.expire_window_handles()
+    assert open_window_handles(driver) == {"home"}
+    assert fake_driver.num_window_handles == 2